@@ -0,0 +1,25 @@
+"""
+A small MAIC analysis shared by the tests of the engines, solvers and
+collectors. It is kept out of the test modules so that importing it does not
+import (and make pytest collect again) another module's tests
+"""
+from cross_validation import build_cross_validation
+from entitylist_builder import EntityListBuilder
+
+TEST_LINES = [
+    "CAT1\tList1\tRANKED\tX\tA\tB\tC\tD\tE\tF\tG\tH",
+    "CAT1\tList2\tUNRANKED\tX\tB\tA\tI\tJ",
+    "CAT2\tList3\tRANKED\tX\tC\tA\tK\tL\tM\tB\tN\tO",
+    "CAT2\tList4\tUNRANKED\tX\tA\tP",
+    "CAT3\tList5\tUNRANKED\tX\tQ\tA\tC\tR",
+    "CAT1\tList6\tUNRANKED\tX\tS\tT\tA",
+]
+
+
+def build_analysis(weight_function='exponential', engine=None):
+    """Return a CrossValidation analysis of TEST_LINES using the given
+    weight function and engine (None for the object engine)"""
+    elb = EntityListBuilder(weight_function)
+    cross_validation = build_cross_validation(TEST_LINES, elb, 0.01, 100)
+    cross_validation.engine = engine
+    return cross_validation
@@ -0,0 +1,218 @@
+"""
+Code relating to saving the state of a CrossValidation analysis to a file
+(including checkpointing it as it runs) and restoring it, so that an
+analysis can be carried on from where it was saved, or a changed analysis
+started from the fixed point of the old one
+"""
+import io
+import json
+import logging
+import os
+
+import numpy as np
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+STATE_FORMAT_VERSION = 1
+
+
+def _json_value(value):
+    """Make the NumPy values in a list's fit state storable as JSON (which
+    keeps floats exactly)"""
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError("Can't store {!r} in a state file".format(value))
+
+
+def _ragged(arrays):
+    """Return (offsets, values, present) for a list of 1-D arrays, where
+    a missing array (None) is stored as an empty slice marked not present"""
+    offsets = [0]
+    values = []
+    present = []
+    for array in arrays:
+        present.append(array is not None)
+        if array is not None:
+            values.append(np.asarray(array, dtype=np.float64))
+        offsets.append(offsets[-1] + (len(array) if array is not None
+                                      else 0))
+    values = np.concatenate(values) if values else np.zeros(0)
+    return np.array(offsets, dtype=np.int64), values, \
+        np.array(present, dtype=bool)
+
+
+def _unragged(offsets, values, present, idx):
+    if not present[idx]:
+        return None
+    return values[offsets[idx]:offsets[idx + 1]]
+
+
+def save_state(cross_validation, path):
+    """Write the state of the analysis (the state of every list, the score,
+    per-list weights and category winners of every Entity, and the
+    iteration counter) to a compressed NumPy archive. The file is replaced
+    in one step, so a reader never sees it half written"""
+    entity_lists = cross_validation.entity_lists
+    entities = cross_validation.entities
+    list_index = dict((x, idx) for idx, x in enumerate(entity_lists))
+    list_states = [x.analysis_state() for x in entity_lists]
+    weights_offsets, weights_values, _ = _ragged(
+        [x['weights_list'] for x in list_states])
+    fitted_offsets, fitted_values, fitted_present = _ragged(
+        [x['fitted_scores'] for x in list_states])
+    membership_entities = []
+    membership_lists = []
+    membership_weights = []
+    membership_winners = []
+    for entity_idx, entity in enumerate(entities):
+        winners = entity.winning_lists_by_category()
+        for entity_list, weight in entity.raw_scores_by_list():
+            if entity_list not in list_index:
+                continue
+            membership_entities.append(entity_idx)
+            membership_lists.append(list_index[entity_list])
+            membership_weights.append(weight)
+            membership_winners.append(
+                winners.get(entity_list.category) is entity_list)
+    arrays = dict(
+        format_version=np.array(STATE_FORMAT_VERSION),
+        iteration=np.array(cross_validation.iteration),
+        list_names=np.array([x.name for x in entity_lists], dtype=str),
+        list_weights=np.array([x['weight'] for x in list_states],
+                              dtype=np.float64),
+        list_deltas=np.array([np.nan if x['delta'] is None else x['delta']
+                              for x in list_states], dtype=np.float64),
+        list_ratios=np.array([x['ratio'] for x in list_states],
+                             dtype=np.float64),
+        list_fit_skipped=np.array([x['fit_skipped'] for x in list_states],
+                                  dtype=bool),
+        list_fit_counts=np.array([x['fit_count'] for x in list_states],
+                                 dtype=np.int64),
+        list_fit_states=np.array([json.dumps(x['fit_state'],
+                                             default=_json_value)
+                                  for x in list_states], dtype=str),
+        weights_offsets=weights_offsets, weights_values=weights_values,
+        fitted_offsets=fitted_offsets, fitted_values=fitted_values,
+        fitted_present=fitted_present,
+        entity_names=np.array([x.name for x in entities], dtype=str),
+        entity_scores=np.array([x.score for x in entities],
+                               dtype=np.float64),
+        membership_entities=np.array(membership_entities, dtype=np.int64),
+        membership_lists=np.array(membership_lists, dtype=np.int64),
+        membership_weights=np.array(membership_weights, dtype=np.float64),
+        membership_winners=np.array(membership_winners, dtype=bool))
+    temporary_path = path + '.tmp'
+    with io.open(temporary_path, 'wb') as out_stream:
+        np.savez_compressed(out_stream, **arrays)
+    os.replace(temporary_path, path)
+
+
+def load_state(path):
+    """Read a state file written by save_state and return its arrays as a
+    dictionary"""
+    with np.load(path, allow_pickle=False) as archive:
+        state = dict((x, archive[x]) for x in archive.files)
+    if int(state['format_version']) != STATE_FORMAT_VERSION:
+        raise ValueError("Unsupported state file version {} in {}".format(
+            state['format_version'], path))
+    return state
+
+
+def restore_state(cross_validation, state):
+    """Give the lists and Entities of the analysis the state saved for the
+    lists and Entities of the same names, and the saved iteration counter.
+    Lists and Entities that were not saved (e.g. a newly added study) keep
+    their starting state; a saved list whose length has changed keeps its
+    weight but not its fitted weights. Return the number of lists and of
+    Entities restored"""
+    list_positions = dict((x, idx) for idx, x in
+                          enumerate(state['list_names'].tolist()))
+    weights_offsets = state['weights_offsets']
+    fitted_offsets = state['fitted_offsets']
+    restored_lists = {}
+    for entity_list in cross_validation.entity_lists:
+        idx = list_positions.get(entity_list.name)
+        if idx is None:
+            continue
+        weight = float(state['list_weights'][idx])
+        weights_list = state['weights_values'][
+            weights_offsets[idx]:weights_offsets[idx + 1]].tolist()
+        fitted_scores = _unragged(fitted_offsets, state['fitted_values'],
+                                  state['fitted_present'], idx)
+        delta = float(state['list_deltas'][idx])
+        fit_state = json.loads(str(state['list_fit_states'][idx]))
+        if entity_list.uses_fitted_weights and \
+                len(weights_list) not in (1, len(entity_list)):
+            # the list has changed - start its fitted weights again
+            weights_list = [weight]
+            fitted_scores = None
+        if fitted_scores is not None and \
+                len(fitted_scores) != len(entity_list):
+            fitted_scores = None
+        entity_list.restore_analysis_state(dict(
+            weight=weight,
+            delta=None if np.isnan(delta) else delta,
+            weights_list=weights_list,
+            ratio=float(state['list_ratios'][idx]),
+            fit_skipped=bool(state['list_fit_skipped'][idx]),
+            fit_count=int(state['list_fit_counts'][idx]),
+            fitted_scores=None if fitted_scores is None
+            else fitted_scores.copy(),
+            fit_state=fit_state))
+        restored_lists[idx] = entity_list
+    entity_positions = dict((x, idx) for idx, x in
+                            enumerate(state['entity_names'].tolist()))
+    saved_entities = {}
+    for entity in cross_validation.entities:
+        idx = entity_positions.get(entity.name)
+        if idx is not None:
+            saved_entities[idx] = entity
+    weights = dict((x, {}) for x in saved_entities)
+    winners = dict((x, {}) for x in saved_entities)
+    for entity_idx, list_idx, weight, winner in zip(
+            state['membership_entities'].tolist(),
+            state['membership_lists'].tolist(),
+            state['membership_weights'].tolist(),
+            state['membership_winners'].tolist()):
+        entity_list = restored_lists.get(list_idx)
+        if entity_idx in weights and entity_list is not None:
+            weights[entity_idx][entity_list] = weight
+            if winner:
+                winners[entity_idx][entity_list.category] = entity_list
+    entity_scores = state['entity_scores'].tolist()
+    for idx, entity in saved_entities.items():
+        entity.set_calculated_score(entity_scores[idx], weights[idx],
+                                    winners[idx])
+    cross_validation.iteration = int(state['iteration'])
+    logger.info("Restored the state of {} lists and {} entities from "
+                "iteration {}".format(len(restored_lists),
+                                      len(saved_entities),
+                                      cross_validation.iteration))
+    return len(restored_lists), len(saved_entities)
+
+
+class Checkpointer(object):
+    """Save the state of a CrossValidation analysis to a checkpoint file
+    every interval iterations, replacing the previous checkpoint. Register
+    it with CrossValidation.register_callback as a POST_STEP_CALLBACK, so
+    that the weights saved are those the next iteration starts from (after
+    any solver or extrapolation step).
+
+    An analysis restored from a checkpoint (with restore_state) and run
+    with resume=True carries on exactly as the checkpointed one would have,
+    provided the input and options are the same. A convergence monitor or
+    solver starts its history again, though, so those that use their
+    history (e.g. Aitken extrapolation) can take different steps"""
+
+    def __init__(self, path, interval=1):
+        self.path = path
+        self.interval = max(1, interval)
+        self.saved = 0
+
+    def do_callback(self, cross_validation, iteration):
+        if iteration % self.interval == 0:
+            save_state(cross_validation, self.path)
+            self.saved += 1
+            logger.debug("Checkpoint of iteration {} saved to {}".format(
+                iteration, self.path))
@@ -0,0 +1,80 @@
+"""
+Code relating to the writing of per-iteration output (score dumps, plots
+and the like) in the background while a CrossValidation analysis carries on
+with its next iteration
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+
+class BackgroundWriter(object):
+    """Run writing tasks one at a time, in the order they were submitted,
+    on a background thread. At most max_pending tasks may be waiting or
+    running at once; submitting another blocks until one has finished, so
+    that a slow disk applies back-pressure to the analysis rather than
+    letting the snapshots waiting to be written pile up in memory.
+
+    Tasks must only use the data they are given (never the live Entities
+    and EntityLists, which the analysis goes on changing)."""
+
+    def __init__(self, max_pending=4):
+        assert max_pending > 0
+        self.max_pending = max_pending
+        # a single worker keeps the writes in order (e.g. the records
+        # appended to one file)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.tasks = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+    def submit(self, function, *args, **kwargs):
+        """Queue function(*args, **kwargs) to be run in the background,
+        waiting for room in the queue if it is full"""
+        if not self.slots.acquire(blocking=False):
+            start = time.perf_counter()
+            self.slots.acquire()
+            self.waits += 1
+            self.wait_time += time.perf_counter() - start
+        future = self.executor.submit(function, *args, **kwargs)
+        future.add_done_callback(lambda _: self.slots.release())
+        self.futures.append(future)
+        self.tasks += 1
+        # forget the tasks that have finished without error
+        self.futures = [x for x in self.futures
+                        if not x.done() or x.exception() is not None]
+
+    def flush(self):
+        """Wait for every queued task to finish, re-raising the first
+        exception raised by any of them"""
+        futures = self.futures
+        self.futures = []
+        for future in futures:
+            future.result()
+        logger.info("{} tasks written in the background; the queue was full "
+                    "{} times, for {:.3f}s in total".format(
+                        self.tasks, self.waits, self.wait_time))
+
+    def close(self):
+        """Flush the queue and stop the background thread"""
+        try:
+            self.flush()
+        finally:
+            self.executor.shutdown()
+
+
+def write_in_background(cross_validation, function, *args, **kwargs):
+    """Hand function(*args, **kwargs) to the BackgroundWriter of the
+    CrossValidation analysis if it has one, otherwise call it straight
+    away"""
+    background_writer = getattr(cross_validation, 'background_writer', None)
+    if background_writer:
+        background_writer.submit(function, *args, **kwargs)
+    else:
+        function(*args, **kwargs)
@@ -1,10 +1,68 @@
+"""
+Code relating to the storage of Baseline measurements. Baselines are kept
+in an indexed SQLite store, keyed on (code version, model, code string),
+holding the baseline with the most permutations for each key. Lookups go
+through an in-process LRU cache.
+
+Baselines files in the older tab-separated format can still be read (they
+are indexed in memory the first time they are used) and can be migrated to
+a store with:
+
+    python baseline.py compact BASELINES_FILE STORE_FILE
+"""
+from __future__ import print_function
+
+import atexit
+import io
 import logging
+import sqlite3
+import sys
+from collections import OrderedDict
 from os.path import expanduser, exists
 
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
 
+# The number of baselines each BaselineStore keeps in its LRU cache
+DEFAULT_CACHE_SIZE = 128
+# The first bytes of every SQLite database file
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+CREATE_TABLE = """CREATE TABLE IF NOT EXISTS baselines (
+    version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    code_string TEXT NOT NULL,
+    num_perms INTEGER NOT NULL,
+    base_score REAL NOT NULL,
+    base_stdev REAL NOT NULL,
+    PRIMARY KEY (version, model, code_string))"""
+# Keep the baseline with the most permutations for each key (and, for
+# equal permutations, the later calculation)
+UPSERT = """INSERT INTO baselines (version, model, code_string, num_perms,
+    base_score, base_stdev) VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (version, model, code_string) DO UPDATE SET
+    num_perms = excluded.num_perms, base_score = excluded.base_score,
+    base_stdev = excluded.base_stdev
+    WHERE excluded.num_perms >= baselines.num_perms"""
+SELECT = """SELECT num_perms, base_score, base_stdev FROM baselines
+    WHERE version = ? AND model = ? AND code_string = ?"""
+# The running statistics of baselines that are still being generated, so
+# that more permutations can be added to them later
+CREATE_PROGRESS_TABLE = """CREATE TABLE IF NOT EXISTS progress (
+    version TEXT NOT NULL,
+    model TEXT NOT NULL,
+    code_string TEXT NOT NULL,
+    num_perms INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    PRIMARY KEY (version, model, code_string))"""
+
+# The open BaselineStore for each file path used with
+# get_baseline_from_store and put_baseline_to_store
+_stores = {}
+
 
 class Baseline(object):
     """Object to represent a Baseline measurement from a random simulated data
@@ -35,6 +93,186 @@ class Baseline(object):
         # @formatter:on
 
 
+class BaselineStore(object):
+    """An indexed store of Baselines, with the best (most permutations)
+    Baseline for each (version, model, code string) and an LRU cache of
+    the most recently used ones in front of it.
+
+    The store is an SQLite database file. If the file holds baselines in
+    the older tab-separated format, they are indexed in an in-memory
+    database instead and any new baselines are appended to the file, as
+    they always were."""
+
+    def __init__(self, file_path, cache_size=DEFAULT_CACHE_SIZE):
+        self.file_path = file_path
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.text_file = exists(file_path) and not is_sqlite_file(file_path)
+        if self.text_file:
+            logger.info("Indexing the tab-separated baselines file at %s - "
+                        "use 'python baseline.py compact' to migrate it to "
+                        "a store" % file_path)
+            self.connection = sqlite3.connect(':memory:')
+        else:
+            self.connection = sqlite3.connect(file_path)
+        self.connection.execute(CREATE_TABLE)
+        self.connection.execute(CREATE_PROGRESS_TABLE)
+        if self.text_file:
+            self.import_text_file(file_path)
+
+    def get(self, version, code_string, model, permutations):
+        """Return the best Baseline for the version, code string and model
+        if it used at least the given number of permutations, or None"""
+        key = (str(version), model, code_string)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            row = self.cache[key]
+        else:
+            self.misses += 1
+            row = self.connection.execute(SELECT, key).fetchone()
+            # misses are not cached, so that a baseline stored since (e.g.
+            # by another process) is found by the next lookup
+            if row is not None:
+                self._cache(key, row)
+        if row is None or row[0] < permutations:
+            return None
+        return Baseline(code_string=code_string, base_score=row[1],
+                        base_stdev=row[2], num_perms=row[0], model=model)
+
+    def put(self, version, baseline):
+        """Store the Baseline unless the store already has one for the same
+        version, model and code string that used more permutations"""
+        self._upsert([(str(version), baseline.model, baseline.code_string,
+                       int(baseline.num_perms), float(baseline.base_score),
+                       float(baseline.base_stdev))])
+        if self.text_file:
+            with io.open(self.file_path, "a") as baseline_file:
+                baseline_file.write(text_line(version, baseline))
+
+    def get_progress(self, version, model, code_string):
+        """Return the (permutations, count, mean, sum of squared
+        differences from the mean) of the scores generated so far for a
+        baseline, or None if there are none"""
+        return self.connection.execute(
+            "SELECT num_perms, count, mean, m2 FROM progress WHERE version = "
+            "? AND model = ? AND code_string = ?",
+            (str(version), model, code_string)).fetchone()
+
+    def put_progress(self, version, model, code_string, num_perms, count,
+                     mean, m2):
+        """Record the running statistics of the scores generated so far for
+        a baseline"""
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO progress (version, model, "
+                "code_string, num_perms, count, mean, m2) VALUES (?, ?, ?, "
+                "?, ?, ?, ?)", (str(version), model, code_string,
+                                int(num_perms), int(count), float(mean),
+                                float(m2)))
+
+    def import_text_file(self, file_path):
+        """Add every baseline in a tab-separated baselines file to the
+        store and return the number of lines read"""
+        rows = []
+        with io.open(file_path, "r") as baseline_file:
+            for line in baseline_file.read().splitlines():
+                cols = line.split("\t")
+                # not enough columns
+                if len(cols) < 6:
+                    logger.debug("Skipping line (%s) - not enough columns"
+                                 % line)
+                    continue
+                try:
+                    rows.append((cols[0], cols[1], cols[3], int(cols[2]),
+                                 float(cols[4]), float(cols[5])))
+                except ValueError:
+                    logger.warning("Skipping unreadable baseline (%s)" % line)
+        self._upsert(rows)
+        return len(rows)
+
+    def import_store(self, store):
+        """Add every baseline in another BaselineStore to this one, along
+        with the progress of any that are still being generated"""
+        self._upsert(store.connection.execute(
+            "SELECT version, model, code_string, num_perms, base_score, "
+            "base_stdev FROM baselines"))
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO progress (version, model, code_string, "
+                "num_perms, count, mean, m2) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (version, model, code_string) DO UPDATE SET "
+                "num_perms = excluded.num_perms, count = excluded.count, "
+                "mean = excluded.mean, m2 = excluded.m2 "
+                "WHERE excluded.num_perms > progress.num_perms",
+                store.connection.execute(
+                    "SELECT version, model, code_string, num_perms, count, "
+                    "mean, m2 FROM progress"))
+
+    def __len__(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM baselines").fetchone()[0]
+
+    def compact(self):
+        """Reclaim the space left in the database file by updates"""
+        self.connection.execute("VACUUM")
+
+    def close(self):
+        """Close the store's database connection"""
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _upsert(self, rows):
+        with self.connection:
+            self.connection.executemany(UPSERT, rows)
+        # the cached rows may now be out of date
+        self.cache.clear()
+
+    def _cache(self, key, row):
+        self.cache[key] = row
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+
+def is_sqlite_file(file_path):
+    with io.open(file_path, "rb") as in_file:
+        return in_file.read(len(SQLITE_HEADER)) == SQLITE_HEADER
+
+
+def text_line(version, baseline):
+    """Return a Baseline as a line of a tab-separated baselines file"""
+    return '\t'.join(
+        [str(version), baseline.model, str(baseline.num_perms),
+         baseline.code_string, str(baseline.base_score),
+         str(baseline.base_stdev)]) + "\n"
+
+
+def open_store(file_path):
+    """Return the BaselineStore for the file path (in which ${HOME} stands
+    for the user's home directory), opening it if need be"""
+    file_path = file_path.replace("${HOME}", expanduser("~"))
+    if file_path not in _stores:
+        _stores[file_path] = BaselineStore(file_path)
+    return _stores[file_path]
+
+
+def close_stores():
+    """Close every BaselineStore opened by open_store (this is done when
+    the interpreter exits)"""
+    while _stores:
+        _stores.popitem()[1].close()
+
+
+atexit.register(close_stores)
+
+
 def get_baseline_from_store(file_path, version, code_string, model,
                             permutations):
     """Look for a baseline that matches the specified conditions. Return
@@ -45,74 +283,49 @@ def get_baseline_from_store(file_path, version, code_string, model,
     :param model: the model used to map the weights
     :param permutations: the minimum number of permutations used to generate
     the baseline"""
-    return_value = None
-    matches = []
-    highest_permutations = 0
-    best_match = -1
     home = expanduser("~")
-    file_path = file_path.replace("${HOME}", home)
-    if exists(file_path):
-        logger.debug("opening the baselines file at %s" % file_path)
-        with open(file_path, "r") as baseline_file:
-            print("all good")
-            for line in baseline_file.read().splitlines():
-                logger.debug("Got a line (%s)" % line)
-                cols = line.split("\t")
-                # not enough columns
-                if len(cols) < 5:
-                    logger.debug("Bailing - not enough columns")
-                    continue
-                # wrong code version
-                if cols[0] != str(version):
-                    logger.debug("Bailing - wrong version")
-                    continue
-                # wrong model
-                if cols[1] != model:
-                    logger.debug("Bailing - wrong model")
-                    continue
-                # not enough permutations
-                if int(cols[2]) < permutations:
-                    logger.debug("Bailing - not enough permutations")
-                    continue
-                # wrong data pattern
-                if cols[3] != code_string:
-                    logger.debug("Bailing - wrong code string")
-                    continue
-                # Build a Baseline object and put it in a list (there may be
-                # multiple matches
-                matches.append(
-                    Baseline(code_string=code_string, base_score=cols[4],
-                             base_stdev=cols[5], num_perms=int(cols[2]),
-                             model=model))
-                # If this has more permutations than any previous match then
-                # note its index. If it matches a previous one, use this one
-                # because it will be a later calculation
-                if int(cols[2]) >= highest_permutations:
-                    logger.debug("Got a match - better than anything we've "
-                                 "seen so far")
-                    best_match = len(matches) - 1
-                else:
-                    logger.debug("Got a match - previous one was better")
-
-        # If we got matches, use the one that was the best match
-        if len(matches) > 0:
-            return_value = matches[best_match]
-    else:
+    if not exists(file_path.replace("${HOME}", home)):
         logger.info("No baselines file at %s" % file_path)
-
-    return return_value
+        return None
+    return open_store(file_path).get(version, code_string, model,
+                                     permutations)
 
 
 def put_baseline_to_store(file_path, version, baseline):
-    """Look for a baseline that matches the specified conditions. Return
-    None if nothing matches.
+    """Store a baseline, keeping only the one with the most permutations
+    for each version, model and code string.
     :param file_path: path to the file to store into
     :param version: version of the code that we have used
     :param baseline: the baseline object to store"""
-    home = expanduser("~")
-    file_path = file_path.replace("${HOME}", home)
-    with open(file_path, "a") as baseline_file:
-        baseline_file.write('\t'.join(
-            [str(version), baseline.model, str(baseline.num_perms),
-             baseline.code_string, str(baseline.base_score),
-             str(baseline.base_stdev)]) + "\n")
+    open_store(file_path).put(version, baseline)
+
+
+def compact(source_path, store_path):
+    """Migrate the baselines in a file (tab-separated or a store) into the
+    store at store_path (creating it if need be), keeping the best baseline
+    for each key, and compact the store. Return the number of baselines in
+    the store"""
+    with BaselineStore(store_path) as store:
+        if store.text_file:
+            raise ValueError("%s is not a baseline store" % store_path)
+        if source_path != store_path:
+            if is_sqlite_file(source_path):
+                with BaselineStore(source_path) as source:
+                    store.import_store(source)
+            else:
+                store.import_text_file(source_path)
+        store.compact()
+        return len(store)
+
+
+def main(args):
+    if len(args) != 3 or args[0] != 'compact':
+        print("Usage: python baseline.py compact BASELINES_FILE STORE_FILE")
+        return 1
+    count = compact(args[1], args[2])
+    print("%d baselines in %s" % (count, args[2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
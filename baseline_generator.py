@@ -0,0 +1,237 @@
+# coding=utf-8
+"""
+Code relating to the generation of Baselines: the mean and standard
+deviation of the entity scores that MAIC gives to randomly simulated data
+sets with the same shape (described by a code string such as '10r.20u|5r')
+as a real one.
+
+Usage: python baseline_generator.py [options] (see python
+baseline_generator.py -h)
+"""
+from __future__ import print_function
+
+import argparse
+import logging
+import random
+import re
+import sys
+from math import sqrt
+from multiprocessing import Pool
+
+import numpy as np
+
+from baseline import Baseline, BaselineStore
+from cross_validation import build_cross_validation
+from entitylist_builder import EntityListBuilder
+from vectorized_engine import VectorizedEngine
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+# The version of the MAIC code that the baselines are generated with
+DEFAULT_VERSION = 1.0
+# The number of permutations run between each update of the store
+DEFAULT_CHECKPOINT_INTERVAL = 20
+
+list_code_matcher = re.compile(r'^(\d+)([ru])$')
+
+
+def parse_code_string(code_string):
+    """Return the lists described by a code string as a list (one entry
+    per category) of lists of (length, is_ranked) pairs"""
+    categories = []
+    for category_string in code_string.split('|'):
+        lists = []
+        for list_string in category_string.split('.'):
+            match = list_code_matcher.match(list_string.strip())
+            if not match:
+                raise ValueError(
+                    "Invalid list '{}' in code string '{}'".format(
+                        list_string, code_string))
+            lists.append((int(match.group(1)), match.group(2) == 'r'))
+        categories.append(lists)
+    return categories
+
+
+def simulated_lines(code_string, random_source_len, seed):
+    """Return the lines of a random input file with the shape described by
+    the code string. The members of every list are drawn at random from a
+    pool of random_source_len entities"""
+    rng = random.Random(seed)
+    lines = []
+    for category_idx, lists in enumerate(parse_code_string(code_string)):
+        for length, is_ranked in lists:
+            members = ["entity{}".format(x) for x in
+                       rng.sample(range(random_source_len), length)]
+            lines.append("\t".join(
+                ["Category{}".format(category_idx + 1),
+                 "List{}".format(len(lines) + 1),
+                 "RANKED" if is_ranked else "NOT_RANKED",
+                 "NAMED_GENES"] + members))
+    return lines
+
+
+def run_permutation(job):
+    """Run MAIC (with the vectorized engine) on one simulated data set and
+    return the (count, mean, sum of squared differences from the mean) of
+    its entity scores. Run in the worker processes"""
+    code_string, model, seed, random_source_len, stability, max_iterations \
+        = job
+    cross_validation = build_cross_validation(
+        simulated_lines(code_string, random_source_len, seed),
+        EntityListBuilder(model), stability, max_iterations)
+    cross_validation.engine = VectorizedEngine()
+    cross_validation.run_analysis()
+    scores = np.array([x.score for x in cross_validation.entities],
+                      dtype=np.float64)
+    mean = scores.mean()
+    return len(scores), mean, float(((scores - mean) ** 2).sum())
+
+
+class RunningStatistics(object):
+    """Welford's running mean and variance, extended (after Chan et al.) to
+    add the statistics of a whole batch of values at once"""
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, count, mean, m2):
+        """Add a batch of count values with the given mean and sum of
+        squared differences from that mean"""
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+
+    def add_values(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if len(values):
+            mean = values.mean()
+            self.add(len(values), mean, float(((values - mean) ** 2).sum()))
+
+    @property
+    def stdev(self):
+        """The (population) standard deviation of the values"""
+        return sqrt(self.m2 / self.count) if self.count else 0.0
+
+
+class BaselineGenerator(object):
+    """Generate Baselines by running MAIC on many randomly simulated data
+    sets (permutations) in a pool of worker processes, streaming the
+    running statistics of their entity scores into a BaselineStore.
+
+    Permutation i always uses random seed i, and the statistics are kept
+    in the store after every checkpoint_interval permutations, so an
+    interrupted run can be resumed and an existing baseline extended to
+    more permutations, giving the same result as generating them all at
+    once"""
+
+    def __init__(self, store, model='exponential', workers=1,
+                 random_source_len=100000, stability=0.01,
+                 max_iterations=100, version=DEFAULT_VERSION,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.store = store
+        self.model = model
+        self.workers = workers
+        self.random_source_len = random_source_len
+        self.stability = stability
+        self.max_iterations = max_iterations
+        self.version = version
+        self.checkpoint_interval = checkpoint_interval
+
+    def generate(self, code_string, permutations):
+        """Return a Baseline for the code string from at least the given
+        number of permutations, running just those not already in the
+        store"""
+        progress = self.store.get_progress(self.version, self.model,
+                                           code_string)
+        done = 0
+        statistics = RunningStatistics()
+        if progress:
+            done = progress[0]
+            statistics = RunningStatistics(*progress[1:])
+        if done < permutations:
+            logger.info("Running permutations {} to {} for {}".format(
+                done + 1, permutations, code_string))
+            pool = Pool(self.workers) if self.workers > 1 else None
+            try:
+                jobs = [(code_string, self.model, seed,
+                         self.random_source_len, self.stability,
+                         self.max_iterations)
+                        for seed in range(done, permutations)]
+                results = pool.imap(run_permutation, jobs) if pool \
+                    else map(run_permutation, jobs)
+                # the results come back in order, so the statistics are the
+                # same however many workers are used
+                for result in results:
+                    statistics.add(*result)
+                    done += 1
+                    if done % self.checkpoint_interval == 0 or \
+                            done == permutations:
+                        self.checkpoint(code_string, done, statistics)
+            except BaseException:
+                # e.g. an interruption - what has been checkpointed so far
+                # can be resumed later
+                if pool:
+                    pool.terminate()
+                raise
+            if pool:
+                pool.close()
+                pool.join()
+        return Baseline(code_string=code_string, base_score=statistics.mean,
+                        base_stdev=statistics.stdev, num_perms=done,
+                        model=self.model)
+
+    def checkpoint(self, code_string, permutations, statistics):
+        """Store the statistics so far and the Baseline they give"""
+        self.store.put_progress(self.version, self.model, code_string,
+                                permutations, statistics.count,
+                                statistics.mean, statistics.m2)
+        self.store.put(self.version, Baseline(
+            code_string=code_string, base_score=statistics.mean,
+            base_stdev=statistics.stdev, num_perms=permutations,
+            model=self.model))
+        logger.debug("{} permutations of {} stored".format(permutations,
+                                                           code_string))
+
+
+def get_parsed_options(args=None):
+    parser = argparse.ArgumentParser(
+        description="Generate MAIC baselines from random permutations")
+    parser.add_argument('-c', '--code-string', required=True,
+                        help="the shape of the data, e.g. '10r.20u|5r'")
+    parser.add_argument('-n', '--permutations', type=int, default=100,
+                        help='total number of permutations to run (default: '
+                             '100); those already in the store are reused')
+    parser.add_argument('-s', '--store', required=True,
+                        help='path to the baseline store')
+    parser.add_argument('-w', '--weight-function', default='exponential',
+                        choices=['exponential', 'knn', 'polynomial', 'svr',
+                                 'none'])
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes (default: 1)')
+    parser.add_argument('--random-source-len', type=int, default=100000,
+                        help='number of entities the simulated lists are '
+                             'drawn from (default: 100000)')
+    return parser.parse_args(args)
+
+
+def main(args):
+    options = get_parsed_options(args)
+    store = BaselineStore(options.store)
+    try:
+        generator = BaselineGenerator(
+            store, model=options.weight_function, workers=options.workers,
+            random_source_len=options.random_source_len)
+        print(generator.generate(options.code_string, options.permutations))
+    finally:
+        store.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,538 @@
+"""
+Code relating to fitting the exponential weights curve to many ranked lists
+at once
+"""
+import logging
+
+import numpy as np
+
+from entitylist import ExponentialEntityList, EXPONENTIAL_FIT_BOUNDS, \
+    same_fit_cost
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+# Parameter count of the exponential_function
+PARAMETER_COUNT = 4
+EPS = np.finfo(float).eps
+# Relative step of the forward differences used for the Jacobian (as
+# curve_fit's default '2-point' scheme)
+DIFFERENCE_STEP = EPS ** 0.5
+# Iterations allowed for finding the Levenberg-Marquardt parameter that
+# puts a step on the edge of the trust region, and the tolerance on the edge
+TRUST_REGION_ITERATIONS = 10
+TRUST_REGION_RTOL = 0.01
+
+
+class BatchExponentialFitter(object):
+    """Fit the exponential weights curve to the truncated weights of all
+    the ExponentialEntityLists in an analysis in one go.
+
+    Every list is padded out to the length of the longest list and the
+    Trust Region Reflective least squares algorithm that curve_fit uses for
+    a bounded fit (with the same forward-difference Jacobian, tolerances and
+    evaluation limit) is run on all of them together using array
+    operations. The same starting values, EXPONENTIAL_FIT_BOUNDS and sigma
+    weighting as ExponentialEntityList are used, so each list takes the
+    same steps as it would with curve_fit and ends at the same minimum (to
+    within rounding). A list whose fit does not converge is fitted again by
+    itself with curve_fit."""
+
+    def __init__(self, max_evaluations=None, ftol=1e-8, xtol=1e-8,
+                 gtol=1e-8):
+        """Create a BatchExponentialFitter. The evaluation limit (per list)
+        and tolerances have the same meaning (and defaults) as the max_nfev,
+        ftol, xtol and gtol of scipy.optimize.least_squares"""
+        self.max_evaluations = 100 * PARAMETER_COUNT \
+            if max_evaluations is None else max_evaluations
+        self.ftol = ftol
+        self.xtol = xtol
+        self.gtol = gtol
+
+    @staticmethod
+    def can_fit(entity_list):
+        """Report whether this fitter knows how to fit the given list"""
+        return isinstance(entity_list, ExponentialEntityList) and \
+            len(entity_list) > 0
+
+    def fit(self, entity_lists, force=False):
+        """Fit the curve to every one of the supplied lists that needs
+        refitting (or all of them if force is True) and store the results
+        in the lists"""
+        if not force:
+            for entity_list in entity_lists:
+                if not entity_list.needs_refit():
+                    entity_list.skip_fit()
+            entity_lists = [x for x in entity_lists if not x.fit_skipped]
+        if not entity_lists:
+            return
+        y_vectors = [x.get_truncated_weights_list() for x in entity_lists]
+        lengths = np.array([len(x) for x in y_vectors])
+        x_matrix, y_matrix, sigma_matrix = self._padded_arrays(
+            entity_lists, y_vectors, lengths)
+        warm_started = np.array([x.can_warm_start() for x in entity_lists],
+                                dtype=bool)
+        initial = np.array([x.initial_fit_parameters()
+                            for x in entity_lists], dtype=float)
+        parameters, converged, evaluations = self.solve(
+            x_matrix, y_matrix, sigma_matrix, initial)
+        if np.any(warm_started):
+            # as with a single list, a warm-started fit is only kept if a fit
+            # from the fixed starting values reaches the same minimum
+            warm_started = self._check_warm_fits(
+                entity_lists, warm_started, x_matrix, y_matrix, sigma_matrix,
+                parameters, converged, evaluations)
+        for idx, entity_list in enumerate(entity_lists):
+            if converged[idx]:
+                entity_list.record_fit_evaluations(int(evaluations[idx]),
+                                                   warm_started[idx])
+                entity_list.set_fit_parameters(parameters[idx])
+            else:
+                logger.debug("The batched fit of list {} did not converge; "
+                             "fitting it by itself".format(entity_list.name))
+                entity_list._fit_curve_to_entity_scores()
+            entity_list.fit_completed()
+        logger.debug("Batch fitted {} lists ({} fitted by themselves)".format(
+            len(entity_lists), len(entity_lists) - int(np.sum(converged))))
+
+    def _check_warm_fits(self, entity_lists, warm_started, x_matrix,
+                         y_matrix, sigma_matrix, parameters, converged,
+                         evaluations):
+        """Fit the warm-started rows again from the fixed starting values and
+        replace (in place) each warm fit that failed or ended in a different
+        minimum by the cold fit. Return which rows kept their warm fit"""
+        rows = np.flatnonzero(warm_started)
+        cold_initial = np.array([entity_lists[x].cold_fit_parameters()
+                                 for x in rows], dtype=float)
+        cold_parameters, cold_converged, cold_evaluations = self.solve(
+            x_matrix[rows], y_matrix[rows], sigma_matrix[rows], cold_initial)
+        inverse_sigma = 1.0 / sigma_matrix[rows]
+        warm_costs = self._costs(parameters[rows], x_matrix[rows],
+                                 y_matrix[rows], inverse_sigma)
+        cold_costs = self._costs(cold_parameters, x_matrix[rows],
+                                 y_matrix[rows], inverse_sigma)
+        evaluations[rows] += cold_evaluations
+        warm_kept = np.zeros(len(entity_lists), dtype=bool)
+        for idx, row in enumerate(rows):
+            if converged[row] and (not cold_converged[idx] or same_fit_cost(
+                    warm_costs[idx], cold_costs[idx])):
+                warm_kept[row] = True
+            elif cold_converged[idx]:
+                parameters[row] = cold_parameters[idx]
+                converged[row] = True
+        return warm_kept
+
+    def _costs(self, parameters, x_matrix, y_matrix, inverse_sigma):
+        """Calculate the sum of the squared weighted residuals of each row"""
+        residuals = self._residuals(parameters, x_matrix, y_matrix,
+                                    inverse_sigma)
+        return np.einsum('ln,ln->l', residuals, residuals)
+
+    def refit_skipped(self, entity_lists):
+        """Fit the curve to those of the supplied lists whose last fit was
+        skipped"""
+        self.fit([x for x in entity_lists if x.fit_skipped], force=True)
+
+    @staticmethod
+    def _padded_arrays(entity_lists, y_vectors, lengths):
+        """Build (lists x longest list) arrays of x values, y values and
+        sigma values. The padding has x = 0, y = 0 and sigma = inf so that
+        it never contributes to a residual"""
+        width = int(np.max(lengths))
+        x_matrix = np.zeros((len(entity_lists), width))
+        y_matrix = np.zeros((len(entity_lists), width))
+        sigma_matrix = np.full((len(entity_lists), width), np.inf)
+        for idx, entity_list in enumerate(entity_lists):
+            length = lengths[idx]
+            x_vector = np.arange(1, length + 1)
+            x_matrix[idx, :length] = x_vector
+            y_matrix[idx, :length] = y_vectors[idx]
+            sigma_matrix[idx, :length] = entity_list.fit_sigma(x_vector)
+        return x_matrix, y_matrix, sigma_matrix
+
+    def solve(self, x_matrix, y_matrix, sigma_matrix, initial):
+        """Perform the bounded Trust Region Reflective fit of all the rows of
+        the supplied arrays at once. Return the fitted parameters (one row
+        per list), a boolean array reporting which fits converged and the
+        number of function evaluations used by each fit.
+
+        Each pass evaluates one trial step for every row still being
+        fitted; a row whose step is rejected tries again from the same
+        point with a smaller trust region on the next pass, just as the
+        inner loop of scipy's trf_bounds does"""
+        list_count = len(initial)
+        lower = np.broadcast_to(
+            np.array(EXPONENTIAL_FIT_BOUNDS[0], dtype=float),
+            (list_count, PARAMETER_COUNT))
+        upper = np.broadcast_to(
+            np.array(EXPONENTIAL_FIT_BOUNDS[1], dtype=float),
+            (list_count, PARAMETER_COUNT))
+        inverse_sigma = 1.0 / sigma_matrix
+        lengths = np.sum(np.isfinite(sigma_matrix), axis=1)
+
+        parameters = _strictly_feasible(
+            np.clip(np.asarray(initial, dtype=float), lower, upper),
+            lower, upper, 1e-10)
+        residuals = self._residuals(parameters, x_matrix, y_matrix,
+                                    inverse_sigma)
+        jacobian = self._jacobian(parameters, residuals, x_matrix, y_matrix,
+                                  inverse_sigma)
+        gradient = np.einsum('lni,ln->li', jacobian, residuals)
+        cost = 0.5 * np.einsum('ln,ln->l', residuals, residuals)
+        evaluations = np.ones(list_count, dtype=int)
+        v, _ = _scaling_vector(parameters, gradient, lower, upper)
+        radius = np.linalg.norm(parameters / v ** 0.5, axis=1)
+        radius[radius == 0] = 1.0
+        damping = np.zeros(list_count)
+        # 0 while being fitted, 1 once converged, -1 if not converged
+        status = np.zeros(list_count, dtype=int)
+
+        while True:
+            active = np.flatnonzero(status == 0)
+            if len(active):
+                v, dv = _scaling_vector(parameters[active], gradient[active],
+                                        lower[active], upper[active])
+                gradient_norm = np.max(np.abs(gradient[active] * v), axis=1)
+                status[active[gradient_norm < self.gtol]] = 1
+                status[active[(gradient_norm >= self.gtol) &
+                              (evaluations[active] >=
+                               self.max_evaluations)]] = -1
+                keep = status[active] == 0
+                active, v, dv = active[keep], v[keep], dv[keep]
+                gradient_norm = gradient_norm[keep]
+            if not len(active):
+                break
+            # Only look as far along the rows as the longest active list
+            width = np.max(lengths[active])
+            x = x_matrix[active, :width]
+            y = y_matrix[active, :width]
+            scale = inverse_sigma[active, :width]
+            p = parameters[active]
+            f = residuals[active, :width]
+            g = gradient[active]
+            delta = radius[active]
+
+            # The trust-region problem in the Coleman-Li scaled ("hat")
+            # variables
+            d = v ** 0.5
+            diagonal_h = g * dv
+            g_h = d * g
+            jacobian_h = jacobian[active, :width] * d[:, None, :]
+            augmented = np.concatenate(
+                (jacobian_h, _diagonal_matrices(diagonal_h ** 0.5)), axis=1)
+            u, s, vt = np.linalg.svd(augmented, full_matrices=False)
+            uf = np.einsum('lni,ln->li', u[:, :width], f)
+            theta = np.maximum(0.995, 1 - gradient_norm)
+
+            step_h, damping[active] = _solve_trust_region(
+                lengths[active], uf, s, vt, delta, damping[active])
+            step, step_h, predicted = _select_step(
+                p, jacobian_h, diagonal_h, g_h, d * step_h, step_h, d, delta,
+                lower[active], upper[active], theta)
+
+            candidate = _strictly_feasible(p + step, lower[active],
+                                           upper[active], 0)
+            candidate_residuals = self._residuals(candidate, x, y, scale)
+            evaluations[active] += 1
+            step_h_norm = np.linalg.norm(step_h, axis=1)
+
+            finite = np.all(np.isfinite(candidate_residuals), axis=1)
+            radius[active[~finite]] = 0.25 * step_h_norm[~finite]
+            candidate_cost = 0.5 * np.einsum('ln,ln->l', candidate_residuals,
+                                             candidate_residuals)
+            reduction = cost[active] - candidate_cost
+            new_radius, ratio = _update_radius(
+                delta, reduction, predicted, step_h_norm,
+                step_h_norm > 0.95 * delta)
+            step_norm = np.linalg.norm(step, axis=1)
+            small_reduction = (reduction < self.ftol * cost[active]) & \
+                (ratio > 0.25)
+            small_step = step_norm < self.xtol * (
+                self.xtol + np.linalg.norm(p, axis=1))
+            terminated = finite & (small_reduction | small_step)
+            resized = finite & ~terminated
+            with np.errstate(divide='ignore', invalid='ignore'):
+                damping[active[resized]] *= \
+                    delta[resized] / new_radius[resized]
+            radius[active[resized]] = new_radius[resized]
+            status[active[terminated]] = 1
+
+            # Move to the better points, updating the Jacobian of those
+            # still being fitted
+            accepted = finite & (reduction > 0)
+            rows = active[accepted]
+            parameters[rows] = candidate[accepted]
+            residuals[rows, :width] = candidate_residuals[accepted]
+            cost[rows] = candidate_cost[accepted]
+            moved = accepted & ~terminated
+            if np.any(moved):
+                rows = active[moved]
+                jacobian[rows, :width] = self._jacobian(
+                    parameters[rows], residuals[rows, :width], x[moved],
+                    y[moved], scale[moved])
+                gradient[rows] = np.einsum(
+                    'lni,ln->li', jacobian[rows, :width],
+                    residuals[rows, :width])
+        return parameters, status > 0, evaluations
+
+    def _jacobian(self, parameters, residuals, x_matrix, y_matrix,
+                  inverse_sigma):
+        """Calculate the Jacobian of the weighted residuals of each row with
+        respect to its parameters by forward differences, as curve_fit does
+        when it is not given a Jacobian"""
+        steps = DIFFERENCE_STEP * np.where(parameters >= 0, 1.0, -1.0) * \
+            np.maximum(1.0, np.abs(parameters))
+        jacobian = np.empty(residuals.shape + (PARAMETER_COUNT,))
+        for idx in range(PARAMETER_COUNT):
+            shifted = parameters.copy()
+            shifted[:, idx] = parameters[:, idx] + steps[:, idx]
+            difference = shifted[:, idx] - parameters[:, idx]
+            jacobian[:, :, idx] = (self._residuals(
+                shifted, x_matrix, y_matrix, inverse_sigma) - residuals) / \
+                difference[:, None]
+        return jacobian
+
+    @staticmethod
+    def _residuals(parameters, x_matrix, y_matrix, inverse_sigma):
+        """Calculate the weighted residuals for each row"""
+        fitted = parameters[:, 0:1] * np.exp(-parameters[:, 1:2] * x_matrix) \
+            - parameters[:, 2:3] * x_matrix + parameters[:, 3:4]
+        return (fitted - y_matrix) * inverse_sigma
+
+
+def _diagonal_matrices(diagonals):
+    """Return a stack of diagonal matrices with the given diagonals"""
+    return diagonals[:, :, None] * np.eye(diagonals.shape[1])
+
+
+def _scaling_vector(x, g, lower, upper):
+    """Return the Coleman-Li scaling vector v of each row and its derivative
+    dv: the distance to the bound that the gradient points away from (or 1
+    if that bound is infinite)"""
+    v = np.ones_like(x)
+    dv = np.zeros_like(x)
+    mask = (g < 0) & np.isfinite(upper)
+    v[mask] = upper[mask] - x[mask]
+    dv[mask] = -1
+    mask = (g > 0) & np.isfinite(lower)
+    v[mask] = x[mask] - lower[mask]
+    dv[mask] = 1
+    return v, dv
+
+
+def _strictly_feasible(x, lower, upper, rstep):
+    """Move the values of each row on (or beyond) a bound just inside it:
+    by rstep relative to the bound, or to the next float if rstep is 0"""
+    x = x.copy()
+    if rstep == 0:
+        on_lower = x <= lower
+        on_upper = x >= upper
+        x[on_lower] = np.nextafter(lower[on_lower], upper[on_lower])
+        x[on_upper] = np.nextafter(upper[on_upper], lower[on_upper])
+    else:
+        lower_distance = x - lower
+        upper_distance = upper - x
+        on_lower = np.isfinite(lower) & (lower_distance <= np.minimum(
+            upper_distance, rstep * np.maximum(1, np.abs(lower))))
+        on_upper = np.isfinite(upper) & (upper_distance <= np.minimum(
+            lower_distance, rstep * np.maximum(1, np.abs(upper))))
+        x[on_lower] = lower[on_lower] + \
+            rstep * np.maximum(1, np.abs(lower[on_lower]))
+        x[on_upper] = upper[on_upper] - \
+            rstep * np.maximum(1, np.abs(upper[on_upper]))
+    return x
+
+
+def _solve_trust_region(lengths, uf, s, vt, delta, damping):
+    """Solve the trust-region subproblem of each row from the SVD of its
+    augmented Jacobian (as scipy's solve_lsq_trust_region does): take the
+    Gauss-Newton step if it is inside the trust region, otherwise find the
+    Levenberg-Marquardt parameter that puts the step on its edge. Return
+    the steps and the parameters"""
+    suf = s * uf
+    with np.errstate(divide='ignore', invalid='ignore'):
+        full_rank = (lengths >= PARAMETER_COUNT) & \
+            (s[:, -1] > EPS * lengths * s[:, 0])
+        gauss_newton = -np.einsum('lji,lj->li', vt,
+                                  np.where(full_rank[:, None], uf / s, 0.0))
+        inside = full_rank & (np.linalg.norm(gauss_newton, axis=1) <= delta)
+
+        def phi_and_derivative(alpha):
+            denominator = s ** 2 + alpha[:, None]
+            step_norm = np.linalg.norm(suf / denominator, axis=1)
+            return step_norm - delta, \
+                -np.sum(suf ** 2 / denominator ** 3, axis=1) / step_norm
+
+        alpha_upper = np.linalg.norm(suf, axis=1) / delta
+        phi, phi_prime = phi_and_derivative(np.zeros(len(delta)))
+        alpha_lower = np.where(full_rank, -phi / phi_prime, 0.0)
+        restart = ~full_rank & (damping == 0)
+        alpha = np.where(restart, np.maximum(
+            0.001 * alpha_upper, (alpha_lower * alpha_upper) ** 0.5),
+            damping)
+        searching = ~inside
+        for _ in range(TRUST_REGION_ITERATIONS):
+            outside = searching & ((alpha < alpha_lower) |
+                                   (alpha > alpha_upper))
+            alpha = np.where(outside, np.maximum(
+                0.001 * alpha_upper, (alpha_lower * alpha_upper) ** 0.5),
+                alpha)
+            phi, phi_prime = phi_and_derivative(alpha)
+            alpha_upper = np.where(searching & (phi < 0), alpha, alpha_upper)
+            ratio = phi / phi_prime
+            alpha_lower = np.where(searching,
+                                   np.maximum(alpha_lower, alpha - ratio),
+                                   alpha_lower)
+            alpha = np.where(searching,
+                             alpha - (phi + delta) * ratio / delta, alpha)
+            searching = searching & ~(np.abs(phi) < TRUST_REGION_RTOL * delta)
+            if not np.any(searching):
+                break
+        step = -np.einsum('lji,lj->li', vt, suf / (s ** 2 + alpha[:, None]))
+        step *= (delta / np.linalg.norm(step, axis=1))[:, None]
+    step = np.where(inside[:, None], gauss_newton, step)
+    return step, np.where(inside, 0.0, alpha)
+
+
+def _step_to_bound(x, s, lower, upper):
+    """Return the multiple of s that takes each row of x to its nearest
+    bound, and which values hit it (-1 for the lower bound, 1 for the
+    upper, 0 if not hit)"""
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        steps = np.where(s != 0, np.maximum((lower - x) / s,
+                                            (upper - x) / s), np.inf)
+    min_step = np.min(steps, axis=1)
+    hits = (steps == min_step[:, None]) * np.sign(s).astype(int)
+    return min_step, hits
+
+
+def _quadratic(jacobian, g, s, diagonal):
+    """Return 0.5 * s.(J.J + diag).s + g.s for each row"""
+    js = np.einsum('lni,li->ln', jacobian, s)
+    return 0.5 * (np.einsum('ln,ln->l', js, js) +
+                  np.einsum('li,li->l', s * diagonal, s)) + \
+        np.einsum('li,li->l', s, g)
+
+
+def _line_quadratic(jacobian, g, s, diagonal, s0):
+    """Return the coefficients (a, b, c) of the quadratic in t given by
+    _quadratic at s0 + s * t for each row"""
+    v = np.einsum('lni,li->ln', jacobian, s)
+    u = np.einsum('lni,li->ln', jacobian, s0)
+    a = 0.5 * (np.einsum('ln,ln->l', v, v) +
+               np.einsum('li,li->l', s * diagonal, s))
+    b = np.einsum('li,li->l', g, s) + np.einsum('ln,ln->l', u, v) + \
+        np.einsum('li,li->l', s0 * diagonal, s)
+    c = 0.5 * np.einsum('ln,ln->l', u, u) + np.einsum('li,li->l', g, s0) + \
+        0.5 * np.einsum('li,li->l', s0 * diagonal, s0)
+    return a, b, c
+
+
+def _minimize_line_quadratic(a, b, c, lower, upper):
+    """Return the t between lower and upper at which a * t**2 + b * t + c is
+    smallest, and that smallest value, for each row"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        extremum = np.where(a != 0, -0.5 * b / a, lower)
+    interior = (a != 0) & (lower < extremum) & (extremum < upper)
+    t = np.stack((lower, upper, extremum), axis=1)
+    y = t * (a[:, None] * t + b[:, None]) + c[:, None]
+    y[~interior, 2] = np.inf
+    best = np.argmin(y, axis=1)
+    rows = np.arange(len(a))
+    return t[rows, best], y[rows, best]
+
+
+def _select_step(x, jacobian_h, diagonal_h, g_h, p, p_h, d, delta, lower,
+                 upper, theta):
+    """Choose the step of each row as the Trust Region Reflective algorithm
+    does (as scipy's select_step): the trust-region step if it stays within
+    the bounds, otherwise the best of that step cut short of the bound, its
+    reflection off the bound and the cut-short steepest descent step.
+    Return the steps, the steps in the scaled variables and the predicted
+    reductions in cost"""
+    step = p.copy()
+    step_h = p_h.copy()
+    predicted = -_quadratic(jacobian_h, g_h, p_h, diagonal_h)
+    outside = np.flatnonzero(np.any((x + p < lower) | (x + p > upper),
+                                    axis=1))
+    if not len(outside):
+        return step, step_h, predicted
+    x, p, p_h, d = x[outside], p[outside], p_h[outside], d[outside]
+    jacobian_h, diagonal_h, g_h = jacobian_h[outside], diagonal_h[outside], \
+        g_h[outside]
+    delta, lower, upper, theta = delta[outside], lower[outside], \
+        upper[outside], theta[outside]
+
+    p_stride, hits = _step_to_bound(x, p, lower, upper)
+    r_h = np.where(hits != 0, -p_h, p_h)
+    r = d * r_h
+    p = p * p_stride[:, None]
+    p_h = p_h * p_stride[:, None]
+    on_bound = x + p
+
+    # The reflected direction leaves either the feasible region or the
+    # trust region first
+    a = np.einsum('li,li->l', r_h, r_h)
+    b = np.einsum('li,li->l', p_h, r_h)
+    c = np.einsum('li,li->l', p_h, p_h) - delta ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        q = -(b + np.copysign(np.sqrt(b * b - a * c), b))
+        to_trust_region = np.maximum(q / a, c / q)
+    to_bound, _ = _step_to_bound(on_bound, r, lower, upper)
+    r_stride = np.minimum(to_bound, to_trust_region)
+    positive = r_stride > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r_lower = np.where(positive, (1 - theta) * p_stride / r_stride, 0.0)
+    r_upper = np.where(positive, np.where(r_stride == to_bound,
+                                          theta * to_bound, to_trust_region),
+                       -1.0)
+    reflect = r_lower <= r_upper
+    a, b, c = _line_quadratic(jacobian_h, g_h, r_h, diagonal_h, p_h)
+    r_stride, r_value = _minimize_line_quadratic(
+        a, b, c, np.where(reflect, r_lower, 0.0),
+        np.where(reflect, r_upper, 0.0))
+    r_h = r_h * r_stride[:, None] + p_h
+    r = r_h * d
+    r_value = np.where(reflect, r_value, np.inf)
+
+    # Step back from the bound to stay strictly inside
+    p = p * theta[:, None]
+    p_h = p_h * theta[:, None]
+    p_value = _quadratic(jacobian_h, g_h, p_h, diagonal_h)
+
+    ag_h = -g_h
+    ag = d * ag_h
+    to_trust_region = delta / np.linalg.norm(ag_h, axis=1)
+    to_bound, _ = _step_to_bound(x, ag, lower, upper)
+    ag_stride = np.where(to_bound < to_trust_region, theta * to_bound,
+                         to_trust_region)
+    a, b, c = _line_quadratic(jacobian_h, g_h, ag_h, diagonal_h,
+                              np.zeros_like(ag_h))
+    ag_stride, ag_value = _minimize_line_quadratic(
+        a, b, np.zeros_like(a), np.zeros_like(a), ag_stride)
+    ag_h = ag_h * ag_stride[:, None]
+    ag = ag * ag_stride[:, None]
+
+    use_p = (p_value < r_value) & (p_value < ag_value)
+    use_r = ~use_p & (r_value < p_value) & (r_value < ag_value)
+    chosen = np.where(use_p[:, None], p, np.where(use_r[:, None], r, ag))
+    chosen_h = np.where(use_p[:, None], p_h,
+                        np.where(use_r[:, None], r_h, ag_h))
+    step[outside] = chosen
+    step_h[outside] = chosen_h
+    predicted[outside] = -np.where(use_p, p_value,
+                                   np.where(use_r, r_value, ag_value))
+    return step, step_h, predicted
+
+
+def _update_radius(delta, reduction, predicted, step_norm, bound_hit):
+    """Return the new trust region radius of each row and the ratio of the
+    actual to the predicted reduction in cost"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(predicted > 0, reduction / predicted,
+                         np.where((predicted == 0) & (reduction == 0),
+                                  1.0, 0.0))
+    delta = np.where(ratio < 0.25, 0.25 * step_norm,
+                     np.where((ratio > 0.75) & bound_hit, 2.0 * delta,
+                              delta))
+    return delta, ratio
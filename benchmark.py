@@ -0,0 +1,229 @@
+# coding=utf-8
+"""
+Time each stage of the MAIC pipeline on synthetic input data and report the
+results in a machine-readable form (JSON or tab-separated) so that
+throughput can be tracked over time.
+
+Usage: python benchmark.py [options] (see python benchmark.py -h)
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+from cross_validation import build_cross_validation, POST_ITERATION_CALLBACK
+from entitylist_builder import EntityListBuilder
+from file_reader import FileReader
+from fixed_point_solver import AcceleratedSolver, PICARD, \
+    SOLVER_METHODS
+from gauss_seidel_engine import GaussSeidelEngine
+from genescores_dumper import AllScoresGeneScoresDumper
+from synthetic_data import SyntheticDataGenerator
+from vectorized_engine import VectorizedEngine
+
+BENCHMARK_COLUMNS = ['stage', 'model', 'iteration', 'items', 'seconds']
+CURVE_FIT_MODELS = ['exponential', 'knn', 'polynomial', 'svr']
+
+
+class IterationTimer(object):
+    """Record the wall time taken by each iteration of a CrossValidation
+    analysis. Register it with CrossValidation.register_callback as a
+    POST_ITERATION_CALLBACK and call start() just before running"""
+
+    def __init__(self):
+        self.last_mark = None
+        self.iteration_times = []
+
+    def start(self):
+        self.last_mark = time.perf_counter()
+
+    def do_callback(self, cross_validation=None, iteration=None):
+        now = time.perf_counter()
+        self.iteration_times.append((iteration, now - self.last_mark))
+        self.last_mark = now
+
+
+class Benchmark(object):
+    """Run the stages of the MAIC pipeline one at a time on a synthetic
+    input file, timing each one"""
+
+    def __init__(self, generator, weight_function='exponential',
+                 engine='object', curve_fit_models=None, stability=0.01,
+                 max_iterations=100, solver=PICARD):
+        self.generator = generator
+        self.weight_function = weight_function
+        self.engine = engine
+        self.curve_fit_models = CURVE_FIT_MODELS \
+            if curve_fit_models is None else curve_fit_models
+        self.stability = stability
+        self.max_iterations = max_iterations
+        self.solver = solver
+        self.results = []
+
+    def record(self, stage, seconds, items, model='', iteration=''):
+        self.results.append(dict(stage=stage, model=model,
+                                 iteration=iteration, items=items,
+                                 seconds=seconds))
+
+    def run(self):
+        """Run every stage and return the list of results"""
+        work_folder = tempfile.mkdtemp(prefix='maic-benchmark-')
+        try:
+            input_file = os.path.join(work_folder, 'input.txt')
+            self.generator.write(input_file)
+            lines = self.time_read(input_file)
+            cross_validation = self.time_build(lines)
+            self.time_analysis(cross_validation)
+            self.time_curve_fits(lines, cross_validation)
+            self.time_final_scores(cross_validation)
+            self.time_dump(cross_validation, work_folder + os.sep)
+        finally:
+            shutil.rmtree(work_folder, ignore_errors=True)
+        return self.results
+
+    def time_read(self, input_file):
+        start = time.perf_counter()
+        lines = list(FileReader.iter_lines(input_file))
+        self.record('read', time.perf_counter() - start, len(lines))
+        return lines
+
+    def time_build(self, lines):
+        start = time.perf_counter()
+        cross_validation = build_cross_validation(
+            lines, EntityListBuilder(self.weight_function),
+            self.stability, self.max_iterations)
+        self.record('build', time.perf_counter() - start,
+                    len(cross_validation.entities),
+                    model=self.weight_function)
+        return cross_validation
+
+    def time_analysis(self, cross_validation):
+        """Time each iteration and the work done after the last one"""
+        if self.engine == 'vectorized':
+            cross_validation.engine = VectorizedEngine()
+        elif self.engine == 'gauss-seidel':
+            cross_validation.engine = GaussSeidelEngine()
+        if self.solver != PICARD:
+            cross_validation.solver = AcceleratedSolver(self.solver)
+        timer = IterationTimer()
+        cross_validation.register_callback(POST_ITERATION_CALLBACK, timer)
+        timer.start()
+        cross_validation.run_analysis()
+        finish_time = time.perf_counter() - timer.last_mark
+        for iteration, seconds in timer.iteration_times:
+            self.record('iteration', seconds,
+                        len(cross_validation.entity_lists),
+                        model=self.weight_function, iteration=iteration)
+        self.record('finish', finish_time, len(cross_validation.entity_lists),
+                    model=self.weight_function)
+
+    def time_curve_fits(self, lines, cross_validation):
+        """Time fitting the curve of every ranked list once, for each of the
+        models, using the scores from the analysis"""
+        scores = dict((x.name, x.score) for x in cross_validation.entities)
+        for model in self.curve_fit_models:
+            builder = EntityListBuilder(model)
+            for line in lines:
+                builder.build_list_from_string(line)
+            for entity in builder.entities():
+                entity.score = scores[entity.name]
+            ranked = [x for x in builder.entity_lists()
+                      if x.uses_fitted_weights and len(x)]
+            for entity_list in ranked:
+                entity_list.calculate_new_weight(fit_curve=False)
+            start = time.perf_counter()
+            for entity_list in ranked:
+                entity_list.refit()
+            self.record('curve_fit', time.perf_counter() - start, len(ranked),
+                        model=model)
+
+    def time_final_scores(self, cross_validation):
+        start = time.perf_counter()
+        cross_validation.calculate_final_corrected_scores()
+        self.record('final_scores', time.perf_counter() - start,
+                    len(cross_validation.entities))
+
+    def time_dump(self, cross_validation, output_folder):
+        start = time.perf_counter()
+        AllScoresGeneScoresDumper(cross_validation, output_folder).dump()
+        self.record('dump', time.perf_counter() - start,
+                    len(cross_validation.entities))
+
+
+def format_results(results, output_format, parameters=None):
+    """Return the benchmark results as a JSON document (including the
+    parameters of the run) or as tab-separated lines"""
+    if output_format == 'json':
+        return json.dumps(dict(parameters=parameters or {},
+                               python=platform.python_version(),
+                               platform=platform.platform(),
+                               timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+                               results=results), indent=2) + '\n'
+    lines = ['\t'.join(BENCHMARK_COLUMNS)]
+    for result in results:
+        lines.append('\t'.join(str(result[x]) for x in BENCHMARK_COLUMNS))
+    return '\n'.join(lines) + '\n'
+
+
+def get_parsed_options(args=None):
+    parser = argparse.ArgumentParser(
+        description="Time each stage of the MAIC pipeline on synthetic data")
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--ranked-lists', type=int, default=10)
+    parser.add_argument('--unranked-lists', type=int, default=10)
+    parser.add_argument('--min-length', type=int, default=20)
+    parser.add_argument('--max-length', type=int, default=2000)
+    parser.add_argument('--signal-entities', type=int, default=1000)
+    parser.add_argument('--noise-entities', type=int, default=20000)
+    parser.add_argument('--signal-fraction', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-w', '--weight-function', default='exponential',
+                        choices=CURVE_FIT_MODELS + ['none'],
+                        help='weights curve used by the analysis (default: '
+                             'exponential)')
+    parser.add_argument('-e', '--engine', default='object',
+                        choices=['object', 'vectorized', 'gauss-seidel'])
+    parser.add_argument('--solver', default=PICARD, choices=SOLVER_METHODS,
+                        help='fixed-point solver used by the analysis '
+                             '(default: picard, plain iteration)')
+    parser.add_argument('-m', '--models', nargs='*', default=CURVE_FIT_MODELS,
+                        choices=CURVE_FIT_MODELS,
+                        help='models whose curve fitting is timed '
+                             '(default: all)')
+    parser.add_argument('--format', default='json', choices=['json', 'tsv'])
+    parser.add_argument('-o', '--output', default=None,
+                        help='file to write the results to (default: stdout)')
+    return parser.parse_args(args)
+
+
+def main(args):
+    options = get_parsed_options(args)
+    generator = SyntheticDataGenerator(
+        categories=options.categories, ranked_lists=options.ranked_lists,
+        unranked_lists=options.unranked_lists,
+        min_length=options.min_length, max_length=options.max_length,
+        signal_entities=options.signal_entities,
+        noise_entities=options.noise_entities,
+        signal_fraction=options.signal_fraction, seed=options.seed)
+    benchmark = Benchmark(generator, weight_function=options.weight_function,
+                          engine=options.engine, solver=options.solver,
+                          curve_fit_models=options.models)
+    results = benchmark.run()
+    output = format_results(results, options.format,
+                            parameters=dict(vars(options)))
+    if options.output:
+        with io.open(options.output, 'w') as out_stream:
+            out_stream.write(output)
+    else:
+        sys.stdout.write(output)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,238 @@
+"""
+Code relating to deciding when a CrossValidation analysis has converged,
+with stopping criteria beyond the fixed absolute change in list weight, and
+to accelerating its convergence
+"""
+import logging
+from math import ceil, log
+
+import numpy as np
+
+from utils import tab_separated_lines, write_report
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+CONVERGENCE_COLUMNS = ['iteration', 'delta', 'relative_delta',
+                       'top_n_changed', 'extrapolated']
+# Reasons for stopping the analysis
+STOP_ABSOLUTE = 'absolute'
+STOP_RELATIVE = 'relative'
+STOP_RANKS = 'ranks'
+STOP_MAX_ITERATIONS = 'max_iterations'
+# Aitken extrapolation is only applied to values whose successive changes
+# shrink by at least this factor, so that it never takes a huge step
+MAX_AITKEN_RATIO = 0.95
+
+
+class ConvergenceMonitor(object):
+    """Decide, after each iteration of a CrossValidation analysis, whether
+    it has converged. Set it as the CrossValidation's convergence attribute.
+
+    As well as the usual test (the biggest absolute change in list weight
+    is no more than the CrossValidation's threshold) the analysis stops
+    when the biggest change in list weight relative to the weight is no
+    more than relative_tolerance, or when the order of the top_n entities
+    has not changed for rank_patience iterations (each of these only if
+    set).
+
+    If aitken is True then, whenever three iterations have been run since
+    the last extrapolation, the list weights (and the fitted weights of
+    ranked lists) are replaced by their Aitken delta-squared extrapolation,
+    jumping closer to the fixed point.
+
+    The number of iterations saved is estimated by projecting the rate at
+    which the change in list weight was shrinking (before any
+    extrapolation) forward to the point at which it would have passed the
+    absolute test"""
+
+    def __init__(self, relative_tolerance=None, top_n=None, rank_patience=3,
+                 aitken=False):
+        self.relative_tolerance = relative_tolerance
+        self.top_n = top_n
+        self.rank_patience = rank_patience
+        self.aitken = aitken
+        self.reset()
+
+    def reset(self):
+        self.records = []
+        self.stop_reason = None
+        self.projected_iterations = None
+        self._deltas = []
+        self._top_entities = None
+        self._stable_iterations = 0
+        self._history = []
+        self._extrapolations = 0
+
+    def check(self, cross_validation, iteration, delta):
+        """Return True if the analysis should stop after this iteration,
+        extrapolating the list weights first if it should not"""
+        if iteration == 1:
+            self.reset()
+        self._deltas.append(delta)
+        relative_delta = self.relative_delta(cross_validation)
+        top_n_changed = self.update_top_entities(cross_validation)
+        self.stop_reason = self.test(cross_validation, iteration, delta,
+                                     relative_delta)
+        extrapolated = 0
+        if self.stop_reason is None and self.aitken:
+            extrapolated = self.accelerate(cross_validation)
+        self.records.append(dict(iteration=iteration, delta=delta,
+                                 relative_delta=relative_delta,
+                                 top_n_changed=top_n_changed,
+                                 extrapolated=extrapolated))
+        if self.stop_reason:
+            self.project(cross_validation)
+            logger.info("Converged ({}) after {} iterations; about {} "
+                        "iterations saved".format(self.stop_reason, iteration,
+                                                  self.iterations_saved))
+        return self.stop_reason is not None
+
+    def resume(self, cross_validation, iteration, delta):
+        """Start monitoring an analysis carried on from the given iteration
+        (e.g. one restored from a checkpoint), whose lists changed by at
+        most delta in it (None if they have not been weighted). Return True
+        if the analysis had already met the stopping criteria there. The
+        rank test needs the iterations before, so it only counts from
+        here"""
+        self.reset()
+        if delta is None:
+            return False
+        self._deltas.append(delta)
+        self.update_top_entities(cross_validation)
+        self.stop_reason = self.test(cross_validation, iteration, delta,
+                                     self.relative_delta(cross_validation))
+        return self.stop_reason is not None
+
+    def test(self, cross_validation, iteration, delta, relative_delta):
+        """Return the reason the analysis should stop after this iteration,
+        or None if it should carry on"""
+        if not delta > cross_validation.threshold:
+            return STOP_ABSOLUTE
+        if self.relative_tolerance is not None and \
+                relative_delta <= self.relative_tolerance:
+            return STOP_RELATIVE
+        if self.top_n and self._stable_iterations >= self.rank_patience:
+            return STOP_RANKS
+        if iteration >= cross_validation.max_iterations:
+            return STOP_MAX_ITERATIONS
+        return None
+
+    @staticmethod
+    def relative_delta(cross_validation):
+        """Return the biggest change in list weight relative to the weight
+        at the last iteration"""
+        relative_delta = 0.0
+        for entity_list in cross_validation.entity_lists:
+            if entity_list.weight:
+                relative_delta = max(relative_delta, abs(
+                    entity_list.delta / entity_list.weight))
+        return relative_delta
+
+    def update_top_entities(self, cross_validation):
+        """Note the top_n entities in score order and return whether they
+        have changed since the last iteration"""
+        if not self.top_n:
+            return False
+        scores = np.array([x.score for x in cross_validation.entities],
+                          dtype=np.float64)
+        order = np.argsort(-scores, kind='stable')[:self.top_n]
+        top_entities = tuple(order.tolist())
+        changed = top_entities != self._top_entities
+        self._stable_iterations = 0 if changed else \
+            self._stable_iterations + 1
+        self._top_entities = top_entities
+        return changed
+
+    def accelerate(self, cross_validation):
+        """Record the list weights and, once there are three successive
+        sets of them, replace them with their Aitken extrapolation. Return
+        the number of values extrapolated"""
+        state = [self.list_state(x) for x in cross_validation.entity_lists]
+        self._history.append(state)
+        if len(self._history) < 3:
+            return 0
+        if self.projected_iterations is None:
+            self.project(cross_validation)
+        extrapolated = 0
+        for entity_list, x0, x1, x2 in zip(cross_validation.entity_lists,
+                                           *self._history):
+            if x0 is None or x1 is None or x2 is None or \
+                    not len(x0) == len(x1) == len(x2):
+                continue
+            d1 = x1 - x0
+            d2 = x2 - x1
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = d2 / d1
+            usable = (d1 != 0) & (np.abs(ratio) < MAX_AITKEN_RATIO) & \
+                (ratio != 0)
+            if not usable.any():
+                continue
+            new_state = x2.copy()
+            new_state[usable] += d2[usable] * ratio[usable] / \
+                (1.0 - ratio[usable])
+            self.set_list_state(entity_list, new_state)
+            extrapolated += int(usable.sum())
+        self._history = []
+        self._extrapolations += 1
+        return extrapolated
+
+    @staticmethod
+    def list_state(entity_list):
+        """Return the weights that the list gives its entities, or None if
+        they are not available"""
+        if entity_list.uses_fitted_weights:
+            if len(entity_list.weights_list) != len(entity_list):
+                return None
+            return np.array(entity_list.weights_list, dtype=np.float64)
+        return np.array([entity_list.weight], dtype=np.float64)
+
+    @staticmethod
+    def set_list_state(entity_list, values):
+        if entity_list.uses_fitted_weights:
+            entity_list.weights_list = values.tolist()
+        else:
+            entity_list.weight = float(values[0])
+
+    def project(self, cross_validation):
+        """Estimate (once) how many iterations the absolute test alone
+        would have needed, from the rate at which the change in list
+        weight was shrinking over the last two iterations"""
+        if self.projected_iterations is not None:
+            return
+        iterations = len(self._deltas)
+        projected = iterations
+        if len(self._deltas) >= 2 and \
+                self._deltas[-1] > cross_validation.threshold:
+            previous, current = self._deltas[-2:]
+            if 0 < current < previous:
+                projected += int(ceil(
+                    log(cross_validation.threshold / current) /
+                    log(current / previous)))
+            else:
+                projected = cross_validation.max_iterations
+        self.projected_iterations = min(projected,
+                                        cross_validation.max_iterations)
+
+    @property
+    def iterations(self):
+        return len(self.records)
+
+    @property
+    def iterations_saved(self):
+        if self.projected_iterations is None:
+            return 0
+        return max(0, self.projected_iterations - self.iterations)
+
+    def dump(self, output_folder=None):
+        """Write the convergence record of each iteration and a summary to
+        a tab-separated file in the output folder (or to the log if there
+        is no output folder)"""
+        lines = tab_separated_lines(CONVERGENCE_COLUMNS, self.records)
+        lines.append("# stopped ({}) after {} iterations, {} "
+                     "extrapolations; estimated iterations saved: "
+                     "{}\n".format(self.stop_reason, self.iterations,
+                                   self._extrapolations,
+                                   self.iterations_saved))
+        write_report(lines, output_folder, 'convergence.txt', "Convergence",
+                     logger)
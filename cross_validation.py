@@ -1,10 +1,26 @@
 import logging
+from contextlib import contextmanager
 
 import numpy
 
 from entity import Entity
 
 POST_ITERATION_CALLBACK = 'iteration'
+# Called at the very end of each iteration, once the convergence test and
+# any solver or extrapolation step have set the weights the next one uses
+POST_STEP_CALLBACK = 'step'
+PRE_PHASE_CALLBACK = 'pre_phase'
+POST_PHASE_CALLBACK = 'post_phase'
+
+# The phases of an analysis reported to PRE_PHASE_CALLBACK and
+# POST_PHASE_CALLBACK objects
+SCORING_PHASE = 'scoring'
+WEIGHTING_PHASE = 'weighting'
+FITTING_PHASE = 'fitting'
+PLOTTING_PHASE = 'plotting'
+DUMPING_PHASE = 'dumping'
+FINAL_SCORES_PHASE = 'final_scores'
+OUTPUT_PHASE = 'output'
 
 logging.basicConfig()
 logger = logging.getLogger(__name__)
@@ -35,15 +51,47 @@ class CrossValidation(object):
         self._fake_entities = []
         self.transform_methods = transform_methods
         self.plotter = None
-        self.callbacks = {POST_ITERATION_CALLBACK: []}
+        self.engine = None
+        self.curve_fitter = None
+        # writes the per-iteration output (plots and dumps) in the
+        # background if set
+        self.background_writer = None
+        # decides when the analysis has converged (see convergence.py) if
+        # set, rather than just the threshold
+        self.convergence = None
+        # chooses the list weights each iteration starts from (see
+        # fixed_point_solver.py) if set, rather than plain iteration
+        self.solver = None
+        # limits each iteration to the scores and weights that can have
+        # changed (see dirty_set.py) if set
+        self.dirty_set = None
+        self.iteration = 0
+        self.callbacks = {POST_ITERATION_CALLBACK: [],
+                          POST_STEP_CALLBACK: [],
+                          PRE_PHASE_CALLBACK: [],
+                          POST_PHASE_CALLBACK: []}
+
+    def run(self, resume=False):
+        """Run the analysis (carrying on from the current state if resume
+        is True - see run_analysis)"""
 
-    def run(self):
-        """Run the analysis."""
+        self.run_analysis(resume=resume)
+        with self.phase(FINAL_SCORES_PHASE):
+            self.calculate_final_corrected_scores()
+        # wait for any per-iteration output still being written
+        if self.background_writer:
+            with self.phase(DUMPING_PHASE):
+                self.background_writer.flush()
 
-        self.run_analysis()
-        for entity in self.entities:
-            entity.calculate_final_corrected_scores(
-                methods=self.transform_methods)
+    def calculate_final_corrected_scores(self):
+        """Calculate the final (corrected) scores of every Entity, using
+        the engine if one has been supplied"""
+        if self.engine:
+            self.engine.calculate_final_corrected_scores(self)
+        else:
+            for entity in self.entities:
+                entity.calculate_final_corrected_scores(
+                    methods=self.transform_methods)
 
     def replace_list(self, list_to_replace, replacement):
         """Replace a list in our set with another one. Because of list
@@ -66,8 +114,41 @@ class CrossValidation(object):
 
                 # Replace the old list with the new one
                 self.entity_lists[idx] = replacement
+                self.iteration = 0
+
+    def add_list(self, entity_list):
+        """Add a list (e.g. a new study) to the analysis. Its Entities that
+        are new to the analysis are added too"""
+        if entity_list not in self.entity_lists:
+            entity_list.tell_entities_to_remember()
+            self.entity_lists.append(entity_list)
+            self.lists_changed(added=entity_list)
 
-    def run_analysis(self):
+    def remove_list(self, entity_list):
+        """Remove a list from the analysis, along with any Entities left on
+        no list at all"""
+        if entity_list in self.entity_lists:
+            entity_list.tell_entities_to_forget()
+            self.entity_lists.remove(entity_list)
+            self.lists_changed(removed=entity_list)
+
+    def lists_changed(self, added=None, removed=None):
+        """Bring the Entities of the analysis up to date after a list has
+        been added or removed, and start counting iterations again. Fake
+        Entities (see get_or_create_entity) are left where they are. The
+        lists and Entities keep their weights and scores, so that the
+        changed analysis can be resumed from the fixed point of the old one
+        with run(resume=True) rather than starting from scratch"""
+        if added is not None:
+            known = set(self.entities)
+            known.update(self._fake_entities)
+            self.entities.extend(x for x in added if x not in known)
+        if removed is not None:
+            left = set(x for x in removed if not x.lists)
+            self.entities[:] = [x for x in self.entities if x not in left]
+        self.iteration = 0
+
+    def run_analysis(self, resume=False):
         """Perform the logic of the cross validation, repeatedly asking
         entities and lists to update their weights/scores until the biggest
         change in the list scores is less than the specified threshold or we
@@ -75,37 +156,154 @@ class CrossValidation(object):
         NOTE: we update entities first to seed the process, otherwise the
         first iteration produces no change in list weights and the cycle
         stops prematurely.
-        As a safety issue, reset everything before we start"""
-        for entity_list in self.entity_lists:
-            entity_list.reset()
-        for entity in self.entities:
-            entity.reset()
-        for entity in self._fake_entities:
-            entity.reset()
-
-        delta = self.threshold + 1
-        counter = self.max_iterations
-        iteration = 0
-        while counter > 0 and delta > self.threshold:
-            delta = 0
+        As a safety issue, reset everything before we start - unless resume
+        is True, in which case the analysis carries on from the current list
+        weights (e.g. those restored from a saved state, or those of a
+        converged analysis whose lists have since been changed), numbering
+        the iterations on from the current iteration"""
+        if not resume:
+            for entity_list in self.entity_lists:
+                entity_list.reset()
+            for entity in self.entities:
+                entity.reset()
+            for entity in self._fake_entities:
+                entity.reset()
+
+        if self.engine:
+            self.engine.prepare(self)
+        elif self.dirty_set:
+            self.dirty_set.prepare(self)
+
+        converged = False
+        iteration = self.iteration if resume else 0
+        counter = self.max_iterations - iteration
+        if iteration:
+            # carrying on from a saved iteration - which may have been the
+            # last one the analysis needed
+            deltas = [abs(x.delta) for x in self.entity_lists
+                      if x.delta is not None]
+            delta = max(deltas) if deltas else None
+            if self.convergence:
+                converged = self.convergence.resume(self, iteration, delta)
+            else:
+                converged = delta is not None and not delta > self.threshold
+        while counter > 0 and not converged:
             counter = counter - 1
             iteration += 1
-            # print(iteration,delta)
-            for entity in self.entities:  # TODO consolidate these two
-                entity.calculate_new_score()
-            for entity in self._fake_entities:
-                entity.calculate_new_score()
-            for entity_list in self.entity_lists:
-                delta = max(delta, abs(entity_list.calculate_new_weight()))
+            self.iteration = iteration
+            delta = self.iterate()
             if self.plotter:
-                self.plotter.plot_cross_validation(self,
-                                                   iteration_number=iteration)
+                with self.phase(PLOTTING_PHASE):
+                    self.plotter.plot_cross_validation(
+                        self, iteration_number=iteration)
             # pass control to everything that has registered an interest
-            for callback in self.callbacks[POST_ITERATION_CALLBACK]:
-                callback.do_callback(self, iteration)
+            with self.phase(DUMPING_PHASE):
+                for callback in self.callbacks[POST_ITERATION_CALLBACK]:
+                    callback.do_callback(self, iteration)
+            if self.convergence:
+                converged = self.convergence.check(self, iteration, delta)
+            else:
+                converged = not delta > self.threshold
+            if self.solver and not converged:
+                self.solver.step(self, iteration)
+            if self.callbacks[POST_STEP_CALLBACK]:
+                with self.phase(DUMPING_PHASE):
+                    for callback in self.callbacks[POST_STEP_CALLBACK]:
+                        callback.do_callback(self, iteration)
             logger.info(
                 "{iterations} iterations complete - delta = {delta}".format(
                     iterations=(self.max_iterations - counter), delta=delta))
+        self.refit_skipped_lists()
+        if self.engine:
+            self.engine.finish(self)
+
+    def iterate(self):
+        """Perform a single iteration of the analysis, updating the Entity
+        scores and then the EntityList weights. If an engine has been
+        supplied then it does the work. Return the biggest absolute change
+        in list weight"""
+        if self.engine:
+            return self.engine.iterate(self)
+        if self.dirty_set:
+            return self.iterate_dirty_set()
+        with self.phase(SCORING_PHASE):
+            for entity in self.entities:  # TODO consolidate these two
+                entity.calculate_new_score()
+            for entity in self._fake_entities:
+                entity.calculate_new_score()
+        return self.calculate_new_weights(self.entity_lists)
+
+    def iterate_dirty_set(self):
+        """Perform a single iteration of the analysis, asking the dirty_set
+        which Entity scores and EntityList weights need recalculating"""
+        with self.phase(SCORING_PHASE):
+            changed = []
+            for entity in self.dirty_set.entities_to_score(self):
+                old_score = entity.score
+                entity.calculate_new_score()
+                if entity.score != old_score:
+                    changed.append(entity)
+            entity_lists = self.dirty_set.lists_to_weight(self, changed)
+        return self.calculate_new_weights(entity_lists)
+
+    def calculate_new_weights(self, entity_lists):
+        """Calculate new weights for the EntityLists, then fit their weights
+        distributions as a separate phase. Return the biggest absolute
+        change in list weight"""
+        delta = 0
+        with self.phase(WEIGHTING_PHASE):
+            for entity_list in entity_lists:
+                delta = max(delta, abs(
+                    entity_list.calculate_new_weight(fit_curve=False)))
+        self.fit_deferred_lists(entity_lists)
+        return delta
+
+    def fit_deferred_lists(self, deferred):
+        """Fit the weights distributions of the lists whose fitting was
+        deferred while their weights were calculated. Those that the
+        curve_fitter can fit are passed to it together; the rest fit their
+        own curves"""
+        if deferred:
+            with self.phase(FITTING_PHASE):
+                fitter_lists = []
+                for entity_list in deferred:
+                    if self.curve_fitter and \
+                            self.curve_fitter.can_fit(entity_list):
+                        fitter_lists.append(entity_list)
+                    else:
+                        entity_list.update_fit()
+                if fitter_lists:
+                    self.curve_fitter.fit(fitter_lists)
+
+    def refit_skipped_lists(self):
+        """Make sure that the weights distribution of every list reflects
+        the final Entity scores by refitting any list whose fit was skipped
+        in the last iteration"""
+        with self.phase(FITTING_PHASE):
+            deferred = []
+            for entity_list in self.entity_lists:
+                if self.curve_fitter and \
+                        self.curve_fitter.can_fit(entity_list):
+                    deferred.append(entity_list)
+                else:
+                    entity_list.ensure_fitted()
+            if deferred:
+                self.curve_fitter.refit_skipped(deferred)
+
+    @contextmanager
+    def phase(self, phase_name, iteration=None):
+        """Wrap a phase of the analysis, calling the PRE_PHASE_CALLBACK
+        objects before it and the POST_PHASE_CALLBACK objects after it. The
+        context passed to them is a (phase_name, iteration) tuple, where the
+        iteration defaults to the current iteration"""
+        if iteration is None:
+            iteration = self.iteration
+        context = (phase_name, iteration)
+        for callback in self.callbacks[PRE_PHASE_CALLBACK]:
+            callback.do_callback(self, context)
+        yield
+        for callback in self.callbacks[POST_PHASE_CALLBACK]:
+            callback.do_callback(self, context)
 
     def register_callback(self, callback_type, callback_object):
         """Register an object to be called when a certain phase of the code
@@ -113,7 +311,8 @@ class CrossValidation(object):
         method called 'do_callback' that takes two arguments. The first is
         the CrossValidation object. The second is context dependent. For an
         iteration-related callback, the second argument is the iteration
-        number"""
+        number. For a phase-related callback, it is a (phase name, iteration
+        number) tuple"""
         if callback_type in self.callbacks:
             self.callbacks[callback_type].append(callback_object)
         else:
@@ -157,14 +356,15 @@ class CrossValidation(object):
 
 def build_cross_validation(lines, entity_list_builder, stability,
                            max_iterations, transform_methods=None):
-    """Given a set of input data lines, a pre-configured EntityListBuilder
-    and some values for stability and max_iterations, return a new
-    CrossValidation analysis object"""
+    """Given a set of input data lines (any iterable, e.g. the generator
+    from FileReader.iter_lines), a pre-configured EntityListBuilder and some
+    values for stability and max_iterations, return a new CrossValidation
+    analysis object"""
     list_of_lists = []
     for line in lines:
         list_of_lists.append(
             entity_list_builder.build_list_from_string(line))
-        logger.debug("line read '%s'" % line)
+        logger.debug("line read '%s'", line)
     # Grab a list of all known Entities from the EntityListBuilder
     all_entities = entity_list_builder.entities()
     logger.info("Input file read, list of Entities secured")
@@ -1,3 +1,4 @@
+from background_writer import write_in_background
 from genescores_dumper import IterationAwareGeneScoresDumper
 
 
@@ -10,4 +11,7 @@ class CrossValidationDumper(object):
     def do_callback(self, cross_validation=None, iteration=None):
         if cross_validation == self.dumper.cross_validation:
             self.dumper.iteration = iteration
-            self.dumper.dump()
+            # take the scores now, but write them in the background if the
+            # analysis has a BackgroundWriter
+            write_in_background(cross_validation, self.dumper.write,
+                                self.dumper.score_table())
@@ -1,62 +1,205 @@
-import matplotlib.pyplot as plt
-from genescores_dumper import AllScoresGeneScoresDumper
-from math import sqrt
+from math import ceil, sqrt
+from multiprocessing import Pool
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy as np
+
+from background_writer import write_in_background
+
+# The size (in inches) of the plot of each list and of each panel of a
+# multi-panel image
+PLOT_SIZE = (6.4, 4.8)
+PANEL_SIZE = (4.0, 3.0)
+# Fast PNG compression: encoding at the default level takes about a fifth
+# of the time needed to draw each plot and saves little space
+PNG_OPTIONS = dict(pil_kwargs=dict(compress_level=1))
+
+# The figure reused by plot_lists in this process (each worker process has
+# its own)
+_list_figure = None
+
+
+class ListAxes(object):
+    """One set of Axes plotting the weights of a list: the truncated list
+    weights, the fitted weights and the list weight. The lines are created
+    once and their data is replaced for each list drawn"""
+
+    def __init__(self, axes, legend=True):
+        self.axes = axes
+        self.legend = legend
+        self.truncated_line, = axes.plot([], [], label="Truncated list weight",
+                                         color="blue")
+        self.fitted_line, = axes.plot([], [], label="Fitted", color="pink")
+        self.weight_line, = axes.plot([], [], ':', label="weight",
+                                      color="grey")
+        # x-axis label
+        axes.set_xlabel('Slot')
+        # frequency label
+        axes.set_ylabel('Score')
+
+    def draw(self, title, truncated_list_weights, fitted_weights, weight):
+        x_values = np.arange(len(truncated_list_weights))
+        self.truncated_line.set_data(x_values, truncated_list_weights)
+        # the fitted weights are only shown when there is one per slot
+        show_fitted = len(fitted_weights) == len(x_values)
+        if show_fitted:
+            self.fitted_line.set_data(x_values, fitted_weights)
+            self.weight_line.set_data(x_values,
+                                      np.full(len(x_values), weight))
+        self.fitted_line.set_visible(show_fitted)
+        self.weight_line.set_visible(show_fitted)
+        self.axes.relim(visible_only=True)
+        self.axes.autoscale_view()
+        self.axes.set_title(title)
+        if self.legend:
+            handles = [self.truncated_line]
+            if show_fitted:
+                handles += [self.fitted_line, self.weight_line]
+            self.axes.legend(handles=handles)
+
+    def clear(self):
+        """Hide the Axes (a spare panel of a multi-panel image)"""
+        self.axes.set_visible(False)
+
+
+class ListFigure(object):
+    """A Figure holding a single ListAxes, reused for every list plotted"""
+
+    def __init__(self):
+        self.figure = Figure(figsize=PLOT_SIZE)
+        FigureCanvasAgg(self.figure)
+        self.list_axes = ListAxes(self.figure.add_subplot())
+
+    def save(self, file_path, title, truncated_list_weights, fitted_weights,
+             weight):
+        self.list_axes.draw(title, truncated_list_weights, fitted_weights,
+                            weight)
+        self.figure.savefig(file_path, **PNG_OPTIONS)
+
+
+class PanelFigure(object):
+    """A Figure with one panel per list, reused for every iteration"""
+
+    def __init__(self, panel_count):
+        self.panel_count = panel_count
+        columns = int(ceil(sqrt(panel_count)))
+        rows = int(ceil(panel_count / float(columns)))
+        self.figure = Figure(figsize=(PANEL_SIZE[0] * columns,
+                                      PANEL_SIZE[1] * rows))
+        FigureCanvasAgg(self.figure)
+        self.panels = [ListAxes(axes, legend=False) for axes in
+                       self.figure.subplots(rows, columns,
+                                            squeeze=False).ravel()]
+        for panel in self.panels[panel_count:]:
+            panel.clear()
+        first = self.panels[0]
+        self.figure.legend(
+            handles=[first.truncated_line, first.fitted_line,
+                     first.weight_line], loc='upper right')
+
+    def save(self, file_path, title, snapshot):
+        for panel, (name, truncated_list_weights, fitted_weights, weight) in \
+                zip(self.panels, snapshot):
+            panel.draw(name, truncated_list_weights, fitted_weights, weight)
+        self.figure.suptitle(title)
+        self.figure.savefig(file_path, **PNG_OPTIONS)
+
+
+def plot_title(name, iteration_number=None):
+    if iteration_number:
+        return "{list_name} - iteration {iteration}".format(
+            list_name=name, iteration=iteration_number)
+    return name
+
+
+def plot_file_path(directory_path, name, iteration_number=None):
+    return "{preceding}{list_name}-{iteration:03d}.png".format(
+        preceding=directory_path, list_name=name, iteration=iteration_number)
+
+
+def plot_lists(job):
+    """Draw and save the plot of each list in a (directory path, snapshot,
+    iteration) job, reusing this process's ListFigure. Run in the worker
+    processes as well as by CrossValidationPlotter itself"""
+    global _list_figure
+    directory_path, snapshot, iteration_number = job
+    if _list_figure is None:
+        _list_figure = ListFigure()
+    for name, truncated_list_weights, fitted_weights, weight in snapshot:
+        _list_figure.save(plot_file_path(directory_path, name,
+                                         iteration_number),
+                          plot_title(name, iteration_number),
+                          truncated_list_weights, fitted_weights, weight)
+
 
 class CrossValidationPlotter(object):
+    """Plot the weights of every list of a CrossValidation analysis at each
+    iteration, either as one image per list or (if panels is True) as a
+    single multi-panel image per iteration.
 
-    def __init__(self, directory_path=None):
+    The plots are drawn with matplotlib's object-oriented interface on the
+    Agg canvas (not pyplot), reusing the same Figure and lines for every
+    plot, and per-list plots can be drawn by a pool of worker processes"""
+
+    def __init__(self, directory_path=None, panels=False, workers=1):
         super(CrossValidationPlotter, self).__init__()
         if directory_path:
             self.directory_path = directory_path + "/"
         else:
             self.directory_path = ""
+        self.panels = panels
+        self.workers = workers
+        self._panel_figure = None
+        self._pool = None
 
     def plot_cross_validation(self, cross_validation, iteration_number=None):
-        for entity_list in cross_validation.entity_lists:
-            entities = entity_list.get_entities()
-            x_values = range(len(entities))
-
-            scores = [ent.score for ent in entities]
-
-            #plt.scatter(x_values, scores, label="Scores", color="green",marker="*", s=30)
-
-            truncated_list_weights = entity_list.get_truncated_weights_list()
-            plt.plot(x_values, truncated_list_weights,
-                     label="Truncated list weight", color="blue")
-            fitted_weights = entity_list.weights_list
-            if len(fitted_weights) == len(x_values):
-                plt.plot(x_values, fitted_weights, label="Fitted",
-                         color="pink")
-                plt.plot(x_values, [entity_list.weight for x in x_values], ':', label="weight",
-                         color="grey")
-            # x-axis label
-            plt.xlabel('Slot')
-            # frequency label
-            plt.ylabel('Score')
-            # plot title
-            if iteration_number:
-                title = "{list_name} - iteration {iteration}".format(
-                    list_name=entity_list.name, iteration=iteration_number)
-            else:
-                title = entity_list.name
-            plt.title(title)
-            # showing legend
-            plt.legend()
-            # function to save the plot
-            plot_filepath = "{preceding}{list_name}-" \
-                            "{iteration:03d}.png".format(
-                                preceding=self.directory_path,
-                                list_name=entity_list.name,
-                                iteration=iteration_number
-                            )
-            plt.savefig(plot_filepath)
-            plt.close()
-
-        gsd = AllScoresGeneScoresDumper(cross_validation, self.directory_path, ".{iteration:03d}".format(iteration=iteration_number))
-        gsd.dump()
-
-
-
+        """Plot the weights of every list. The data is taken straight away
+        but the plots are drawn in the background if the analysis has a
+        BackgroundWriter"""
+        write_in_background(cross_validation, self.draw_plots,
+                            self.snapshot(cross_validation),
+                            iteration_number)
 
+    @staticmethod
+    def snapshot(cross_validation):
+        """Return the (name, truncated weights, fitted weights, weight) of
+        every list - all that is needed to draw the plots"""
+        snapshot = []
+        for entity_list in cross_validation.entity_lists:
+            # the truncated weights list is a new, read-only array whenever
+            # it changes, so it needn't be copied
+            snapshot.append((entity_list.name,
+                             entity_list.get_truncated_weights_list(),
+                             np.array(entity_list.weights_list,
+                                      dtype=np.float64),
+                             entity_list.weight))
+        return snapshot
 
+    def draw_plots(self, snapshot, iteration_number=None):
+        """Draw and save the plots of the lists in the snapshot"""
+        if self.panels:
+            if self._panel_figure is None or \
+                    self._panel_figure.panel_count != len(snapshot):
+                self._panel_figure = PanelFigure(len(snapshot))
+            self._panel_figure.save(
+                "{}iteration-{:03d}.png".format(self.directory_path,
+                                                iteration_number),
+                plot_title("Iteration", iteration_number), snapshot)
+        elif self.workers < 2 or len(snapshot) < 2:
+            plot_lists((self.directory_path, snapshot, iteration_number))
+        else:
+            if self._pool is None:
+                self._pool = Pool(self.workers)
+            chunk_size = int(ceil(len(snapshot) / float(self.workers)))
+            self._pool.map(plot_lists, [
+                (self.directory_path, snapshot[idx:idx + chunk_size],
+                 iteration_number)
+                for idx in range(0, len(snapshot), chunk_size)])
 
+    def close(self):
+        """Shut down the pool of worker processes, if one was started"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
@@ -0,0 +1,127 @@
+"""
+Code relating to recalculating, at each iteration of a CrossValidation
+analysis, only the Entity scores and EntityList weights that can have
+changed
+"""
+import logging
+
+import numpy as np
+
+from utils import tab_separated_lines, write_report
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+DIRTY_SET_COUNTERS = ['iteration', 'entities_scored', 'entities_skipped',
+                      'lists_weighted', 'lists_skipped']
+
+
+class DirtySetTracker(object):
+    """Track which Entities and EntityLists of a CrossValidation analysis
+    need recalculating. Set it as the CrossValidation's dirty_set attribute
+    (it is used by the object-by-object iteration, not by an engine).
+
+    An Entity's score depends only on the weights its lists give it, so it
+    is only recalculated when one of those lists gives its members weights
+    that differ by more than epsilon from the weights they were last
+    scored with. A list's weight (and fit) depends only on the scores of
+    its members, so it is only recalculated when one of them has changed.
+    Lists that are not recalculated keep their weight and fitted weights,
+    with a delta of zero. Lists whose own weights have changed (e.g.
+    because a solver set them) or that have never been weighted are always
+    recalculated.
+
+    With an epsilon of zero the results are the same as recalculating
+    everything (as long as the curve fits do not depend on their previous
+    results, as they do with --warm-start); most of the work saved is on
+    the many entities that appear on a single list whose weight has
+    settled"""
+
+    def __init__(self, epsilon=0.0):
+        self.epsilon = epsilon
+        self.members = {}
+        self.iterations = []
+        self._scored_weights = {}
+        self._changed_lists = set()
+
+    def prepare(self, cross_validation):
+        """Build the index from each list to its members. Called once at
+        the start of each analysis"""
+        self.members = dict((x, list(x)) for x in
+                            cross_validation.entity_lists)
+        self._scored_weights = {}
+        self._changed_lists = set()
+        self.iterations = []
+
+    def entities_to_score(self, cross_validation):
+        """Return the Entities whose lists' weights have changed since the
+        Entities were last scored, noting the weights they are now scored
+        with"""
+        self._changed_lists = set()
+        for entity_list in cross_validation.entity_lists:
+            weights = entity_list.weights_vector()
+            last_weights = self._scored_weights.get(entity_list)
+            if last_weights is None or \
+                    last_weights.shape != weights.shape or \
+                    np.max(np.abs(weights - last_weights),
+                           initial=0.0) > self.epsilon:
+                self._scored_weights[entity_list] = weights
+                self._changed_lists.add(entity_list)
+        all_entities = cross_validation.entities + \
+            cross_validation._fake_entities
+        if len(self._changed_lists) == len(cross_validation.entity_lists):
+            # the usual case until some lists settle
+            entities = all_entities
+        else:
+            dirty = {}
+            for entity_list in cross_validation.entity_lists:
+                if entity_list in self._changed_lists:
+                    for entity in self.members[entity_list]:
+                        dirty[entity] = True
+            entities = list(dirty)
+        self.iterations.append(dict(
+            iteration=cross_validation.iteration,
+            entities_scored=len(entities),
+            entities_skipped=len(all_entities) - len(entities),
+            lists_weighted=0, lists_skipped=0))
+        return entities
+
+    def lists_to_weight(self, cross_validation, changed_entities):
+        """Return the lists that need their weights recalculating - those
+        with a member whose score has changed, those whose own weights have
+        changed and those never weighted - setting the delta of every other
+        list to zero"""
+        changed = None
+        lists = []
+        for entity_list in cross_validation.entity_lists:
+            if entity_list.delta is None or \
+                    entity_list in self._changed_lists:
+                lists.append(entity_list)
+                continue
+            if changed is None:
+                changed = set(changed_entities)
+            if any(x in changed for x in self.members[entity_list]):
+                lists.append(entity_list)
+            else:
+                entity_list.delta = 0.0
+        counters = self.iterations[-1]
+        counters['lists_weighted'] = len(lists)
+        counters['lists_skipped'] = len(cross_validation.entity_lists) - \
+            len(lists)
+        logger.debug("Iteration {iteration}: {entities_scored} entities "
+                     "scored ({entities_skipped} skipped), {lists_weighted} "
+                     "lists weighted ({lists_skipped} skipped)".format(
+                         **counters))
+        return lists
+
+    def totals(self):
+        """Return the total of each counter over the analysis"""
+        return dict((x, sum(y[x] for y in self.iterations))
+                    for x in DIRTY_SET_COUNTERS[1:])
+
+    def dump(self, output_folder=None):
+        """Write the counters of each iteration to a tab-separated file in
+        the output folder (or to the log if there is no output folder)"""
+        write_report(tab_separated_lines(DIRTY_SET_COUNTERS, self.iterations),
+                     output_folder, 'dirty_set.txt', "Dirty set counters",
+                     logger)
@@ -5,19 +5,38 @@ from entitylist import adjusted_weight
 from constants import T_METHOD_NONE
 
 
-class Entity:
-    """Represent an entity (e.g. a gene)."""
+class CompactEntity(object):
+    """Represent an entity (e.g. a gene) without a per-instance __dict__.
+    Only the attributes named in __slots__ can be set, which keeps the
+    memory used by each of the (many) Entities of a large analysis down."""
+
+    __slots__ = ('name', '__score', 'lists', '__weights',
+                 '__category_winners', 'adjusted_scores')
 
     def __init__(self, name):
         """Build a new Entity object."""
         assert name
         self.name = name
-        self.score = 1
         self.lists = []
-        self.__weights = {}
+        self.__score = 1
+        # The weight from each list, in the same order as self.lists
+        self.__weights = []
         self.__category_winners = {}
         self.adjusted_scores = {}
 
+    @property
+    def score(self):
+        """The score of this Entity. Changing it tells the lists this Entity
+        is on that one of their members' scores has changed"""
+        return self.__score
+
+    @score.setter
+    def score(self, score):
+        if score != self.__score:
+            self.__score = score
+            for lst in self.lists:
+                lst.scores_changed()
+
     def transformed_score(self, method=T_METHOD_NONE):
         """Return the transformed score for the requested transform method.
         If no matching score is found then return zero"""
@@ -39,12 +58,13 @@ class Entity:
         """
         if entity_list not in self.lists:
             self.lists.append(entity_list)
-            self.__weights[entity_list] = 0.0
+            self.__weights.append(0.0)
 
     def forget_list(self, entity_list):
         if entity_list in self.lists:
-            self.lists.remove(entity_list)
-            del self.__weights[entity_list]
+            index = self.lists.index(entity_list)
+            del self.lists[index]
+            del self.__weights[index]
 
     def calculate_final_corrected_scores(self, methods=None):
         """Having reached completion, we can now calculate the corrected or
@@ -94,33 +114,45 @@ class Entity:
 
     def calculate_new_score(self):
         """Calculate the new score for this Entity"""
-        # Set up some accumulators and a pair of dictionaries for tracking
-        # purposes
+        # Set up an accumulator and a dictionary for tracking purposes
         new_score = 0
         category_scores = {}
 
         # For each list in turn...
-        for lst in self.lists:
+        for index, lst in enumerate(self.lists):
             # Grab the weight and the transformed weight for this entity on
             # that list
             lst_weight = lst.get_weight_for_entity(self)
-            self.__weights[lst] = lst_weight
+            self.__weights[index] = lst_weight
 
             # If we've already got a score for this category then check to
             # see if this score is better. If it is, then forget the
             # previous value and use this one
             if lst.category in category_scores:
                 if lst_weight > category_scores[lst.category]:
-                    new_score -= category_scores[lst.category]
                     category_scores[lst.category] = lst_weight
-                    new_score += lst_weight
                     self.__category_winners[lst.category] = lst
             else:
                 category_scores[lst.category] = lst_weight
-                new_score += lst_weight
                 self.__category_winners[lst.category] = lst
+
+        # Sum the category maxima in the order in which the categories were
+        # first seen. The VectorizedEngine relies on this order to reproduce
+        # the score exactly
+        for category_score in category_scores.values():
+            new_score += category_score
         self.score = new_score
 
+    def set_calculated_score(self, score, weights, category_winners):
+        """Store a score calculated outside this Entity (e.g. by the
+        VectorizedEngine) along with the per-list weights and the winning
+        list for each category that produced it"""
+        self.score = score
+        for index, lst in enumerate(self.lists):
+            if lst in weights:
+                self.__weights[index] = weights[lst]
+        self.__category_winners = category_winners
+
     def score_from_list(self, entity_list):
         """Report the contribution of the given list to the current score"""
         return_value = 0.0
@@ -129,7 +161,8 @@ class Entity:
             if category in self.__category_winners:
                 if self.__category_winners[entity_list.category] == \
                         entity_list:
-                    return_value = self.__weights[entity_list]
+                    return_value = self.__weights[
+                        self.lists.index(entity_list)]
         return return_value
 
     def raw_score_from_list(self, entity_list):
@@ -137,9 +170,14 @@ class Entity:
         regardless of whether or not this list is the winner in its category"""
         return_value = 0.0
         if entity_list in self.lists:
-            return_value = self.__weights[entity_list]
+            return_value = self.__weights[self.lists.index(entity_list)]
         return return_value
 
+    def raw_scores_by_list(self):
+        """Return (list, score) pairs for each of the lists this entity is
+        on, where the score is the one reported by raw_score_from_list"""
+        return list(zip(self.lists, self.__weights))
+
     def winning_lists_by_category(self):
         """Return a dictionary of category->list pairs indicating the
         winning lists for each category"""
@@ -149,5 +187,8 @@ class Entity:
         """Reset an Entity so that we can re-run an analysis"""
         self.score = 1
         self.__category_winners = {}
-        for lst in self.__weights:
-            self.__weights[lst] = 0.0
+        self.__weights = [0.0] * len(self.lists)
+
+
+class Entity(CompactEntity):
+    """Represent an entity (e.g. a gene)."""
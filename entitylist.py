@@ -18,17 +18,43 @@ logger = logging.getLogger(__name__)
 # fails to fit a function successfully
 FAILED_RANKED_LIST_DESCENT_STEP = 0.00000001
 
+# Bounds on the parameters of the exponential_function when fitting it to
+# the weights of a ranked list
+EXPONENTIAL_FIT_BOUNDS = ([0, 0, 0.00000001, 0],
+                          [np.inf, np.inf, np.inf, np.inf])
+
+# Two fits of the same weights whose costs (sums of squared weighted
+# residuals) agree this closely are taken to have found the same minimum
+SAME_FIT_COST_RTOL = 0.00000001
+
+
+def same_fit_cost(cost, other_cost):
+    """Report whether two curve fits of the same data reached the same
+    minimum, judged by their costs"""
+    return abs(cost - other_cost) <= SAME_FIT_COST_RTOL * max(cost,
+                                                               other_cost)
+
+
+def exponential_function(x, a, b, c, d):
+    """The curve used by ExponentialEntityList to distribute its weight"""
+    return a * np.exp(-b * x) - c * x + d
+
 
 class EntityList(object):
     """Represent a list of Entity objects"""
 
     __list_category_counter = 0
     lock = Lock()
+    # True for lists that distribute their weight using a fitted
+    # weights_list rather than giving every Entity the list weight
+    uses_fitted_weights = False
+    # Skip refitting the weights_list if no member Entity's score has
+    # changed by at least this much since the last fit (zero never skips)
+    refit_tolerance = 0.0
 
     def __init__(self):
         """Build a default EntityList object."""
         self.__list = []
-        self.__seen = {}
         self.__entity_indexes_one_based = {}
         self.__total_entity_weight = 0.0
         self.__entity_count_minus_one = 1
@@ -42,6 +68,16 @@ class EntityList(object):
         self.need_local_baseline_base_score_mean = 0.0  # safe default values
         self.weights_list = [self.weight]
         self.ratio = 1
+        self.fit_skipped = False
+        # Number of curve fits completed over the lifetime of the list
+        self.fit_count = 0
+        # Bumped whenever a member Entity's score changes (or a member is
+        # added), so the caches below can tell in O(1) that none has
+        self.score_version = 0
+        self.__fitted_scores = None
+        self.__fitted_version = None
+        self.__truncated_version = None
+        self.__truncated_weights = None
 
     def reset(self):
         """Reset a list to a pre-calculation state"""
@@ -50,15 +86,21 @@ class EntityList(object):
         self.weights_list = [self.weight]
         self.ratio = 1
         self.delta = None
+        self.fit_skipped = False
+        self.__fitted_scores = None
+        self.__fitted_version = None
+        self.__truncated_version = None
+        self.__truncated_weights = None
         for lst in self.__list:
             lst.reset()
 
     def append(self, entity):
         """Add the Entity to the end of the list"""
-        if entity not in self.__seen:  # quicker than scanning the list
+        # quicker than scanning the list
+        if entity not in self.__entity_indexes_one_based:
             self.__list.append(entity)
-            self.__seen[entity] = 1
             entity.note_list(self)
+            self.scores_changed()
             self.__entity_indexes_one_based[entity] = len(self.__list)
 
     def tell_entities_to_forget(self):
@@ -68,42 +110,70 @@ class EntityList(object):
     def tell_entities_to_remember(self):
         for entity in self.__list:
             entity.note_list(self)
+        # scores that changed while the Entities had forgotten this list
+        # were not reported to it
+        self.scores_changed()
 
-    def get_entities(self):
-        return self.__seen
+    def scores_changed(self):
+        """Note that the score of a member Entity has changed"""
+        self.score_version += 1
 
     def get_truncated_weights_list(self):
-        y_vector = []
-        running_total = 0.0
-        counter = 1
-        for entity in self:
-            running_total += entity.score
-            y_vector.append(sqrt(running_total / counter))
-            counter += 1
-        return y_vector
-
-    def __setattr__(self, key, value):
         """
-        Intercept attribute setting and special case where required.
-
-        Setting category_name also sets category as a side-effect.
+        Return the square root of the running mean of the member Entity
+        scores (in list order) as a read-only NumPy array. The result is
+        cached and only recalculated when the member scores change.
+        """
+        if self.__truncated_version != self.score_version:
+            scores = self.member_scores()
+            y_vector = np.sqrt(np.cumsum(scores) /
+                               np.arange(1, len(scores) + 1))
+            y_vector.flags.writeable = False
+            self.__truncated_version = self.score_version
+            self.__truncated_weights = y_vector
+        return self.__truncated_weights
+
+    def member_scores(self):
+        """Return the scores of the member Entities, in list order, as a
+        NumPy array"""
+        return np.fromiter((x.score for x in self.__list), dtype=float,
+                           count=len(self.__list))
+
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        self._name = value.strip()
+
+    @property
+    def category_name(self):
+        return self._category_name
+
+    @category_name.setter
+    def category_name(self, value):
         """
-        if key == 'name':
-            value = value.strip()
-        if key == 'category_name':
-            value = value.strip()
-            if value:
-                category = re.sub(" +", "-", value.upper())
-            else:
-                EntityList.lock.acquire()
-                EntityList.__list_category_counter += 1
-                category = "Unknown-{:03d}".format(
-                    EntityList.__list_category_counter)
-                EntityList.lock.release()
-            super(EntityList, self).__setattr__('category', category)
-        elif key == 'category':
-            raise AttributeError("Can't set 'category' attribute directly")
-        super(EntityList, self).__setattr__(key, value)
+        Setting category_name also sets category as a side-effect. The
+        category is derived here, once, rather than every time it is read.
+        """
+        value = value.strip()
+        if value:
+            category = re.sub(" +", "-", value.upper())
+        else:
+            EntityList.lock.acquire()
+            EntityList.__list_category_counter += 1
+            category = "Unknown-{:03d}".format(
+                EntityList.__list_category_counter)
+            EntityList.lock.release()
+        self._category = category
+        self._category_name = value
+
+    @property
+    def category(self):
+        """The category of the list, derived from the category_name. It
+        can't be set directly"""
+        return self._category
 
     def __len__(self):
         """Report the length of the list of Entity objects"""
@@ -113,26 +183,139 @@ class EntityList(object):
         """Make the EntityList iterable."""
         return self.__list.__iter__()
 
-    def calculate_new_weight(self):
+    def calculate_new_weight(self, fit_curve=True):
         """
         Calculate the new weight of this EntityList based on the Entities it
         contains.
         Record and return the change in list weight (delta) as a side-effect
+        If fit_curve is False then the caller takes responsibility for
+        fitting the weights distribution.
+        """
+        total_entity_weight = 0.0
+        for entity in self.__list:
+            total_entity_weight += entity.score
+        return self.apply_total_entity_weight(total_entity_weight, fit_curve)
+
+    def apply_total_entity_weight(self, total_entity_weight, fit_curve=True):
+        """
+        Calculate the new weight of this EntityList from the supplied sum of
+        the scores of the Entities it contains, then fit the weights
+        distribution as required.
+        Record and return the change in list weight (delta) as a side-effect
         """
         old_weight = self.weight
-        self.__total_entity_weight = 0.0
+        self.__total_entity_weight = total_entity_weight
         if len(self.__list):
-            for entity in self.__list:
-                self.__total_entity_weight += entity.score
             average = self.__total_entity_weight / len(self.__list)
             self.weight = sqrt(average)
         else:
             self.weight = 0.0
         self.delta = self.weight - old_weight
         self.__entity_count_minus_one = max(1, len(self.__list) - 1)
+        self.fit_skipped = False
+        if fit_curve:
+            self.update_fit()
+        return self.delta
+
+    def update_fit(self):
+        """Refit the weights distribution if it needs refitting (see
+        needs_refit), otherwise keep the current one"""
+        if self.needs_refit():
+            self.refit()
+        else:
+            self.skip_fit()
+
+    def refit(self):
+        """Fit the weights distribution to the current Entity scores"""
         self._fit_curve_to_entity_scores()
+        self.fit_completed()
+
+    def fit_completed(self):
+        """Finish off a fit of the weights distribution, noting the Entity
+        scores it was based on"""
         self._correct_fitted_weights()
-        return self.delta
+        self.fit_skipped = False
+        self.fit_count += 1
+        if self.uses_fitted_weights and self.refit_tolerance > 0:
+            self.__fitted_scores = self.member_scores()
+            self.__fitted_version = self.score_version
+
+    def skip_fit(self):
+        """Keep the current weights distribution rather than refitting"""
+        self.fit_skipped = True
+
+    def fit_payload(self):
+        """
+        Return the (picklable) data needed to repeat this list's curve fit
+        somewhere else, e.g. in another process: the class of the list, the
+        member Entity scores in rank order, the list weight and any other
+        state that the fit depends on.
+        """
+        return type(self), self.member_scores(), self.weight, \
+            self._fit_state()
+
+    def fit_result(self):
+        """Return the (picklable) results of the most recent curve fit"""
+        return self.weights_list, self.ratio, self._fit_state()
+
+    def apply_fit_result(self, result):
+        """Store the results of a curve fit performed elsewhere (see
+        fit_payload and fit_result)"""
+        self.weights_list, self.ratio, state = result
+        self._restore_fit_state(state)
+
+    def analysis_state(self):
+        """Return everything about this list that the next iteration of an
+        analysis depends on (see restore_analysis_state)"""
+        return dict(weight=self.weight, delta=self.delta,
+                    weights_list=self.weights_list, ratio=self.ratio,
+                    fit_skipped=self.fit_skipped, fit_count=self.fit_count,
+                    fitted_scores=self.__fitted_scores,
+                    fit_state=self._fit_state())
+
+    def restore_analysis_state(self, state):
+        """Restore the state returned by analysis_state, e.g. to carry on
+        an analysis from where it was saved"""
+        self.weight = state['weight']
+        self.delta = state['delta']
+        self.weights_list = state['weights_list']
+        self.ratio = state['ratio']
+        self.fit_skipped = state['fit_skipped']
+        self.fit_count = state['fit_count']
+        self.__fitted_scores = state['fitted_scores']
+        self.__fitted_version = None
+        if state['fit_state'] is not None:
+            # the options of this analysis, not those of the one saved,
+            # decide whether the fits are warm started
+            fit_state = dict(state['fit_state'])
+            fit_state.pop('warm_start', None)
+            self._restore_fit_state(fit_state)
+
+    def _fit_state(self):
+        """Return any state, beyond the scores and the weight, that the
+        curve fit uses or produces"""
+        return None
+
+    def _restore_fit_state(self, state):
+        """Restore the state returned by _fit_state"""
+        pass
+
+    def ensure_fitted(self):
+        """Refit the weights distribution if the last fit was skipped"""
+        if self.fit_skipped:
+            self.refit()
+
+    def needs_refit(self):
+        """Report whether the weights distribution needs to be refitted i.e.
+        whether any member Entity's score has changed by at least the
+        refit_tolerance since the last fit"""
+        if self.__fitted_scores is None or not self.uses_fitted_weights or \
+                self.refit_tolerance <= 0:
+            return True
+        if self.__fitted_version == self.score_version:
+            return False
+        change = np.max(np.abs(self.member_scores() - self.__fitted_scores))
+        return change >= self.refit_tolerance
 
     def _fit_curve_to_entity_scores(self):
         """
@@ -157,7 +340,7 @@ class EntityList(object):
         """Calculate all the requested corrected weights for the given
         entity and return them in a dictionary"""
         weights = {}
-        if entity and entity in self.__seen:
+        if entity and entity in self.__entity_indexes_one_based:
             index = self.__entity_indexes_one_based[entity]
             initial = self._weight_function(index)
 
@@ -179,7 +362,7 @@ class EntityList(object):
         NOTE: correction methods are only valid once the analysis is complete
         """
         return_value = 0.0
-        if entity and entity in self.__seen:
+        if entity and entity in self.__entity_indexes_one_based:
             index = self.__entity_indexes_one_based[entity]
             return_value = self._weight_function(index)
         return return_value
@@ -194,6 +377,18 @@ class EntityList(object):
         """
         return self.weight
 
+    def weights_vector(self):
+        """
+        Return the weights that this list provides to each of its Entities,
+        in list order, as a NumPy array. This is the array equivalent of
+        calling _weight_function() for every index in the list.
+        """
+        if not self.uses_fitted_weights:
+            return np.full(len(self.__list), self.weight, dtype=float)
+        if len(self.weights_list) == len(self.__list):
+            return np.asarray(self.weights_list, dtype=float)
+        return np.ones(len(self.__list))
+
     def code_string(self):
         ranked_string = "r" if self.is_ranked else "u"
         return str(len(self)) + ranked_string
@@ -222,6 +417,8 @@ class EntityList(object):
 
 class KnnEntityList(EntityList):
 
+    uses_fitted_weights = True
+
     def _fit_curve_to_entity_scores(self):
         y_vector = self.get_truncated_weights_list()
         knn = neighbors.KNeighborsRegressor(n_neighbors=3, weights='distance')
@@ -254,6 +451,8 @@ class KnnEntityList(EntityList):
 
 class PolynomialEntityList(EntityList):
 
+    uses_fitted_weights = True
+
     def _fit_curve_to_entity_scores(self):
         """Do the Polynomial-specific curve fitting."""
         y_vector = self.get_truncated_weights_list()
@@ -289,6 +488,8 @@ class SvrEntityList(EntityList):
     """EntityList that uses a Support Vector Regression with a Radial
     Basis Function to model and distribute weights"""
 
+    uses_fitted_weights = True
+
     def _fit_curve_to_entity_scores(self):
         y_vector = self.get_truncated_weights_list()
         clf = SVR(kernel='rbf', C=1.0, epsilon=0.2)
@@ -320,52 +521,131 @@ class SvrEntityList(EntityList):
 
 class ExponentialEntityList(EntityList):
 
+    uses_fitted_weights = True
+    # Start each fit from the parameters of the previous successful fit
+    # rather than from the fixed starting values
+    warm_start = False
+
     def __init__(self):
         super(ExponentialEntityList, self).__init__()
         self.fit_parameters = None
+        self.fit_succeeded = False
+        self.fit_was_warm_started = False
+        self.fit_evaluations = 0
+        self.fit_evaluations_saved = 0
+        self.cold_fit_evaluations = None
 
     def _fit_curve_to_entity_scores(self):
         """Do the Exponential-specific curve fitting."""
-
-        def func(x, a, b, c, d):
-            return a * np.exp(-b * x) - c * x + d
-
         y_vector = self.get_truncated_weights_list()
 
         x_vector = list(range(1, len(y_vector) + 1, 1))
 
         y_vector = np.asanyarray(y_vector)
         x_vector = np.asanyarray(x_vector)
+        warm_started = self.can_warm_start()
+        starts = [self.initial_fit_parameters()]
+        if warm_started:
+            # a warm start can end in a different minimum, so its fit is
+            # only kept if a fit from the fixed starting values reaches the
+            # same one
+            starts.append(self.cold_fit_parameters())
+        fits = []
+        error = None
+        for p0 in starts:
+            try:
+                fits.append(self._fit_from(x_vector, y_vector, p0))
+            except RuntimeError as fit_error:
+                error = fit_error
+                fits.append(None)
+        evaluations = sum(x[1] for x in fits if x is not None)
+        if warm_started and None not in fits and \
+                not same_fit_cost(fits[0][0], fits[1][0]):
+            fits[0] = None
+        warm_kept = warm_started and fits[0] is not None
+        fits = [x for x in fits if x is not None]
+        if not fits:
+            self.set_failed_fit(error)
+            return
+        self.record_fit_evaluations(evaluations, warm_kept)
+        self.set_fit_parameters(fits[0][2])
+
+    def _fit_from(self, x_vector, y_vector, initial_parameters):
+        """Fit the curve starting from the initial_parameters and return its
+        cost (the sum of the squared weighted residuals), the number of
+        function evaluations used and the fitted parameters"""
+        optimal_parameters, covariance, info, message, flag = curve_fit(
+            exponential_function, x_vector, y_vector,
+            p0=initial_parameters,
+            sigma=self.fit_sigma(x_vector),
+            bounds=EXPONENTIAL_FIT_BOUNDS,
+            full_output=True)
+        return np.sum(info['fvec'] ** 2), info['nfev'], optimal_parameters
+
+    def can_warm_start(self):
+        """Report whether the next fit will start from the parameters of the
+        previous fit"""
+        return self.warm_start and self.fit_succeeded
+
+    def initial_fit_parameters(self):
+        """Return the starting values for the curve fit"""
+        if self.can_warm_start():
+            return list(self.fit_parameters)
+        return self.cold_fit_parameters()
+
+    def cold_fit_parameters(self):
+        """Return the fixed starting values used without a warm start"""
+        return [3, 0.01, 0.0001, self.weight]
+
+    def record_fit_evaluations(self, evaluations, warm_started):
+        """Note how many function evaluations a fit took. The number saved
+        by a warm-started fit is estimated by comparison with the most
+        recent fit that used the fixed starting values"""
+        self.fit_evaluations = evaluations
+        self.fit_was_warm_started = warm_started
+        if warm_started and self.cold_fit_evaluations is not None:
+            self.fit_evaluations_saved = max(
+                0, self.cold_fit_evaluations - evaluations)
+        else:
+            self.cold_fit_evaluations = evaluations
+            self.fit_evaluations_saved = 0
+
+    def fit_sigma(self, x_vector):
+        """Return the uncertainty of each point to be fitted - the variance
+        scales linearly with number of entities"""
+        return [self.weight * (len(x_vector) - i + 1) / len(x_vector)
+                for i in x_vector]
+
+    def set_fit_parameters(self, fit_parameters):
+        """Store the results of a successful curve fit and use them to
+        distribute the list weight"""
+        self.fit_parameters = fit_parameters
+        self.fit_succeeded = True
+        a, b, c, d = self.fit_parameters
         weights = []
-        try:
-            optimal_parameters, covariance = curve_fit(
-                func, x_vector, y_vector,
-                # starting values to speed it up
-                p0=[3, 0.01, 0.0001, self.weight],
-                # variance scales linearly with number of entities
-                sigma=[self.weight*(len(x_vector)-i+1)/len(x_vector) for i in x_vector],
-                bounds = ([0, 0, 0.00000001, 0], [np.inf, np.inf, np.inf, np.inf]))
-            #print (self.name, self.weight, optimal_parameters)
-            self.fit_parameters = optimal_parameters
-            a, b, c, d = self.fit_parameters
-            for x in x_vector:
-                weights.append(a * np.exp(-b * x) - c * x + d)
-            self.weights_list = weights
-            self.ratio = np.average(weights) / self.weight
-        except RuntimeError as error:
-            logger.warning("An error occured when trying to fit a "
-                           "function to distribute weights for "
-                           "list {}. The error was '{}'".format(self.name,
-                                                                error))
-            self.fit_parameters = [0, 0, 0, 0]
-            entity_count = len(self)
-            base = self.weight + (
-                    (FAILED_RANKED_LIST_DESCENT_STEP * entity_count) / 2.0)
-            for x in range(entity_count):
-                weights.append(
-                    base - (x * FAILED_RANKED_LIST_DESCENT_STEP))
-            self.weights_list = weights
-            self.ratio = 1
+        for x in range(1, len(self) + 1):
+            weights.append(a * np.exp(-b * x) - c * x + d)
+        self.weights_list = weights
+        self.ratio = np.average(weights) / self.weight
+
+    def set_failed_fit(self, error):
+        """Fall back to a near-unranked distribution of the list weight when
+        the curve fit fails"""
+        logger.warning("An error occured when trying to fit a "
+                       "function to distribute weights for "
+                       "list {}. The error was '{}'".format(self.name,
+                                                            error))
+        self.fit_parameters = [0, 0, 0, 0]
+        self.fit_succeeded = False
+        weights = []
+        entity_count = len(self)
+        base = self.weight + (
+                (FAILED_RANKED_LIST_DESCENT_STEP * entity_count) / 2.0)
+        for x in range(entity_count):
+            weights.append(
+                base - (x * FAILED_RANKED_LIST_DESCENT_STEP))
+        self.weights_list = weights
+        self.ratio = 1
 
     def _weight_function(self, index):
         """Return the precalculated and adjusted Exponential-specific adjusted
@@ -381,9 +661,27 @@ class ExponentialEntityList(EntityList):
                          'had no parameters')
         return return_value
 
+    def _fit_state(self):
+        return dict(warm_start=self.warm_start,
+                    fit_parameters=self.fit_parameters,
+                    fit_succeeded=self.fit_succeeded,
+                    fit_was_warm_started=self.fit_was_warm_started,
+                    fit_evaluations=self.fit_evaluations,
+                    fit_evaluations_saved=self.fit_evaluations_saved,
+                    cold_fit_evaluations=self.cold_fit_evaluations)
+
+    def _restore_fit_state(self, state):
+        for key in state:
+            setattr(self, key, state[key])
+
     def reset(self):
         super(ExponentialEntityList, self).reset()
         self.fit_parameters = None
+        self.fit_succeeded = False
+        self.fit_was_warm_started = False
+        self.fit_evaluations = 0
+        self.fit_evaluations_saved = 0
+        self.cold_fit_evaluations = None
 
     def blank_copy(self):
         """Return a new blank EntityList"""
@@ -1,7 +1,7 @@
 import logging
 import re
 
-from entity import Entity
+from entity import CompactEntity, Entity
 from entitylist import EntityList, KnnEntityList, PolynomialEntityList, \
     ExponentialEntityList, SvrEntityList
 from errors import WarnValueError, KillValueError
@@ -18,12 +18,23 @@ class EntityListBuilder(object):
     input line.
     """
 
-    def __init__(self, list_type, limit=None):
-        """Initialise an EntityListBuilder"""
+    def __init__(self, list_type, limit=None, warm_start=False,
+                 refit_tolerance=0.0, compact=True):
+        """Initialise an EntityListBuilder. If warm_start is True then the
+        curve fits of the ranked lists it builds also start from the
+        parameters of their previous fit (which is kept when it reaches the
+        same minimum as the usual fit). The lists skip refitting while their scores
+        change by less than the refit_tolerance. The Entities are created
+        as (slotted) CompactEntity objects unless compact is False, when
+        they are Entity objects, which can be given attributes of their
+        own"""
         from sys import maxsize
         self.__list_names = {}
         self.list_type = list_type
         self.limit = maxsize if limit is None else limit
+        self.warm_start = warm_start
+        self.refit_tolerance = refit_tolerance
+        self.entity_class = CompactEntity if compact else Entity
         self._entity_dict = {}
 
     def build_list_from_string(self, string, limit=None):
@@ -90,6 +101,7 @@ class EntityListBuilder(object):
             entity_list = PolynomialEntityList()
         elif self.list_type == 'exponential':
             entity_list = ExponentialEntityList()
+            entity_list.warm_start = self.warm_start
         elif self.list_type == 'svr':
             entity_list = SvrEntityList()
         else:
@@ -97,6 +109,7 @@ class EntityListBuilder(object):
                            "unranked EntityList." % self.list_type)
             entity_list = EntityList()
 
+        entity_list.refit_tolerance = self.refit_tolerance
         return entity_list
 
     def get_or_create_entity(self, entity_name):
@@ -104,10 +117,17 @@ class EntityListBuilder(object):
         Return the Entity corresponding to the supplied entity_name,
         creating it if required.
         """
-        if entity_name not in self._entity_dict:
-            self._entity_dict[entity_name] = Entity(entity_name)
-        return self._entity_dict[entity_name]
+        entity = self._entity_dict.get(entity_name)
+        if entity is None:
+            entity = self.entity_class(entity_name)
+            self._entity_dict[entity_name] = entity
+        return entity
 
     def entities(self):
         """Return a list of all the entities we have created"""
         return list(self._entity_dict.values())
+
+    def entity_lists(self):
+        """Return a list of all the EntityLists we have built, in the order
+        they were built"""
+        return list(self.__list_names.values())
@@ -1,6 +1,8 @@
 import io
 import re
 
+blank_matcher = re.compile("^\\s*$")
+
 
 class FileReader(object):
 
@@ -14,11 +16,25 @@ class FileReader(object):
         Skips lines that begin with a hash character and stops reading the
         file when it encounters a line that begins with 5 or more hyphens
         """
+        self.list_lines.extend(self.iter_lines(file_path))
+
+    @staticmethod
+    def iter_lines(file_path):
+        """
+        Generate the data lines of the supplied file one at a time, without
+        holding the whole file in memory. The same rules as read_file apply:
+        lines that begin with a hash character and blank lines are skipped
+        and reading stops at a line that begins with 5 or more hyphens
+        """
         with io.open(file_path, "r") as input_file:
-            for line in input_file.read().splitlines():
-                if line.startswith("-----"):
-                    break
-                elif re.match("^\\s*$", line):
-                    pass
-                elif not line.startswith("#"):
-                    self.list_lines.append(line)
+            for physical_line in input_file:
+                # splitlines() so that any line break characters left in
+                # the line are treated exactly as when splitting the whole
+                # file at once
+                for line in physical_line.splitlines():
+                    if line.startswith("-----"):
+                        return
+                    elif blank_matcher.match(line):
+                        pass
+                    elif not line.startswith("#"):
+                        yield line
@@ -0,0 +1,56 @@
+"""
+Code relating to the collection of statistics about the curve fitting done
+at each iteration of a CrossValidation analysis
+"""
+import logging
+
+from entitylist import ExponentialEntityList
+from utils import tab_separated_lines, write_report
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+FIT_STATISTICS_COLUMNS = ['iteration', 'fits', 'skipped', 'warm_starts',
+                          'evaluations', 'evaluations_saved']
+
+
+class FitStatisticsCollector(object):
+    """Record, at each iteration, how many curve fits the ranked lists of a
+    CrossValidation analysis performed, how many fits were skipped because
+    the scores had not changed, how many were warm-started and how many
+    function evaluations they used (and saved). Register it with
+    CrossValidation.register_callback as a POST_ITERATION_CALLBACK"""
+
+    def __init__(self):
+        self.iterations = []
+
+    def do_callback(self, cross_validation=None, iteration=None):
+        statistics = dict.fromkeys(FIT_STATISTICS_COLUMNS, 0)
+        statistics['iteration'] = iteration
+        for entity_list in cross_validation.entity_lists:
+            if not entity_list.uses_fitted_weights:
+                continue
+            if entity_list.fit_skipped:
+                statistics['skipped'] += 1
+                continue
+            statistics['fits'] += 1
+            if not isinstance(entity_list, ExponentialEntityList):
+                continue
+            if entity_list.fit_was_warm_started:
+                statistics['warm_starts'] += 1
+            statistics['evaluations'] += entity_list.fit_evaluations
+            statistics['evaluations_saved'] += \
+                entity_list.fit_evaluations_saved
+        self.iterations.append(statistics)
+        logger.info("Iteration {iteration}: {fits} fits ({skipped} skipped, "
+                    "{warm_starts} warm started) used {evaluations} function "
+                    "evaluations, saving {evaluations_saved}".format(
+                        **statistics))
+
+    def dump(self, output_folder=None):
+        """Write the statistics to a tab-separated file in the output folder
+        (or to the log if there is no output folder)"""
+        write_report(tab_separated_lines(FIT_STATISTICS_COLUMNS,
+                                         self.iterations),
+                     output_folder, 'fit_statistics.txt', "Fit statistics",
+                     logger)
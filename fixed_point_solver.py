@@ -0,0 +1,162 @@
+"""
+Code relating to accelerating the fixed-point iteration of a CrossValidation
+analysis with Anderson or (multisecant) Broyden mixing
+"""
+import logging
+
+import numpy as np
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+PICARD = 'picard'
+ANDERSON = 'anderson'
+BROYDEN = 'broyden'
+SOLVER_METHODS = [PICARD, ANDERSON, BROYDEN]
+DEFAULT_MEMORY = 5
+
+
+def read_state(entity_lists):
+    """Return the fixed-point state of the lists - the weight of each list
+    followed (for a ranked list with a fitted weight for every member) by
+    its fitted weights - as a (layout, vector) pair, where the layout is
+    the number of values taken from each list"""
+    layout = []
+    values = []
+    for entity_list in entity_lists:
+        values.append([entity_list.weight])
+        if entity_list.uses_fitted_weights and \
+                len(entity_list.weights_list) == len(entity_list):
+            values.append(entity_list.weights_list)
+            layout.append(1 + len(entity_list))
+        else:
+            layout.append(1)
+    if not values:
+        return (), np.zeros(0)
+    return tuple(layout), np.concatenate(values).astype(np.float64)
+
+
+def write_state(entity_lists, layout, state):
+    """Give the lists the weights (and fitted weights) held in a state
+    vector laid out as read_state returns it"""
+    start = 0
+    for entity_list, count in zip(entity_lists, layout):
+        entity_list.weight = float(state[start])
+        if count > 1:
+            entity_list.weights_list = state[start + 1:start + count].tolist()
+        start += count
+
+
+class AcceleratedSolver(object):
+    """Accelerate the fixed-point iteration of a CrossValidation analysis.
+    Set it as the CrossValidation's solver attribute and, after every
+    iteration that has not converged, it replaces the list weights (and
+    fitted weights) that the next iteration starts from.
+
+    Each iteration of the analysis is one evaluation x -> g(x) of the
+    fixed-point map on the state of the lists (see read_state). From the
+    last memory pairs of inputs and residuals (g(x) - x) the solver mixes
+    the next input: by least squares on the residuals (method 'anderson',
+    Anderson type II) or by the multisecant Broyden update (method
+    'broyden', Anderson type I).
+
+    As a safeguard, if the residual of an accelerated state is bigger than
+    that of the state it was accelerated from, the solver falls back to the
+    plain (Picard) step it would otherwise have taken and starts its
+    history again. Since convergence is always judged on an ordinary
+    iteration, the threshold test means the same as without a solver"""
+
+    def __init__(self, method=ANDERSON, memory=DEFAULT_MEMORY):
+        if method not in (ANDERSON, BROYDEN):
+            raise ValueError("Unknown solver method '{}'".format(method))
+        self.method = method
+        self.memory = memory
+        self.reset()
+
+    def reset(self):
+        self.accelerated_steps = 0
+        self.fallbacks = 0
+        self.residuals = []
+        self.clear_history()
+        self._input = None
+        self._layout = None
+
+    def clear_history(self):
+        self._input_differences = []
+        self._residual_differences = []
+        self._last_input = None
+        self._last_residual = None
+        self._last_norm = None
+        self._accelerated = False
+        self._picard_state = None
+
+    def step(self, cross_validation, iteration):
+        """Called after each iteration that has not converged: choose the
+        state that the next iteration starts from"""
+        if iteration == 1:
+            self.reset()
+        entity_lists = cross_validation.entity_lists
+        layout, output = read_state(entity_lists)
+        if self._input is None or layout != self._layout:
+            # the first iteration, or ranked lists have just been fitted
+            self.clear_history()
+            self._layout = layout
+            self._input = output
+            return
+        residual = output - self._input
+        residual_norm = float(np.max(np.abs(residual))) if len(residual) \
+            else 0.0
+        self.residuals.append(residual_norm)
+        if self._accelerated and not residual_norm <= self._last_norm:
+            # the accelerated state made things worse: take the plain step
+            # from the state it was accelerated from instead
+            logger.debug("Iteration {}: accelerated residual {} exceeds {}; "
+                         "falling back".format(iteration, residual_norm,
+                                               self._last_norm))
+            self.fallbacks += 1
+            write_state(entity_lists, layout, self._picard_state)
+            self._input = self._picard_state
+            self.clear_history()
+            return
+        if self._last_input is not None:
+            self._input_differences.append(self._input - self._last_input)
+            self._residual_differences.append(residual - self._last_residual)
+            del self._input_differences[:-self.memory]
+            del self._residual_differences[:-self.memory]
+        self._last_input = self._input
+        self._last_residual = residual
+        self._last_norm = residual_norm
+        next_input = self.mix(output, residual)
+        self._accelerated = next_input is not None
+        if next_input is None:
+            self._input = output
+            return
+        self.accelerated_steps += 1
+        self._picard_state = output
+        write_state(entity_lists, layout, next_input)
+        self._input = next_input
+
+    def mix(self, output, residual):
+        """Return the next input mixed from the history, or None to take
+        the plain step to output"""
+        if not self._input_differences:
+            return None
+        input_differences = np.column_stack(self._input_differences)
+        residual_differences = np.column_stack(self._residual_differences)
+        if self.method == ANDERSON:
+            gamma = np.linalg.lstsq(residual_differences, residual,
+                                    rcond=None)[0]
+        else:
+            gamma = np.linalg.lstsq(
+                input_differences.T.dot(residual_differences),
+                input_differences.T.dot(residual), rcond=None)[0]
+        next_input = output - (input_differences +
+                               residual_differences).dot(gamma)
+        if not np.all(np.isfinite(next_input)):
+            return None
+        # weights are square roots of mean scores, so never negative
+        return np.maximum(next_input, 0.0)
+
+    def summary(self):
+        return "{} solver: {} accelerated steps, {} fallbacks".format(
+            self.method, self.accelerated_steps, self.fallbacks)
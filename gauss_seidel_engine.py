@@ -0,0 +1,111 @@
+"""
+Code relating to the Gauss-Seidel (in-place) alternative to the usual
+Jacobi-style MAIC iteration
+"""
+import logging
+
+from cross_validation import SCORING_PHASE, WEIGHTING_PHASE
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+
+class GaussSeidelEngine(object):
+    """Perform the iterations of a CrossValidation analysis in place. The
+    usual iteration calculates every Entity score from the old list weights
+    and then every list weight from those scores; here, as soon as a list
+    has a new weight (and fitted weights), the scores of its members are
+    recalculated so that the lists after it in the same sweep already see
+    the change. Since the best list in each category is what counts, news
+    of a strong list reaches the other categories within the sweep, which
+    usually saves whole iterations when there are many categories.
+
+    Only the scores that can have changed are recalculated: those of the
+    members of each list whose weights changed during the sweep, and (at
+    the start of a sweep) those of the members of any list whose weights
+    were changed in between sweeps (e.g. by a solver)"""
+
+    def __init__(self):
+        self._list_states = None
+        # The number of Entity scores recalculated in the last iteration
+        # and in the whole analysis
+        self.rescored = 0
+        self.total_rescored = 0
+
+    def prepare(self, cross_validation):
+        """Called once at the start of each analysis, after everything has
+        been reset"""
+        self._list_states = None
+        self.rescored = 0
+        self.total_rescored = 0
+
+    def iterate(self, cross_validation):
+        """Perform one sweep of the analysis and return the largest
+        absolute change in list weight. The weighting, fitting and scoring
+        of each list are reported as separate phases, which a PhaseProfiler
+        adds up for the iteration"""
+        self.rescored = 0
+        with cross_validation.phase(SCORING_PHASE):
+            self.rescore(self.dirty_entities(cross_validation))
+        delta = 0
+        for entity_list in cross_validation.entity_lists:
+            old_state = self._list_states.get(entity_list)
+            with cross_validation.phase(WEIGHTING_PHASE):
+                delta = max(delta, abs(
+                    entity_list.calculate_new_weight(fit_curve=False)))
+            cross_validation.fit_deferred_lists([entity_list])
+            if self.list_state_changed(entity_list, old_state):
+                with cross_validation.phase(SCORING_PHASE):
+                    self.rescore(entity_list)
+                self._list_states[entity_list] = self.list_state(entity_list)
+        self.total_rescored += self.rescored
+        logger.debug("{} entity scores recalculated".format(self.rescored))
+        return delta
+
+    def dirty_entities(self, cross_validation):
+        """Return the Entities whose scores are out of date at the start of
+        a sweep: all of them the first time, and otherwise the members of
+        the lists whose weights have changed since the last sweep"""
+        if self._list_states is None:
+            self._list_states = dict(
+                (x, self.list_state(x)) for x in cross_validation.entity_lists)
+            return cross_validation.entities + cross_validation._fake_entities
+        dirty = {}
+        for entity_list in cross_validation.entity_lists:
+            if self.list_state_changed(entity_list,
+                                       self._list_states.get(entity_list)):
+                self._list_states[entity_list] = self.list_state(entity_list)
+                for entity in entity_list:
+                    dirty[entity] = True
+        return list(dirty)
+
+    @staticmethod
+    def list_state(entity_list):
+        """Return what the members of the list get their weights from: its
+        weight and (a reference to) its fitted weights"""
+        return entity_list.weight, entity_list.weights_list
+
+    @staticmethod
+    def list_state_changed(entity_list, state):
+        """Report whether the list's state differs from the state noted by
+        list_state. The fitted weights are replaced (not changed in place)
+        whenever they are refitted, so they are compared by identity; the
+        state keeps the old ones alive, so a new list can't take their id"""
+        return state is None or entity_list.weight != state[0] or \
+            entity_list.weights_list is not state[1]
+
+    def rescore(self, entities):
+        count = 0
+        for entity in entities:
+            entity.calculate_new_score()
+            count += 1
+        self.rescored += count
+
+    def calculate_final_corrected_scores(self, cross_validation):
+        for entity in cross_validation.entities:
+            entity.calculate_final_corrected_scores(
+                methods=cross_validation.transform_methods)
+
+    def finish(self, cross_validation):
+        """Called at the end of the analysis. The Entity objects are always
+        up to date, so there is nothing to do"""
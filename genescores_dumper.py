@@ -3,6 +3,21 @@ import sys
 import numpy as np
 from constants import T_METHOD_NONE
 
+try:
+    import pyarrow
+    import pyarrow.feather
+    import pyarrow.parquet
+except ImportError:  # Parquet and Feather output are optional
+    pyarrow = None
+
+# Number of rows formatted and written at a time by the
+# AllScoresGeneScoresDumper
+DUMP_CHUNK_ROWS = 1000
+# The formats that the AllScoresGeneScoresDumper can write, and those of
+# them that need pyarrow
+OUTPUT_FORMATS = ['txt', 'npz', 'parquet', 'feather']
+ARROW_OUTPUT_FORMATS = ['parquet', 'feather']
+
 
 # TODO - rewrite this object to handle TransformMethods rather than separate
 #  methods
@@ -124,6 +139,176 @@ class GeneScoresDumper(object):
 
 
 class AllScoresGeneScoresDumper(GeneScoresDumper):
+    """A GeneScoresDumper that reports the score every entity would receive
+    from every list (whether or not that list is the winner in its category)
+    along with the winning list in each category.
+
+    Most entities are on only a few of the lists, so the entity x list score
+    matrix is assembled sparsely, from the lists that each entity is on,
+    and the rows are formatted and written in chunks rather than one entity
+    x list pair at a time.
+
+    As well as tab-separated text ('txt') the scores can be written as a
+    compressed NumPy archive ('npz') holding the entity names, list names
+    and the sparse score matrix, or as a Parquet or Feather table
+    ('parquet', 'feather' - these need pyarrow) with the same columns as
+    the text file."""
+
+    def __init__(self, cross_validation, output_folder=None,
+                 output_format='txt'):
+        super(AllScoresGeneScoresDumper, self).__init__(
+            cross_validation=cross_validation,
+            output_folder=output_folder
+        )
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError(
+                "Unknown output format '{}'".format(output_format))
+        if output_format in ARROW_OUTPUT_FORMATS and pyarrow is None:
+            raise ImportError(
+                "pyarrow is needed to write {} output".format(output_format))
+        self.output_format = output_format
+
+    def dump(self, method=T_METHOD_NONE, baseline=None):
+        """Actually do the GeneScoresDump into the supplied stream (or, for
+        the binary formats, into a file in the output folder or the current
+        directory)"""
+        self.write(self.score_table(method, baseline))
+
+    def score_table(self, method=T_METHOD_NONE, baseline=None):
+        """Return a ScoreTable holding everything that dump writes, taken
+        from the current state of the analysis. Writing it does not touch
+        the Entities or EntityLists, so it can be done in the background
+        while the analysis carries on"""
+        famn = self.build_file_and_method_name(method, baseline)
+        lists = self.lists_in_category_order()
+        entities = self.entities_in_descending_score_order(
+            method=famn.methodname)
+        table = ScoreTable()
+        table.filename = famn.filename
+        table.entity_names = [x.name for x in entities]
+        table.list_names = [x.name for x in lists]
+        table.list_categories = [x.category for x in lists]
+        table.row_starts, table.columns, table.values = \
+            self.sparse_score_matrix(entities, lists)
+        table.maic_scores = [x.transformed_score(method=famn.methodname)
+                             for x in entities]
+        table.extra_headers = self.extra_headers()
+        table.extra_rows = [self.additional_column_data(x) for x in entities]
+        return table
+
+    def write(self, table):
+        """Write a ScoreTable in the output format"""
+        if self.output_format == 'txt':
+            self.write_text(table)
+            return
+        file_path = "{}{}.{}".format(self.output_folder or '',
+                                     table.filename, self.output_format)
+        if self.output_format == 'npz':
+            self.write_npz(file_path, table)
+        else:
+            self.write_arrow(file_path, table)
+
+    def write_text(self, table):
+        """Write the scores as tab-separated text, one row per entity"""
+        # Format max(0.0, score) for every score. The scores are formatted
+        # as they are (rather than as floats) so that, e.g., the integer
+        # weights of the first iteration are written as they always were
+        strings = [str(x) if x > 0.0 else '0.0' for x in table.values]
+        columns = table.columns.tolist()
+        row_starts = table.row_starts.tolist()
+
+        out_stream = sys.stdout
+        if self.output_folder:
+            out_stream = io.open(
+                "{}{}.txt".format(self.output_folder, table.filename), 'w+')
+        else:
+            out_stream.writelines(
+                "-------- {} ---------".format(table.filename))
+        out_stream.write('\t'.join(
+            ['gene'] + table.list_names + [
+                'maic_score'] + table.extra_headers) + '\n')
+        empty_row = ['0.0'] * len(table.list_names)
+        chunk = []
+        for row, name in enumerate(table.entity_names):
+            out_columns = empty_row[:]
+            for idx in range(row_starts[row], row_starts[row + 1]):
+                out_columns[columns[idx]] = strings[idx]
+            chunk.append('\t'.join(
+                [name] + out_columns + [str(table.maic_scores[row])] +
+                table.extra_rows[row]) + '\n')
+            if len(chunk) == DUMP_CHUNK_ROWS:
+                out_stream.write(''.join(chunk))
+                chunk = []
+        out_stream.write(''.join(chunk))
+        if self.output_folder:
+            out_stream.close()
+
+    def write_npz(self, file_path, table):
+        """Write the scores to a compressed NumPy archive. The score matrix
+        is stored in compressed sparse row form under the same keys as
+        scipy.sparse.save_npz uses, so scipy.sparse.load_npz can read it
+        straight back in; the names and other columns are stored alongside
+        it as arrays of strings (none of the arrays need pickling)"""
+        arrays = dict(
+            format=np.array('csr'),
+            shape=np.array([len(table.entity_names), len(table.list_names)],
+                           dtype=np.int64),
+            data=table.clipped_scores(), indices=table.columns,
+            indptr=table.row_starts,
+            entity_names=np.array(table.entity_names, dtype=str),
+            list_names=np.array(table.list_names, dtype=str),
+            list_categories=np.array(table.list_categories, dtype=str),
+            maic_score=np.array(table.maic_scores, dtype=np.float64))
+        for header, column in zip(table.extra_headers, table.extra_columns()):
+            arrays[header] = np.array(column, dtype=str)
+        np.savez_compressed(file_path, **arrays)
+
+    def write_arrow(self, file_path, table):
+        """Write the scores to a Parquet or Feather table with the same
+        columns as the text output. The Feather file is written
+        uncompressed so that it can be memory-mapped"""
+        # Build the dense matrix column by column (Fortran order) so that
+        # every list's column is contiguous
+        entity_count = len(table.entity_names)
+        dense = np.zeros((entity_count, len(table.list_names)),
+                         dtype=np.float64, order='F')
+        rows = np.repeat(np.arange(entity_count), np.diff(table.row_starts))
+        dense[rows, table.columns] = table.clipped_scores()
+        names = ['gene'] + table.list_names + ['maic_score'] + \
+            table.extra_headers
+        arrays = [pyarrow.array(table.entity_names)] + \
+            [pyarrow.array(dense[:, idx])
+             for idx in range(len(table.list_names))] + \
+            [pyarrow.array(np.array(table.maic_scores, dtype=np.float64))] + \
+            [pyarrow.array(x) for x in table.extra_columns()]
+        arrow_table = pyarrow.Table.from_arrays(arrays, names=names)
+        if self.output_format == 'parquet':
+            pyarrow.parquet.write_table(arrow_table, file_path)
+        else:
+            pyarrow.feather.write_feather(arrow_table, file_path,
+                                          compression='uncompressed')
+
+    @staticmethod
+    def sparse_score_matrix(entities, lists):
+        """Return the entity x list scores in compressed sparse row form:
+        an array of the offset of the first entry of each row (plus the
+        total number of entries), an array of the column of each entry and
+        a list of the scores. Only the lists that each entity is on have
+        entries. There is one row per entity and one column per list, in
+        the orders supplied"""
+        list_columns = dict((lst, idx) for idx, lst in enumerate(lists))
+        row_starts = [0]
+        columns = []
+        values = []
+        for entity in entities:
+            for lst, score in entity.raw_scores_by_list():
+                column = list_columns.get(lst)
+                if column is not None:
+                    columns.append(column)
+                    values.append(score)
+            row_starts.append(len(columns))
+        return np.array(row_starts, dtype=np.int64), \
+            np.array(columns, dtype=np.int64), values
 
     def extra_headers(self):
         return ['contributors']
@@ -145,10 +330,12 @@ class IterationAwareGeneScoresDumper(AllScoresGeneScoresDumper):
     iteration it is being called from (using the CrossValidation callback
     mechanism"""
 
-    def __init__(self, cross_validation, output_folder=None):
+    def __init__(self, cross_validation, output_folder=None,
+                 output_format='txt'):
         super(IterationAwareGeneScoresDumper, self).__init__(
             cross_validation=cross_validation,
-            output_folder=output_folder
+            output_folder=output_folder,
+            output_format=output_format
         )
         self.iteration = 0
 
@@ -165,3 +352,33 @@ class FileAndMethodName(object):
     def __init__(self):
         self.filename = ""
         self.methodname = ""
+
+
+class ScoreTable(object):
+    """The scores written by an AllScoresGeneScoresDumper: the names of the
+    entities (in row order) and lists (in column order), the entity x list
+    scores in compressed sparse row form, each entity's MAIC score and the
+    data for any extra columns"""
+
+    def __init__(self):
+        self.filename = ""
+        self.entity_names = []
+        self.list_names = []
+        self.list_categories = []
+        self.row_starts = np.zeros(1, dtype=np.int64)
+        self.columns = np.zeros(0, dtype=np.int64)
+        self.values = []
+        self.maic_scores = []
+        self.extra_headers = []
+        self.extra_rows = []
+
+    def clipped_scores(self):
+        """Return max(0.0, score) for every score, as a float array, exactly
+        as the scores are written in the text output"""
+        scores = np.array(self.values, dtype=np.float64)
+        return np.where(scores > 0.0, scores, 0.0)
+
+    def extra_columns(self):
+        """Return the data of each of the extra columns"""
+        return [[row[idx] for row in self.extra_rows]
+                for idx in range(len(self.extra_headers))]
@@ -0,0 +1,302 @@
+# coding=utf-8
+"""
+Code relating to the storage of the entity scores, list weights and
+category winners of every iteration of a CrossValidation analysis as a
+compact history: the first iteration is written in full and each later one
+as a binary delta from the one before, so that the history of a long
+analysis takes a fraction of the space of a full score table per iteration.
+Any iteration can be reconstructed from the history on demand.
+"""
+from __future__ import print_function
+
+import argparse
+import io
+import logging
+import struct
+import sys
+
+import numpy as np
+
+from background_writer import write_in_background
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+HISTORY_FILENAME = 'iteration_history.bin'
+# Every record is an iteration number, a flag that is set for full (rather
+# than delta) records and a payload length, followed by the payload, which
+# is a compressed NumPy archive
+RECORD_HEADER = struct.Struct('<i?Q')
+# The state of each iteration that is recorded
+SNAPSHOT_ARRAYS = ['entity_scores', 'list_weights', 'category_winners']
+# The category winner code for a category in which an entity has no lists
+NO_WINNER = -1
+
+
+def _bits(values):
+    """Return the values as integers with the same bit patterns, so that
+    comparing them finds every change (including to and from NaN)"""
+    if values.dtype == np.float64:
+        return values.view(np.int64)
+    return values
+
+
+def _archive_bytes(arrays):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+
+class IterationSnapshot(object):
+    """The state of a CrossValidation analysis at the end of one iteration.
+    entity_scores and list_weights hold the score of each entity and the
+    weight of each list, in the order of entity_names and list_names;
+    category_winners holds, for each entity and each category (in the
+    order of category_names), the index of the winning list or NO_WINNER"""
+
+    def __init__(self, iteration, entity_names, list_names, category_names,
+                 entity_scores, list_weights, category_winners):
+        self.iteration = iteration
+        self.entity_names = entity_names
+        self.list_names = list_names
+        self.category_names = category_names
+        self.entity_scores = entity_scores
+        self.list_weights = list_weights
+        self.category_winners = category_winners
+
+    def scores_by_entity(self):
+        """Return a dictionary of entity name->score pairs"""
+        return dict(zip(self.entity_names, self.entity_scores.tolist()))
+
+    def weights_by_list(self):
+        """Return a dictionary of list name->weight pairs"""
+        return dict(zip(self.list_names, self.list_weights.tolist()))
+
+    def winning_lists_by_category(self, entity_name):
+        """Return a dictionary of category->list name pairs indicating the
+        winning lists of the named entity in each category"""
+        row = self.entity_names.index(entity_name)
+        winners = {}
+        for category, winner in zip(self.category_names,
+                                    self.category_winners[row].tolist()):
+            if winner != NO_WINNER:
+                winners[category] = self.list_names[winner]
+        return winners
+
+    def copy(self):
+        return IterationSnapshot(self.iteration, self.entity_names,
+                                 self.list_names, self.category_names,
+                                 self.entity_scores.copy(),
+                                 self.list_weights.copy(),
+                                 self.category_winners.copy())
+
+
+class IterationHistoryWriter(object):
+    """Write the state of a CrossValidation analysis at the end of every
+    iteration to a history file. Register it with
+    CrossValidation.register_callback as a POST_ITERATION_CALLBACK.
+
+    The first iteration is written in full (with the names of the entities,
+    lists and categories) and every later iteration as the positions and
+    new values of just the entity scores, list weights and category winners
+    that changed. If the entities or lists of the analysis change, the next
+    iteration is written in full again"""
+
+    def __init__(self, output_folder=None):
+        self.file_path = "{}{}".format(output_folder or '', HISTORY_FILENAME)
+        self.previous = None
+        self.bytes_written = 0
+
+    def do_callback(self, cross_validation=None, iteration=None):
+        snapshot = self.snapshot(cross_validation, iteration)
+        full = self.previous is None or \
+            self.previous.entity_names != snapshot.entity_names or \
+            self.previous.list_names != snapshot.list_names or \
+            self.previous.category_names != snapshot.category_names
+        if full:
+            arrays = self.full_record(snapshot)
+        else:
+            arrays = self.delta_record(self.previous, snapshot)
+        # start a new file with the first record
+        mode = 'wb' if self.previous is None else 'ab'
+        self.previous = snapshot
+        # the record is compressed and written in the background if the
+        # analysis has a BackgroundWriter
+        write_in_background(cross_validation, self.write_record, iteration,
+                            full, arrays, mode)
+
+    def write_record(self, iteration, full, arrays, mode='ab'):
+        payload = _archive_bytes(arrays)
+        with io.open(self.file_path, mode) as out_stream:
+            out_stream.write(RECORD_HEADER.pack(iteration, full,
+                                                len(payload)))
+            out_stream.write(payload)
+        self.bytes_written += RECORD_HEADER.size + len(payload)
+        logger.debug("Iteration {} written to the history in {} bytes".format(
+            iteration, len(payload)))
+
+    @staticmethod
+    def snapshot(cross_validation, iteration):
+        """Return an IterationSnapshot of the current state of the
+        CrossValidation analysis"""
+        entities = cross_validation.entities
+        entity_lists = cross_validation.entity_lists
+        list_indexes = dict(
+            (lst, idx) for idx, lst in enumerate(entity_lists))
+        category_names = sorted(set(lst.category for lst in entity_lists))
+        category_indexes = dict(
+            (category, idx) for idx, category in enumerate(category_names))
+        winners = np.full((len(entities), len(category_names)), NO_WINNER,
+                          dtype=np.int32)
+        for row, entity in enumerate(entities):
+            for category, lst in entity.winning_lists_by_category().items():
+                winners[row, category_indexes[category]] = list_indexes[lst]
+        return IterationSnapshot(
+            iteration, [x.name for x in entities],
+            [x.name for x in entity_lists], category_names,
+            np.array([x.score for x in entities], dtype=np.float64),
+            np.array([x.weight for x in entity_lists], dtype=np.float64),
+            winners)
+
+    @staticmethod
+    def full_record(snapshot):
+        return dict(entity_names=np.array(snapshot.entity_names, dtype=str),
+                    list_names=np.array(snapshot.list_names, dtype=str),
+                    category_names=np.array(snapshot.category_names,
+                                            dtype=str),
+                    entity_scores=snapshot.entity_scores,
+                    list_weights=snapshot.list_weights,
+                    category_winners=snapshot.category_winners)
+
+    @staticmethod
+    def delta_record(previous, snapshot):
+        arrays = {}
+        for name in SNAPSHOT_ARRAYS:
+            new = getattr(snapshot, name).ravel()
+            changed = np.flatnonzero(
+                _bits(getattr(previous, name).ravel()) != _bits(new)
+            ).astype(np.int32)
+            arrays[name + '_indexes'] = changed
+            arrays[name + '_values'] = new[changed]
+        return arrays
+
+
+class IterationHistoryReader(object):
+    """Read a history file written by an IterationHistoryWriter and
+    reconstruct the state of the analysis at any of its iterations"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        # (iteration, full, offset, length) of every record, in file order
+        self.records = []
+        with io.open(file_path, 'rb') as in_stream:
+            offset = 0
+            while True:
+                header = in_stream.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                iteration, full, length = RECORD_HEADER.unpack(header)
+                offset += RECORD_HEADER.size
+                self.records.append((iteration, full, offset, length))
+                offset += length
+                in_stream.seek(offset)
+        self._latest = None
+        self._latest_position = None
+
+    @property
+    def iterations(self):
+        """The iterations in the history, in the order they were written"""
+        return [x[0] for x in self.records]
+
+    def _load(self, in_stream, position):
+        _, _, offset, length = self.records[position]
+        in_stream.seek(offset)
+        with np.load(io.BytesIO(in_stream.read(length))) as archive:
+            return dict((name, archive[name]) for name in archive.files)
+
+    def snapshot(self, iteration):
+        """Return an IterationSnapshot of the analysis at the end of the
+        given iteration"""
+        matches = [idx for idx, record in enumerate(self.records)
+                   if record[0] == iteration]
+        if not matches:
+            raise KeyError("Iteration {} is not in the history".format(
+                iteration))
+        target = matches[-1]
+        first = max(idx for idx in range(target + 1) if self.records[idx][1])
+        # carry on from the last snapshot reconstructed if we can, otherwise
+        # start again from the last full record before the target
+        if self._latest_position is not None and \
+                first <= self._latest_position <= target:
+            snapshot = self._latest.copy()
+            start = self._latest_position + 1
+        else:
+            snapshot = None
+            start = first
+        with io.open(self.file_path, 'rb') as in_stream:
+            for idx in range(start, target + 1):
+                arrays = self._load(in_stream, idx)
+                if self.records[idx][1]:
+                    snapshot = self._from_full_record(arrays)
+                else:
+                    self._apply_delta_record(snapshot, arrays)
+        snapshot.iteration = self.records[target][0]
+        self._latest = snapshot.copy()
+        self._latest_position = target
+        return snapshot
+
+    @staticmethod
+    def _from_full_record(arrays):
+        return IterationSnapshot(None, arrays['entity_names'].tolist(),
+                                 arrays['list_names'].tolist(),
+                                 arrays['category_names'].tolist(),
+                                 arrays['entity_scores'],
+                                 arrays['list_weights'],
+                                 arrays['category_winners'])
+
+    @staticmethod
+    def _apply_delta_record(snapshot, arrays):
+        for name in SNAPSHOT_ARRAYS:
+            values = getattr(snapshot, name)
+            values.ravel()[arrays[name + '_indexes']] = \
+                arrays[name + '_values']
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="List the iterations in a MAIC iteration history, or "
+                    "print the scores and category winners of one of them")
+    parser.add_argument('history_file',
+                        help='the iteration history file (e.g. {} in an '
+                             'output folder)'.format(HISTORY_FILENAME))
+    parser.add_argument('iteration', nargs='?', type=int, default=None,
+                        help='the iteration to print (default: list the '
+                             'recorded iterations)')
+    return parser
+
+
+def main(args):
+    parser = build_parser()
+    options = parser.parse_args(args)
+    try:
+        reader = IterationHistoryReader(options.history_file)
+    except IOError as error:
+        parser.error("cannot read the history file: {}".format(error))
+    if options.iteration is None:
+        print("\n".join(str(x) for x in reader.iterations))
+        return
+    try:
+        snapshot = reader.snapshot(options.iteration)
+    except KeyError as error:
+        parser.error(error.args[0])
+    print("\t".join(['gene', 'maic_score'] + snapshot.category_names))
+    for row, name in enumerate(snapshot.entity_names):
+        winners = snapshot.category_winners[row].tolist()
+        print("\t".join(
+            [name, repr(snapshot.entity_scores[row])] +
+            [snapshot.list_names[x] if x != NO_WINNER else ''
+             for x in winners]))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
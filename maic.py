@@ -7,14 +7,28 @@ import re
 import sys
 from time import strftime
 
-from cross_validation import build_cross_validation, POST_ITERATION_CALLBACK
+from analysis_state import Checkpointer, load_state, restore_state, \
+    save_state
+from background_writer import BackgroundWriter
+from batch_fitter import BatchExponentialFitter
+from convergence import ConvergenceMonitor
+from cross_validation import build_cross_validation, \
+    POST_ITERATION_CALLBACK, POST_STEP_CALLBACK, OUTPUT_PHASE
 from cv_dumper import CrossValidationDumper
 from cv_plotter import CrossValidationPlotter
+from dirty_set import DirtySetTracker
 from entitylist_builder import EntityListBuilder
 from file_reader import FileReader
+from fixed_point_solver import AcceleratedSolver, PICARD
+from fit_statistics import FitStatisticsCollector
+from gauss_seidel_engine import GaussSeidelEngine
 from genescores_dumper import AllScoresGeneScoresDumper, \
     IterationAwareGeneScoresDumper
+from iteration_history import IterationHistoryWriter
 from options import get_parsed_options
+from parallel_fitter import ParallelCurveFitter
+from profiler import PhaseProfiler
+from vectorized_engine import VectorizedEngine
 
 
 class Maic(object):
@@ -35,18 +49,41 @@ class Maic(object):
         logger = logging.getLogger(__name__)
         # Create a new FileReader object
         file_reader = FileReader()
-        # Tell it to read the file, passing in the path to the file as an
-        # argument
-        logger.info("Reading the input data file")
-        file_reader.read_file(options.filename)
         # Make a new EntityListBuilder
-        elb = EntityListBuilder(options.weight_function, options.max_input_len)
-        # Use the lines read and the EntityListBuilder to create a
-        # CrossValidation analysis object
-        cross_validation = build_cross_validation(file_reader.list_lines, elb,
-                                                  options.stability,
-                                                  options.max_iterations)
+        elb = EntityListBuilder(options.weight_function, options.max_input_len,
+                                warm_start=options.warm_start,
+                                refit_tolerance=options.refit_tolerance)
+        # Stream the lines of the input file straight into the
+        # EntityListBuilder to create a CrossValidation analysis object
+        logger.info("Reading the input data file")
+        cross_validation = build_cross_validation(
+            file_reader.iter_lines(options.filename), elb, options.stability,
+            options.max_iterations)
         logger.info("CrossValidation analysis set up")
+        if options.engine == 'vectorized':
+            cross_validation.engine = VectorizedEngine()
+        elif options.engine == 'gauss-seidel':
+            cross_validation.engine = GaussSeidelEngine()
+        if options.dirty_epsilon is not None:
+            if options.engine == 'object':
+                cross_validation.dirty_set = DirtySetTracker(
+                    options.dirty_epsilon)
+            else:
+                logger.warning("--dirty-epsilon is only used by the object "
+                               "engine")
+        if options.batch_fit:
+            cross_validation.curve_fitter = BatchExponentialFitter()
+        elif options.workers > 1:
+            cross_validation.curve_fitter = ParallelCurveFitter(
+                options.workers)
+
+        if options.solver != PICARD:
+            cross_validation.solver = AcceleratedSolver(options.solver,
+                                                        options.solver_memory)
+
+        if options.write_queue > 0:
+            cross_validation.background_writer = BackgroundWriter(
+                options.write_queue)
 
         output_folder = self.make_output_folder(options.output_folder)
         logger.info("Output folder created")
@@ -54,28 +91,110 @@ class Maic(object):
         if options.plot:
             images_folder = self.make_output_folder(
                 os.sep.join([output_folder, "images"]))
-            cross_validation.plotter = CrossValidationPlotter(images_folder)
+            cross_validation.plotter = CrossValidationPlotter(
+                images_folder, panels=options.plot_panels,
+                workers=options.plot_workers)
 
         if options.dump:
             dump_folder = self.make_output_folder(
                 os.sep.join([output_folder, "scores"])
             )
-            iteration_aware_dumper = IterationAwareGeneScoresDumper(
-                cross_validation, dump_folder)
-            cross_validation_dumper = CrossValidationDumper(
-                dumper=iteration_aware_dumper)
+            if options.dump_history:
+                cross_validation.register_callback(
+                    POST_ITERATION_CALLBACK,
+                    IterationHistoryWriter(dump_folder))
+            else:
+                iteration_aware_dumper = IterationAwareGeneScoresDumper(
+                    cross_validation, dump_folder,
+                    output_format=options.output_format)
+                cross_validation_dumper = CrossValidationDumper(
+                    dumper=iteration_aware_dumper)
+                cross_validation.register_callback(POST_ITERATION_CALLBACK,
+                                                   cross_validation_dumper)
+
+        fit_statistics = None
+        if options.warm_start or options.refit_tolerance > 0:
+            fit_statistics = FitStatisticsCollector()
             cross_validation.register_callback(POST_ITERATION_CALLBACK,
-                                               cross_validation_dumper)
-
+                                               fit_statistics)
+
+        convergence = None
+        if options.relative_tolerance is not None or options.top_n or \
+                options.aitken:
+            convergence = ConvergenceMonitor(
+                relative_tolerance=options.relative_tolerance,
+                top_n=options.top_n, rank_patience=options.rank_patience,
+                aitken=options.aitken)
+            cross_validation.convergence = convergence
+
+        if options.checkpoint:
+            cross_validation.register_callback(
+                POST_STEP_CALLBACK,
+                Checkpointer(options.checkpoint,
+                             options.checkpoint_interval))
+
+        profiler = None
+        if options.profile:
+            profiler = PhaseProfiler(trace_memory=options.profile_memory)
+            profiler.register(cross_validation)
+
+        # Create the final dumper now so that an output format that can't
+        # be written is reported before the analysis is run
+        gsd = AllScoresGeneScoresDumper(cross_validation, output_folder,
+                                        output_format=options.output_format)
+
+        if options.resume:
+            self.resume_from_checkpoint(cross_validation, options.resume)
+        elif options.start_from:
+            restore_state(cross_validation, load_state(options.start_from))
+            # a new analysis, but starting from the saved weights
+            cross_validation.iteration = 0
 
         logger.info("Running the CrossValidation analysis")
-        cross_validation.run()
+        cross_validation.run(
+            resume=bool(options.resume or options.start_from))
+        if isinstance(cross_validation.curve_fitter, ParallelCurveFitter):
+            cross_validation.curve_fitter.close()
+        if cross_validation.background_writer:
+            cross_validation.background_writer.close()
+        if cross_validation.plotter:
+            cross_validation.plotter.close()
         logger.info("CrossValidation analysis complete")
+        if options.save_state:
+            save_state(cross_validation, options.save_state)
+        if cross_validation.solver:
+            logger.info(cross_validation.solver.summary())
+        if fit_statistics:
+            fit_statistics.dump(output_folder)
+        if convergence:
+            convergence.dump(output_folder)
+        if cross_validation.dirty_set:
+            cross_validation.dirty_set.dump(output_folder)
 
         logger.info("Dumping gene scores")
-        gsd = AllScoresGeneScoresDumper(cross_validation, output_folder)
-        gsd.dump()
+        with cross_validation.phase(OUTPUT_PHASE):
+            gsd.dump()
         gsd.dataset_feature_check_to_choice_methods()
+        if profiler:
+            profiler.dump(output_folder, options.profile)
+
+    @staticmethod
+    def resume_from_checkpoint(cross_validation, checkpoint):
+        """Restore the state of an interrupted analysis from a checkpoint,
+        failing if it is not a checkpoint of the same input"""
+        state = load_state(checkpoint)
+        restored = restore_state(cross_validation, state)
+        expected = (len(cross_validation.entity_lists),
+                    len(cross_validation.entities))
+        if restored != expected or \
+                len(state['list_names']) != expected[0] or \
+                len(state['entity_names']) != expected[1]:
+            raise ValueError(
+                "Checkpoint {} is not of this input: it holds {} lists and "
+                "{} entities, the input has {} and {}, and {} and {} "
+                "match".format(checkpoint, len(state['list_names']),
+                               len(state['entity_names']), expected[0],
+                               expected[1], restored[0], restored[1]))
 
     def make_output_folder(self, output_folder):
         """Given a requested output folder, create it and return the full
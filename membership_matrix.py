@@ -0,0 +1,131 @@
+"""
+Code relating to an array-backed view of the Entity/EntityList graph
+"""
+import numpy as np
+
+
+class MembershipMatrix(object):
+    """A compiled, sparse (coordinate format) representation of which
+    Entities appear on which EntityLists. Each membership records the
+    Entity, the EntityList, the (one-based) rank of the Entity within the
+    list and the category of the list.
+
+    Memberships are stored in 'list order' (list by list, in rank order
+    within each list) which is the order used by EntityList.weights_vector().
+    The matrix also pre-computes the grouping of memberships by Entity and
+    category that is needed to take the maximum weight per category."""
+
+    def __init__(self, entities, entity_lists):
+        """Compile the membership graph for the supplied Entities and
+        EntityLists. Only the supplied EntityLists are considered."""
+        self.entities = list(entities)
+        self.entity_lists = list(entity_lists)
+        self.entity_count = len(self.entities)
+        self.list_count = len(self.entity_lists)
+
+        entity_index = {}
+        for idx, entity in enumerate(self.entities):
+            entity_index[entity] = idx
+        list_index = {}
+        for idx, entity_list in enumerate(self.entity_lists):
+            list_index[entity_list] = idx
+
+        self.categories = []
+        category_ids = {}
+        list_categories = []
+        for entity_list in self.entity_lists:
+            if entity_list.category not in category_ids:
+                category_ids[entity_list.category] = len(self.categories)
+                self.categories.append(entity_list.category)
+            list_categories.append(category_ids[entity_list.category])
+        self.list_categories = np.array(list_categories, dtype=np.int32)
+        self.list_sizes = np.array([len(x) for x in self.entity_lists],
+                                   dtype=np.int64)
+
+        # The memberships, in list order
+        entity_ids = []
+        for entity_list in self.entity_lists:
+            for entity in entity_list:
+                entity_ids.append(entity_index[entity])
+        self.entity_ids = np.array(entity_ids, dtype=np.int32)
+        self.list_ids = np.repeat(
+            np.arange(self.list_count, dtype=np.int32), self.list_sizes)
+        starts = np.cumsum(self.list_sizes) - self.list_sizes
+        self.ranks = (np.arange(len(self.entity_ids)) -
+                      np.repeat(starts, self.list_sizes) + 1).astype(np.int32)
+        self.category_ids = self.list_categories[self.list_ids]
+        self.membership_count = len(self.entity_ids)
+
+        self._build_entity_order(list_index)
+        self._build_category_groups()
+
+    def _build_entity_order(self, list_index):
+        """Work out the permutation that takes the memberships from list
+        order into 'entity order' i.e. Entity by Entity, visiting each
+        Entity's lists in the same order as the Entity.lists attribute"""
+        keys = []
+        for idx, entity in enumerate(self.entities):
+            for entity_list in entity.lists:
+                if entity_list in list_index:
+                    keys.append(idx * self.list_count +
+                                list_index[entity_list])
+        keys = np.array(keys, dtype=np.int64)
+        list_order_keys = (self.entity_ids.astype(np.int64) *
+                           self.list_count + self.list_ids)
+        sorter = np.argsort(list_order_keys, kind='stable')
+        found = np.searchsorted(list_order_keys, keys, sorter=sorter)
+        self.entity_order = sorter[found]
+
+    def _build_category_groups(self):
+        """Group the memberships by (Entity, category), preserving the entity
+        order within each group. Then work out the order in which the group
+        maxima should be summed so that it matches the order in which each
+        Entity first encounters each category."""
+        entity_ids = self.entity_ids[self.entity_order]
+        category_ids = self.category_ids[self.entity_order]
+        # lexsort is stable so entity order is preserved within groups
+        grouping = np.lexsort((category_ids, entity_ids))
+        self.group_order = self.entity_order[grouping]
+        entity_ids = entity_ids[grouping]
+        category_ids = category_ids[grouping]
+        if self.membership_count:
+            changed = np.flatnonzero(
+                (entity_ids[1:] != entity_ids[:-1]) |
+                (category_ids[1:] != category_ids[:-1])) + 1
+            self.group_starts = np.concatenate(([0], changed))
+        else:
+            self.group_starts = np.zeros(0, dtype=np.int64)
+        self.group_sizes = np.diff(
+            np.append(self.group_starts, self.membership_count))
+        self.group_entities = entity_ids[self.group_starts]
+        self.group_categories = category_ids[self.group_starts]
+        # The first position (in entity order) of each group tells us when
+        # the Entity first saw that category
+        first_positions = grouping[self.group_starts]
+        self.group_sum_order = np.argsort(first_positions, kind='stable')
+
+    def category_maxima(self, weights):
+        """Given the weights for every membership (in list order), return a
+        tuple of the maximum weight for each (Entity, category) group and
+        the membership (in list order) that supplied it. Where there is a
+        tie, the first membership in entity order wins."""
+        if not self.membership_count:
+            return np.zeros(0), np.zeros(0, dtype=np.int64)
+        grouped = weights[self.group_order]
+        maxima = np.maximum.reduceat(grouped, self.group_starts)
+        is_max = grouped == np.repeat(maxima, self.group_sizes)
+        candidates = np.where(is_max, np.arange(self.membership_count),
+                              self.membership_count)
+        first = np.minimum.reduceat(candidates, self.group_starts)
+        return maxima, self.group_order[first]
+
+    def entity_scores(self, maxima):
+        """Sum the per-category maxima for each Entity"""
+        return np.bincount(self.group_entities[self.group_sum_order],
+                           weights=maxima[self.group_sum_order],
+                           minlength=self.entity_count)
+
+    def list_totals(self, scores):
+        """Sum the scores of the member Entities of each list"""
+        return np.bincount(self.list_ids, weights=scores[self.entity_ids],
+                           minlength=self.list_count)
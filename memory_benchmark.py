@@ -0,0 +1,107 @@
+# coding=utf-8
+"""
+Measure the memory used per Entity when building the Entity/EntityList graph
+for a synthetic input, with Entity, with the compact (slotted) CompactEntity
+and, as a baseline, with the layout the graph had before either: Entities
+with an instance __dict__ and a dict of per-list weights, and EntityLists
+that kept a __seen dict of their members as well as the index dict.
+
+Usage: python memory_benchmark.py [-n ENTITIES] [-l LISTS] [-c CATEGORIES]
+"""
+from __future__ import print_function
+
+import argparse
+import gc
+import random
+import sys
+import tracemalloc
+
+from cross_validation import build_cross_validation
+from entity import CompactEntity, Entity
+from entitylist_builder import EntityListBuilder
+
+
+class BaselineEntity(object):
+    """The storage of an Entity as it was before CompactEntity: attributes
+    in an instance __dict__ and the per-list weights in a dict keyed by
+    list. Only what building the lists uses is reproduced"""
+
+    def __init__(self, name):
+        assert name
+        self.name = name
+        self.score = 1
+        self.lists = []
+        self.__weights = {}
+        self.__category_winners = {}
+        self.adjusted_scores = {}
+
+    def note_list(self, entity_list):
+        if entity_list not in self.lists:
+            self.lists.append(entity_list)
+            self.__weights[entity_list] = 0.0
+
+
+def synthetic_lines(entity_count, list_count, category_count,
+                    shared_fraction=0.1, seed=1):
+    """Return the lines of a synthetic MAIC input that mentions exactly
+    entity_count distinct Entities. Every Entity appears on one list and a
+    shared_fraction of them also appear on every other list"""
+    rng = random.Random(seed)
+    names = ["entity{}".format(x) for x in range(entity_count)]
+    shared = names[:int(entity_count * shared_fraction)]
+    lines = []
+    for idx in range(list_count):
+        members = list(dict.fromkeys(shared + names[idx::list_count]))
+        rng.shuffle(members)
+        lines.append("\t".join(
+            ["Category{}".format(idx % category_count),
+             "List{}".format(idx),
+             "RANKED" if idx % 2 else "NOT_RANKED",
+             "NAMED_GENES"] + members))
+    return lines
+
+
+def measure(lines, entity_class, baseline_lists=False):
+    """Build the analysis for the lines using the entity_class and return
+    the number of Entities and the number of bytes allocated while doing
+    so. If baseline_lists is True then each list is also given the __seen
+    dict (Entity -> 1) that EntityLists used to keep"""
+    gc.collect()
+    tracemalloc.start()
+    builder = EntityListBuilder('exponential')
+    builder.entity_class = entity_class
+    cross_validation = build_cross_validation(iter(lines), builder, 0.01,
+                                              100)
+    if baseline_lists:
+        for entity_list in cross_validation.entity_lists:
+            entity_list.seen = dict((x, 1) for x in entity_list)
+    gc.collect()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(cross_validation.entities), allocated
+
+
+def main(args):
+    parser = argparse.ArgumentParser(
+        description="Measure the memory used per Entity")
+    parser.add_argument('-n', '--entities', type=int, default=50000)
+    parser.add_argument('-l', '--lists', type=int, default=20)
+    parser.add_argument('-c', '--categories', type=int, default=4)
+    options = parser.parse_args(args)
+    lines = synthetic_lines(options.entities, options.lists,
+                            options.categories)
+    print("entity_class\tentities\tbytes\tbytes_per_entity\t"
+          "change_from_baseline")
+    baseline = None
+    for entity_class in [BaselineEntity, Entity, CompactEntity]:
+        entities, allocated = measure(lines, entity_class,
+                                      entity_class is BaselineEntity)
+        if baseline is None:
+            baseline = allocated
+        print("{}\t{}\t{}\t{:.1f}\t{:+.1%}".format(
+            entity_class.__name__, entities, allocated,
+            allocated / float(entities), allocated / float(baseline) - 1))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -26,11 +26,139 @@ def get_parsed_options(args=None):
     parser.add_argument('-p', '--plot', default=False, action='store_true',
                         help='draw plots for each list at each iteration')
     #
+    parser.add_argument('--plot-panels', default=False, action='store_true',
+                        help='with -p, draw the plots of all the lists at '
+                             'each iteration as panels of a single image')
+    #
+    parser.add_argument('--plot-workers', default=1, type=int,
+                        help='with -p, number of worker processes used to '
+                             'draw the plots of the lists (default: 1)')
+    #
     parser.add_argument('-d', '--dump-scores', default=False,
                         action='store_true',
                         dest='dump',
                         help='dump maic scores at each iteration')
     #
+    parser.add_argument('--dump-history', default=False, action='store_true',
+                        help='with -d, write the scores at each iteration '
+                             'to a single history file of changes rather '
+                             'than a full table per iteration')
+    #
+    parser.add_argument('-e', '--engine', default='object',
+                        choices=['object', 'vectorized', 'gauss-seidel'],
+                        help='how to perform each iteration - object by '
+                             'object, using array operations or updating '
+                             'the entity scores as soon as each list weight '
+                             'changes (default: object)')
+    #
+    parser.add_argument('--batch-fit', default=False, action='store_true',
+                        help='fit the weights curves of all ranked lists '
+                             'together at each iteration')
+    #
+    parser.add_argument('--warm-start', default=False, action='store_true',
+                        help='also start each curve fit from the parameters '
+                             'of the previous iteration\'s fit, keeping that '
+                             'fit only when it reaches the same minimum as '
+                             'the usual fit, and report the function '
+                             'evaluations used')
+    #
+    parser.add_argument('--refit-tolerance', default=0.0, type=float,
+                        help='skip refitting a ranked list\'s weights curve '
+                             'while none of its entity scores has changed by '
+                             'this much since the last fit (default: 0, '
+                             'always refit); a non-zero tolerance changes '
+                             'the final scores slightly (on the example '
+                             'input, by less than a tenth of the '
+                             'tolerance)')
+    #
+    parser.add_argument('--workers', default=1, type=int,
+                        help='number of worker processes used to fit the '
+                             'weights curves of the ranked lists (default: '
+                             '1; ignored with --batch-fit)')
+    #
+    parser.add_argument('--profile', default=None, choices=['tsv', 'json'],
+                        help='record the time, CPU time, curve fits and peak '
+                             'memory of each phase of each iteration and '
+                             'write them to a profile file in this format')
+    #
+    parser.add_argument('--profile-memory', default=False,
+                        action='store_true',
+                        help='with --profile, trace the peak memory of each '
+                             'phase (slower) rather than reporting the peak '
+                             'memory of the process')
+    #
+    parser.add_argument('--write-queue', default=0, type=int,
+                        help='number of per-iteration plots and score dumps '
+                             'that may wait to be written in the background '
+                             'while the analysis carries on (default: 0, '
+                             'write them before the next iteration)')
+    #
+    parser.add_argument('--output-format', default='txt',
+                        choices=['txt', 'npz', 'parquet', 'feather'],
+                        help='format in which to write the gene scores '
+                             '(default: txt; parquet and feather need '
+                             'pyarrow)')
+    #
+    parser.add_argument('--relative-tolerance', default=None, type=float,
+                        help='also stop once no list weight changes by more '
+                             'than this fraction of itself in an iteration')
+    #
+    parser.add_argument('--top-n', default=None, type=int,
+                        help='also stop once the order of this many top '
+                             'scoring entities has not changed for '
+                             '--rank-patience iterations')
+    #
+    parser.add_argument('--rank-patience', default=3, type=int,
+                        help='number of iterations the --top-n entities must '
+                             'keep their order for (default: 3)')
+    #
+    parser.add_argument('--aitken', default=False, action='store_true',
+                        help='accelerate convergence by Aitken extrapolation '
+                             'of the list weights every three iterations')
+    #
+    parser.add_argument('--solver', default='picard',
+                        choices=['picard', 'anderson', 'broyden'],
+                        help='how each iteration\'s list weights are chosen: '
+                             'plain iteration (picard, the default) or '
+                             'Anderson or Broyden acceleration')
+    #
+    parser.add_argument('--solver-memory', default=5, type=int,
+                        help='number of past iterations the anderson and '
+                             'broyden solvers mix (default: 5)')
+    #
+    parser.add_argument('--dirty-epsilon', default=None, type=float,
+                        help='with the object engine, only recalculate the '
+                             'scores of entities on lists whose weights have '
+                             'changed by more than this, and the weights of '
+                             'lists whose members\' scores have changed '
+                             '(0 gives the same results as recalculating '
+                             'everything)')
+    #
+    parser.add_argument('--save-state', default=None,
+                        help='write the final state of the analysis (list '
+                             'weights, fitted weights and entity scores) to '
+                             'this file, to start a later analysis from')
+    #
+    parser.add_argument('--start-from', default=None,
+                        help='start from the list weights and entity scores '
+                             'in this state file (written by --save-state) '
+                             'rather than from scratch; lists and entities '
+                             'not in it start as usual')
+    #
+    parser.add_argument('--checkpoint', default=None,
+                        help='save the state of the analysis to this file '
+                             'as it runs, so that it can be carried on with '
+                             '--resume if it is interrupted')
+    #
+    parser.add_argument('--checkpoint-interval', default=1, type=int,
+                        help='number of iterations between checkpoints '
+                             '(default: 1)')
+    #
+    parser.add_argument('--resume', default=None,
+                        help='carry on an interrupted analysis of the same '
+                             'input, with the same options, from this '
+                             'checkpoint file')
+    #
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase the detail of logging messages.')
     #
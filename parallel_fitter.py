@@ -0,0 +1,93 @@
+"""
+Code relating to fitting the weights curves of ranked lists in parallel
+worker processes
+"""
+import logging
+from multiprocessing import Pool
+
+from entity import Entity
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+# Below this many Entities (summed over the lists to be fitted) the cost of
+# shipping the work to the pool outweighs the benefit so we fit serially
+DEFAULT_MIN_PARALLEL_ENTITIES = 2000
+
+
+def fit_detached_list(payload):
+    """Repeat the curve fit described by an EntityList.fit_payload() on a
+    freshly built copy of the list and return its fit_result(). Run in the
+    worker processes."""
+    list_class, scores, weight, state = payload
+    entity_list = list_class()
+    for idx, score in enumerate(scores.tolist()):
+        entity = Entity(str(idx + 1))
+        entity.score = score
+        entity_list.append(entity)
+    entity_list.weight = weight
+    entity_list._restore_fit_state(state)
+    entity_list._fit_curve_to_entity_scores()
+    return entity_list.fit_result()
+
+
+class ParallelCurveFitter(object):
+    """Fit the weights curves of all the ranked lists in an analysis using a
+    pool of worker processes. Each list is sent to a worker as its class,
+    its rank-ordered member scores and its weight; the fitted weights_list
+    (and any fit state) comes back. The fitting code is the list's own so
+    the results are identical to fitting the lists one by one.
+
+    Small jobs are fitted serially in this process."""
+
+    def __init__(self, workers, min_parallel_entities=None):
+        """Create a ParallelCurveFitter that uses the given number of worker
+        processes."""
+        self.workers = workers
+        self.min_parallel_entities = DEFAULT_MIN_PARALLEL_ENTITIES \
+            if min_parallel_entities is None else min_parallel_entities
+        self._pool = None
+
+    @staticmethod
+    def can_fit(entity_list):
+        """Report whether this fitter knows how to fit the given list"""
+        return entity_list.uses_fitted_weights and len(entity_list) > 0
+
+    def fit(self, entity_lists, force=False):
+        """Fit the curve to every one of the supplied lists that needs
+        refitting (or all of them if force is True) and store the results
+        in the lists"""
+        if not force:
+            for entity_list in entity_lists:
+                if not entity_list.needs_refit():
+                    entity_list.skip_fit()
+            entity_lists = [x for x in entity_lists if not x.fit_skipped]
+        if not entity_lists:
+            return
+        entity_count = sum(len(x) for x in entity_lists)
+        if self.workers < 2 or len(entity_lists) < 2 or \
+                entity_count < self.min_parallel_entities:
+            for entity_list in entity_lists:
+                entity_list.refit()
+            return
+        if self._pool is None:
+            self._pool = Pool(self.workers)
+        results = self._pool.map(fit_detached_list,
+                                 [x.fit_payload() for x in entity_lists])
+        for entity_list, result in zip(entity_lists, results):
+            entity_list.apply_fit_result(result)
+            entity_list.fit_completed()
+        logger.debug("Fitted {} lists using {} workers".format(
+            len(entity_lists), self.workers))
+
+    def refit_skipped(self, entity_lists):
+        """Fit the curve to those of the supplied lists whose last fit was
+        skipped"""
+        self.fit([x for x in entity_lists if x.fit_skipped], force=True)
+
+    def close(self):
+        """Shut down the worker processes"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
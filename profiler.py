@@ -0,0 +1,157 @@
+"""
+Code relating to the profiling of each phase of each iteration of a
+CrossValidation analysis
+"""
+import json
+import logging
+import time
+import tracemalloc
+
+from cross_validation import POST_ITERATION_CALLBACK, PRE_PHASE_CALLBACK, \
+    POST_PHASE_CALLBACK
+from utils import tab_separated_lines, write_report
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+PROFILE_COLUMNS = ['iteration', 'phase', 'wall_time', 'cpu_time', 'fits',
+                   'peak_memory']
+# The phase name used for the whole of each iteration
+ITERATION_TOTAL = 'iteration'
+
+
+class CallbackHook(object):
+    """Adapt a function taking (cross_validation, context) arguments to the
+    do_callback interface used by CrossValidation.register_callback"""
+
+    def __init__(self, function):
+        self.function = function
+
+    def do_callback(self, cross_validation=None, context=None):
+        self.function(cross_validation, context)
+
+
+class PhaseProfiler(object):
+    """Record the wall time, CPU time, number of curve fits and peak memory
+    of every phase (scoring, weighting, fitting, plotting, dumping...) of
+    every iteration of a CrossValidation analysis, plus the totals for each
+    iteration. A phase entered more than once in an iteration is recorded
+    once, with its times and fits added up.
+
+    If trace_memory is True the peak memory is the peak of the memory
+    traced by tracemalloc during the phase (which slows the analysis down).
+    Otherwise it is the peak resident set size of the process so far, as
+    reported by the operating system (None where that is not available)."""
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._phase_starts = {}
+        self._iteration_start = None
+        self._iteration = None
+        self._iteration_records = {}
+
+    def register(self, cross_validation):
+        """Register the profiler's callbacks with the CrossValidation
+        analysis"""
+        cross_validation.register_callback(PRE_PHASE_CALLBACK,
+                                           CallbackHook(self.start_phase))
+        cross_validation.register_callback(POST_PHASE_CALLBACK,
+                                           CallbackHook(self.end_phase))
+        cross_validation.register_callback(POST_ITERATION_CALLBACK,
+                                           CallbackHook(self.end_iteration))
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def start_phase(self, cross_validation, context):
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+        sample = self._sample(cross_validation)
+        self._phase_starts[context] = sample
+        if self._iteration_start is None:
+            self._iteration_start = sample
+
+    def end_phase(self, cross_validation, context):
+        start = self._phase_starts.pop(context, None)
+        if start is None:
+            return
+        phase_name, iteration = context
+        self._record(iteration, phase_name, start,
+                     self._sample(cross_validation))
+
+    def end_iteration(self, cross_validation, iteration):
+        if self._iteration_start is None:
+            return
+        end = self._sample(cross_validation)
+        self._record(iteration, ITERATION_TOTAL, self._iteration_start, end)
+        self._iteration_start = end
+
+    def _sample(self, cross_validation):
+        fits = 0
+        for entity_list in cross_validation.entity_lists:
+            if entity_list.uses_fitted_weights:
+                fits += entity_list.fit_count
+        return time.perf_counter(), time.process_time(), fits
+
+    def _peak_memory(self):
+        if self.trace_memory:
+            return tracemalloc.get_traced_memory()[1]
+        if resource is None:
+            return None
+        # ru_maxrss is in kilobytes on Linux (but bytes on macOS)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _record(self, iteration, phase_name, start, end):
+        """Record a phase, adding it to the record of the same phase of
+        the same iteration if there is one (e.g. when an engine weights and
+        fits the lists one at a time)"""
+        if iteration != self._iteration:
+            self._iteration = iteration
+            self._iteration_records = {}
+        record = self._iteration_records.get(phase_name)
+        if record is None:
+            record = dict(iteration=iteration, phase=phase_name,
+                          wall_time=0.0, cpu_time=0.0, fits=0,
+                          peak_memory=None)
+            self.records.append(record)
+            self._iteration_records[phase_name] = record
+        record['wall_time'] += end[0] - start[0]
+        record['cpu_time'] += end[1] - start[1]
+        record['fits'] += end[2] - start[2]
+        peak_memory = self._peak_memory()
+        if peak_memory is not None:
+            record['peak_memory'] = max(record['peak_memory'] or 0,
+                                        peak_memory)
+
+    def totals(self):
+        """Return the total wall time, CPU time and fits of each phase over
+        all the iterations, along with its largest peak memory"""
+        totals = {}
+        for record in self.records:
+            if record['phase'] not in totals:
+                totals[record['phase']] = dict(
+                    wall_time=0.0, cpu_time=0.0, fits=0, peak_memory=None)
+            total = totals[record['phase']]
+            total['wall_time'] += record['wall_time']
+            total['cpu_time'] += record['cpu_time']
+            total['fits'] += record['fits']
+            if record['peak_memory'] is not None:
+                total['peak_memory'] = max(total['peak_memory'] or 0,
+                                           record['peak_memory'])
+        return totals
+
+    def dump(self, output_folder=None, output_format='tsv'):
+        """Write the profile (as JSON or tab-separated values) to a file in
+        the output folder, or to the log if there is no output folder"""
+        if output_format == 'json':
+            lines = [json.dumps(dict(phases=self.records,
+                                     totals=self.totals()), indent=2) + '\n']
+        else:
+            lines = tab_separated_lines(PROFILE_COLUMNS, self.records)
+        write_report(lines, output_folder, 'profile.{}'.format(output_format),
+                     "Profile", logger)
@@ -0,0 +1,77 @@
+"""
+Code relating to the generation of synthetic MAIC input data, laid out like
+the simulated inputs in example_input_and_result
+"""
+import io
+import random
+
+
+class SyntheticDataGenerator(object):
+    """Generate the lines of a synthetic MAIC input file.
+
+    There is a pool of 'signal' entities (named entityN) that tend to
+    appear on many lists, near the top of ranked lists, and a much larger
+    pool of 'noise' entities (named noiseN) that appear at random. The
+    lists are spread evenly over the categories and every list length is
+    drawn uniformly from [min_length, max_length]."""
+
+    def __init__(self, categories=10, ranked_lists=10, unranked_lists=10,
+                 min_length=20, max_length=2000, signal_entities=1000,
+                 noise_entities=20000, signal_fraction=0.2, seed=1):
+        """Create a SyntheticDataGenerator. signal_fraction is the expected
+        proportion of each list that is made up of signal entities. The
+        seed makes the output reproducible"""
+        assert categories > 0
+        assert ranked_lists + unranked_lists > 0
+        assert 0 < min_length <= max_length
+        assert max_length <= signal_entities + noise_entities
+        self.categories = categories
+        self.ranked_lists = ranked_lists
+        self.unranked_lists = unranked_lists
+        self.min_length = min_length
+        self.max_length = max_length
+        self.signal_entities = signal_entities
+        self.noise_entities = noise_entities
+        self.signal_fraction = signal_fraction
+        self.seed = seed
+
+    def lines(self):
+        """Generate the input lines, one per list"""
+        rng = random.Random(self.seed)
+        list_count = self.ranked_lists + self.unranked_lists
+        for idx in range(list_count):
+            is_ranked = idx < self.ranked_lists
+            length = rng.randint(self.min_length, self.max_length)
+            signal_count = min(self.signal_entities,
+                               int(round(length * self.signal_fraction)))
+            noise_count = min(self.noise_entities, length - signal_count)
+            signal_count = length - noise_count
+            signal = ["entity{}".format(x) for x in
+                      rng.sample(range(self.signal_entities), signal_count)]
+            noise = ["noise{}".format(x) for x in
+                     rng.sample(range(self.noise_entities), noise_count)]
+            if is_ranked:
+                members = self._rank(rng, signal, noise)
+            else:
+                members = signal + noise
+                rng.shuffle(members)
+            yield "\t".join(
+                ["Category{}".format(idx % self.categories + 1),
+                 "List{}".format(idx + 1),
+                 "RANKED" if is_ranked else "UNRANKED",
+                 "NAMED_GENES"] + members)
+
+    @staticmethod
+    def _rank(rng, signal, noise):
+        """Interleave the signal and noise entities so that the signal tends
+        to be found near the top of the list"""
+        members = [(rng.random() * 0.5, x) for x in signal] + \
+                  [(rng.random(), x) for x in noise]
+        members.sort()
+        return [x[1] for x in members]
+
+    def write(self, file_path):
+        """Write the generated input lines to the given file"""
+        with io.open(file_path, 'w') as out_stream:
+            for line in self.lines():
+                out_stream.write(line + "\n")
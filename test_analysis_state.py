@@ -0,0 +1,168 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from analysis_state import Checkpointer, load_state, restore_state, \
+    save_state
+from mock import Mock
+
+from analysis_fixtures import build_analysis, TEST_LINES
+from convergence import ConvergenceMonitor
+from cross_validation import build_cross_validation, POST_STEP_CALLBACK
+from entitylist_builder import EntityListBuilder
+from vectorized_engine import VectorizedEngine
+
+
+class Interruption(Exception):
+    pass
+
+
+class InterruptAt(object):
+    """A callback that interrupts the analysis"""
+
+    def __init__(self, iteration):
+        self.iteration = iteration
+
+    def do_callback(self, cross_validation, iteration):
+        if iteration == self.iteration:
+            raise Interruption()
+
+
+def list_states(cross_validation):
+    states = []
+    for entity_list in cross_validation.entity_lists:
+        state = entity_list.analysis_state()
+        states.append((entity_list.name, state['weight'], state['delta'],
+                       [float(x) for x in state['weights_list']],
+                       state['ratio'], state['fit_count']))
+    return states
+
+
+def entity_states(cross_validation):
+    return [(x.name, x.score,
+             [(y.name, z) for y, z in x.raw_scores_by_list()],
+             sorted((y, z.name) for y, z in
+                    x.winning_lists_by_category().items()))
+            for x in cross_validation.entities]
+
+
+class TestAnalysisState(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'state.npz')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_round_trip(self):
+        """Check that restoring a saved state into a new analysis of the
+        same input gives every list and Entity exactly the saved state"""
+        expected = build_analysis('exponential')
+        expected.max_iterations = 3
+        expected.run_analysis()
+        save_state(expected, self.path)
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        actual = build_analysis('exponential')
+        self.assertEqual((6, len(actual.entities)),
+                         restore_state(actual, load_state(self.path)))
+        self.assertEqual(3, actual.iteration)
+        self.assertEqual(list_states(expected), list_states(actual))
+        self.assertEqual(entity_states(expected), entity_states(actual))
+        self.assertEqual(list(expected.entity_lists[0].fit_parameters),
+                         actual.entity_lists[0].fit_parameters)
+
+    def test_new_and_changed_lists_start_afresh(self):
+        """Check that a list missing from the state keeps its starting
+        state and a list whose length has changed keeps only its weight"""
+        expected = build_analysis('exponential')
+        expected.run_analysis()
+        save_state(expected, self.path)
+        lines = TEST_LINES[:] + ["CAT4\tList7\tUNRANKED\tX\tA\tZ"]
+        lines[0] += "\tY"
+        actual = build_cross_validation(lines,
+                                        EntityListBuilder('exponential'),
+                                        0.01, 100)
+        self.assertEqual((6, len(expected.entities)),
+                         restore_state(actual, load_state(self.path)))
+        changed, added = actual.entity_lists[0], actual.entity_lists[-1]
+        self.assertEqual(expected.entity_lists[0].weight, changed.weight)
+        self.assertEqual([changed.weight], changed.weights_list)
+        self.assertEqual((1, None), (added.weight, added.delta))
+        self.assertEqual(expected.entity_lists[1].weights_list,
+                         actual.entity_lists[1].weights_list)
+
+    def test_checkpointer_saves_every_interval(self):
+        cross_validation = build_analysis('exponential')
+        test_object = Checkpointer(self.path, interval=2)
+        cross_validation.register_callback(POST_STEP_CALLBACK, test_object)
+        cross_validation.max_iterations = 5
+        cross_validation.run_analysis()
+        self.assertEqual(2, test_object.saved)
+        self.assertEqual(4, int(load_state(self.path)['iteration']))
+
+    def test_resumed_analysis_matches_uninterrupted(self):
+        """Check that an analysis interrupted after any iteration and
+        resumed from its checkpoint gives exactly the results of one that
+        ran straight through, with either engine"""
+        for engine in [None, VectorizedEngine]:
+            expected = build_analysis('exponential',
+                                      engine and engine())
+            expected.run()
+            for interrupted_at in range(1, expected.iteration + 1):
+                cross_validation = build_analysis('exponential',
+                                                  engine and engine())
+                cross_validation.register_callback(
+                    POST_STEP_CALLBACK, Checkpointer(self.path))
+                cross_validation.register_callback(
+                    POST_STEP_CALLBACK, InterruptAt(interrupted_at))
+                self.assertRaises(Interruption, cross_validation.run)
+                actual = build_analysis('exponential', engine and engine())
+                restore_state(actual, load_state(self.path))
+                actual.run(resume=True)
+                self.assertEqual(expected.iteration, actual.iteration)
+                self.assertEqual(entity_states(expected),
+                                 entity_states(actual))
+                self.assertEqual(
+                    [x.adjusted_scores for x in expected.entities],
+                    [x.adjusted_scores for x in actual.entities])
+
+    def test_checkpoint_saved_after_solver_step(self):
+        """Check that a checkpoint holds the weights set by the solver step
+        at the end of its iteration, which the next iteration starts from"""
+        def step(cross_validation, iteration):
+            for entity_list in cross_validation.entity_lists:
+                entity_list.weight = 0.5
+        cross_validation = build_analysis('exponential')
+        cross_validation.solver = Mock()
+        cross_validation.solver.step.side_effect = step
+        cross_validation.register_callback(POST_STEP_CALLBACK,
+                                           Checkpointer(self.path))
+        cross_validation.max_iterations = 1
+        cross_validation.run_analysis()
+        cross_validation.solver.step.assert_called_once_with(
+            cross_validation, 1)
+        self.assertEqual([0.5] * len(cross_validation.entity_lists),
+                         load_state(self.path)['list_weights'].tolist())
+
+    def test_resumed_analysis_stops_if_monitor_had_stopped(self):
+        """Check that an analysis resumed from the checkpoint of the
+        iteration at which its convergence monitor stopped it (here by the
+        relative tolerance) runs no further iterations"""
+        expected = build_analysis('exponential')
+        expected.convergence = ConvergenceMonitor(relative_tolerance=0.1)
+        expected.register_callback(POST_STEP_CALLBACK,
+                                   Checkpointer(self.path))
+        expected.run()
+        actual = build_analysis('exponential')
+        actual.convergence = ConvergenceMonitor(relative_tolerance=0.1)
+        restore_state(actual, load_state(self.path))
+        actual.run(resume=True)
+        self.assertEqual(expected.iteration, actual.iteration)
+        self.assertEqual([], actual.convergence.records)
+        self.assertEqual(entity_states(expected), entity_states(actual))
+
+
+if __name__ == '__main__':
+    main()
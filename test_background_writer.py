@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import TestCase, main
+
+import mock
+
+from analysis_fixtures import build_analysis
+from background_writer import BackgroundWriter, write_in_background
+from cross_validation import CrossValidation, POST_ITERATION_CALLBACK
+from cv_dumper import CrossValidationDumper
+from cv_plotter import CrossValidationPlotter
+from genescores_dumper import IterationAwareGeneScoresDumper
+
+
+class TestBackgroundWriter(TestCase):
+
+    def test_tasks_run_in_order(self):
+        """Check that the tasks are run one at a time in the order they
+        were submitted"""
+        test_object = BackgroundWriter(max_pending=2)
+        results = []
+        for idx in range(20):
+            test_object.submit(results.append, idx)
+        test_object.close()
+        self.assertEqual(list(range(20)), results)
+        self.assertEqual(20, test_object.tasks)
+
+    def test_full_queue_applies_back_pressure(self):
+        """Check that submitting a task to a full queue waits until a task
+        has finished"""
+        test_object = BackgroundWriter(max_pending=1)
+        release = threading.Event()
+        test_object.submit(release.wait)
+        submitter = threading.Thread(target=test_object.submit,
+                                     args=(lambda: None,))
+        submitter.start()
+        submitter.join(0.2)
+        self.assertTrue(submitter.is_alive())
+        release.set()
+        submitter.join()
+        test_object.close()
+        self.assertEqual(1, test_object.waits)
+        self.assertTrue(test_object.wait_time > 0.0)
+
+    def test_flush_reraises_task_exceptions(self):
+        """Check that an exception raised by a task is raised again when
+        the queue is flushed"""
+        test_object = BackgroundWriter()
+
+        def fail():
+            raise IOError('disk full')
+
+        test_object.submit(fail)
+        self.assertRaises(IOError, test_object.flush)
+        test_object.close()
+
+    def test_write_in_background_without_writer(self):
+        """Check that the work is done straight away if the analysis has no
+        BackgroundWriter"""
+        cross_val = mock.create_autospec(CrossValidation)
+        function = mock.MagicMock()
+        write_in_background(cross_val, function, 1, key='value')
+        function.assert_called_once_with(1, key='value')
+
+    def test_background_output_matches_synchronous_output(self):
+        """Check that the per-iteration dumps and plots written in the
+        background are the same as those written synchronously"""
+        output_folders = []
+        try:
+            for background_writer in [None, BackgroundWriter(max_pending=2)]:
+                output_folder = tempfile.mkdtemp() + os.sep
+                output_folders.append(output_folder)
+                cross_validation = build_analysis('exponential')
+                cross_validation.max_iterations = 3
+                cross_validation.background_writer = background_writer
+                cross_validation.plotter = CrossValidationPlotter(
+                    output_folder + 'images')
+                os.mkdir(output_folder + 'images')
+                cross_validation.register_callback(
+                    POST_ITERATION_CALLBACK, CrossValidationDumper(
+                        IterationAwareGeneScoresDumper(cross_validation,
+                                                       output_folder)))
+                cross_validation.run()
+            for name in sorted(os.listdir(output_folders[0])):
+                if name.endswith('.txt'):
+                    with open(output_folders[0] + name) as expected, \
+                            open(output_folders[1] + name) as actual:
+                        self.assertEqual(expected.read(), actual.read())
+            self.assertEqual(
+                sorted(os.listdir(output_folders[0] + 'images')),
+                sorted(os.listdir(output_folders[1] + 'images')))
+            self.assertEqual(3 * len(cross_validation.entity_lists),
+                             len(os.listdir(output_folders[1] + 'images')))
+        finally:
+            for output_folder in output_folders:
+                shutil.rmtree(output_folder)
+
+
+if __name__ == '__main__':
+    main()
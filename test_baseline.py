@@ -0,0 +1,141 @@
+import io
+import os
+import shutil
+import sqlite3
+import tempfile
+from unittest import TestCase, main
+
+import baseline
+from baseline import Baseline, BaselineStore, compact, \
+    get_baseline_from_store, put_baseline_to_store
+
+BASELINE_LINES = [
+    "1.0\texponential\t100\tAB\t0.5\t0.1",
+    "1.0\texponential\t1000\tAB\t0.6\t0.2",
+    "1.0\texponential\t1000\tAB\t0.7\t0.3",
+    "1.0\texponential\t10000\tABC\t0.1\t0.1",
+    "not enough columns",
+    "1.0\tknn\t50\tAB\t1.0\t2.0",
+    "2.0\texponential\t5000\tAB\t3.0\t4.0",
+]
+
+
+class TestBaselineStore(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.text_path = os.path.join(self.folder, 'baselines.txt')
+        with io.open(self.text_path, 'w') as out_file:
+            out_file.write("\n".join(BASELINE_LINES) + "\n")
+        self.store_path = os.path.join(self.folder, 'baselines.db')
+        baseline._stores.clear()
+
+    def tearDown(self):
+        baseline.close_stores()
+        shutil.rmtree(self.folder)
+
+    def assertBaseline(self, expected, actual):
+        self.assertEqual(expected, (actual.num_perms, actual.base_score,
+                                    actual.base_stdev))
+
+    def test_text_file_lookups_find_best_match(self):
+        """Check that a tab-separated baselines file gives the baseline with
+        the most permutations (the later one, for a tie) and nothing if
+        that has too few permutations"""
+        self.assertBaseline((1000, 0.7, 0.3), get_baseline_from_store(
+            self.text_path, '1.0', 'AB', 'exponential', 500))
+        self.assertIsNone(get_baseline_from_store(
+            self.text_path, '1.0', 'AB', 'exponential', 1001))
+        self.assertIsNone(get_baseline_from_store(
+            self.text_path, '1.0', 'AB', 'svr', 1))
+        self.assertIsNone(get_baseline_from_store(
+            os.path.join(self.folder, 'missing.txt'), '1.0', 'AB',
+            'exponential', 1))
+
+    def test_put_to_text_file_appends(self):
+        """Check that baselines stored to a tab-separated file are appended
+        to it, as they always were"""
+        put_baseline_to_store(self.text_path, '3.0',
+                              Baseline('AB', 0.25, 0.5, 20, 'exponential'))
+        with io.open(self.text_path) as in_file:
+            self.assertEqual("3.0\texponential\t20\tAB\t0.25\t0.5",
+                             in_file.read().splitlines()[-1])
+        self.assertBaseline((20, 0.25, 0.5), get_baseline_from_store(
+            self.text_path, '3.0', 'AB', 'exponential', 1))
+
+    def test_store_keeps_most_permutations(self):
+        """Check that the store keeps just the baseline with the most
+        permutations for each key"""
+        store = BaselineStore(self.store_path)
+        store.put('1.0', Baseline('AB', 0.5, 0.1, 1000, 'exponential'))
+        store.put('1.0', Baseline('AB', 0.6, 0.2, 100, 'exponential'))
+        self.assertBaseline((1000, 0.5, 0.1),
+                            store.get('1.0', 'AB', 'exponential', 1))
+        store.put('1.0', Baseline('AB', 0.7, 0.3, 1000, 'exponential'))
+        self.assertBaseline((1000, 0.7, 0.3),
+                            store.get('1.0', 'AB', 'exponential', 1))
+        self.assertEqual(1, len(store))
+        store.close()
+        self.assertTrue(baseline.is_sqlite_file(self.store_path))
+
+    def test_lookups_are_cached(self):
+        """Check that repeated lookups are answered from the LRU cache and
+        that the least recently used entries are evicted"""
+        store = BaselineStore(self.text_path, cache_size=2)
+        store.get('1.0', 'AB', 'exponential', 1)
+        store.get('1.0', 'AB', 'exponential', 1)
+        store.get('1.0', 'AB', 'knn', 1)
+        store.get('1.0', 'AB', 'exponential', 1)
+        self.assertEqual((2, 2), (store.hits, store.misses))
+        store.get('1.0', 'ABC', 'exponential', 1)
+        self.assertEqual([('1.0', 'exponential', 'AB'),
+                          ('1.0', 'exponential', 'ABC')],
+                         list(store.cache.keys()))
+        store.close()
+
+    def test_misses_are_not_cached(self):
+        """Check that a lookup that finds no baseline is not cached, so that
+        a baseline stored since is found by the next lookup"""
+        store = BaselineStore(self.store_path)
+        other = BaselineStore(self.store_path)
+        self.assertIsNone(store.get('1.0', 'AB', 'exponential', 1))
+        self.assertEqual([], list(store.cache.keys()))
+        other.put('1.0', Baseline('AB', 0.5, 0.1, 1000, 'exponential'))
+        self.assertBaseline((1000, 0.5, 0.1),
+                            store.get('1.0', 'AB', 'exponential', 1))
+        other.close()
+        store.close()
+
+    def test_stores_are_closed(self):
+        """Check that a store closes its connection at the end of a with
+        block and that close_stores() closes and forgets the stores opened
+        by the module functions"""
+        with BaselineStore(self.store_path) as store:
+            store.put('1.0', Baseline('AB', 0.5, 0.1, 1000, 'exponential'))
+        self.assertRaises(sqlite3.ProgrammingError, len, store)
+
+        put_baseline_to_store(self.store_path, '1.0',
+                              Baseline('AB', 0.6, 0.2, 2000, 'exponential'))
+        opened = baseline._stores[self.store_path]
+        baseline.close_stores()
+        self.assertEqual({}, baseline._stores)
+        self.assertRaises(sqlite3.ProgrammingError, len, opened)
+        self.assertBaseline((2000, 0.6, 0.2), get_baseline_from_store(
+            self.store_path, '1.0', 'AB', 'exponential', 1))
+
+    def test_compact_migrates_text_file(self):
+        """Check that compacting a tab-separated file into a store keeps
+        one baseline per key and that the store then answers lookups"""
+        self.assertEqual(4, compact(self.text_path, self.store_path))
+        self.assertEqual(0, baseline.main(
+            ['compact', self.text_path, self.store_path]))
+        self.assertBaseline((1000, 0.7, 0.3), get_baseline_from_store(
+            self.store_path, '1.0', 'AB', 'exponential', 1))
+        self.assertBaseline((5000, 3.0, 4.0), get_baseline_from_store(
+            self.store_path, '2.0', 'AB', 'exponential', 1))
+        self.assertRaises(ValueError, compact, self.store_path,
+                          self.text_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import numpy as np
+
+from baseline import BaselineStore
+from baseline_generator import BaselineGenerator, RunningStatistics, \
+    parse_code_string, simulated_lines, run_permutation
+from cross_validation import build_cross_validation
+from entitylist_builder import EntityListBuilder
+
+CODE_STRING = '10r.20u|15r'
+
+
+class TestBaselineGenerator(TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.stores = []
+
+    def tearDown(self):
+        for store in self.stores:
+            store.close()
+        shutil.rmtree(self.folder)
+
+    def make_generator(self, name, **kwargs):
+        store = BaselineStore(os.path.join(self.folder, name))
+        self.stores.append(store)
+        return BaselineGenerator(store, random_source_len=40,
+                                 checkpoint_interval=2, **kwargs)
+
+    def test_parse_code_string(self):
+        """Check that a code string is split into categories of lists"""
+        self.assertEqual([[(10, True), (20, False)], [(15, True)]],
+                         parse_code_string(CODE_STRING))
+        self.assertRaises(ValueError, parse_code_string, '10r.20x|15r')
+
+    def test_simulated_lines_match_code_string(self):
+        """Check that a simulated data set has the shape described by the
+        code string and is the same for the same seed"""
+        lines = simulated_lines(CODE_STRING, 100, 7)
+        cross_validation = build_cross_validation(
+            lines, EntityListBuilder('exponential'), 0.01, 100)
+        self.assertEqual(CODE_STRING, cross_validation.code_string())
+        self.assertEqual(lines, simulated_lines(CODE_STRING, 100, 7))
+        self.assertNotEqual(lines, simulated_lines(CODE_STRING, 100, 8))
+
+    def test_running_statistics_match_numpy(self):
+        """Check that adding batches of values gives the mean and standard
+        deviation of all of them"""
+        values = np.random.RandomState(1).rand(100) * 10
+        statistics = RunningStatistics()
+        for batch in [values[:1], values[1:30], values[30:30], values[30:]]:
+            statistics.add_values(batch)
+        self.assertEqual(100, statistics.count)
+        self.assertAlmostEqual(values.mean(), statistics.mean, places=12)
+        self.assertAlmostEqual(values.std(), statistics.stdev, places=12)
+
+    def test_generate_stores_baseline(self):
+        """Check that the baseline of a number of permutations is the mean
+        and standard deviation of all their entity scores, and that it is
+        stored"""
+        generator = self.make_generator('baselines.db')
+        baseline = generator.generate(CODE_STRING, 3)
+        statistics = RunningStatistics()
+        for seed in range(3):
+            statistics.add(*run_permutation(
+                (CODE_STRING, 'exponential', seed, 40, 0.01, 100)))
+        self.assertEqual(3, baseline.num_perms)
+        self.assertEqual(statistics.mean, baseline.base_score)
+        self.assertEqual(statistics.stdev, baseline.base_stdev)
+        self.assertTrue(baseline.base_stdev > 0)
+        stored = generator.store.get(generator.version, CODE_STRING,
+                                     'exponential', 3)
+        self.assertEqual(baseline.base_score, stored.base_score)
+
+    def test_resumed_generation_matches_single_run(self):
+        """Check that extending a baseline to more permutations (here with
+        worker processes) gives the same result as running them all at
+        once, and that permutations already run are not repeated"""
+        expected = self.make_generator('once.db').generate(CODE_STRING, 5)
+        generator = self.make_generator('resumed.db', workers=2)
+        generator.generate(CODE_STRING, 2)
+        actual = generator.generate(CODE_STRING, 5)
+        self.assertEqual((5, expected.base_score, expected.base_stdev),
+                         (actual.num_perms, actual.base_score,
+                          actual.base_stdev))
+        self.assertEqual(5, generator.store.get_progress(
+            generator.version, 'exponential', CODE_STRING)[0])
+        again = generator.generate(CODE_STRING, 4)
+        self.assertEqual((5, expected.base_score),
+                         (again.num_perms, again.base_score))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import os
+import warnings
+from unittest import TestCase, main
+
+import numpy as np
+from mock import patch
+from scipy.optimize import curve_fit, OptimizeWarning
+
+from batch_fitter import BatchExponentialFitter
+from cross_validation import build_cross_validation
+from entity import Entity
+from entitylist import EntityList, ExponentialEntityList, \
+    exponential_function, EXPONENTIAL_FIT_BOUNDS
+from entitylist_builder import EntityListBuilder
+from file_reader import FileReader
+
+EXAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'example_input_and_result', '3_3_0m.txt')
+
+
+def build_list(name, scores):
+    """Make an ExponentialEntityList whose Entities have the given scores and
+    whose weight has been calculated (but not fitted)"""
+    entity_list = ExponentialEntityList()
+    entity_list.name = name
+    for idx, score in enumerate(scores):
+        ent = Entity("{}-{}".format(name, idx))
+        ent.score = score
+        entity_list.append(ent)
+    entity_list.calculate_new_weight(fit_curve=False)
+    return entity_list
+
+
+def fit_cost(entity_list):
+    """Return the (sigma weighted) least squares cost of a list's fit"""
+    y_vector = np.asarray(entity_list.get_truncated_weights_list())
+    x_vector = np.arange(1, len(y_vector) + 1)
+    residuals = (exponential_function(x_vector, *entity_list.fit_parameters)
+                 - y_vector) / np.asarray(entity_list.fit_sigma(x_vector))
+    return 0.5 * residuals.dot(residuals)
+
+
+def synthetic_lists(count, seed):
+    """Make ExponentialEntityLists of varied lengths whose scores decay
+    exponentially (with noise), are constant, are random or increase"""
+    random_state = np.random.RandomState(seed)
+    lists = []
+    for idx in range(count):
+        length = random_state.randint(4, 300)
+        positions = np.arange(length)
+        shape = idx % 4
+        if shape == 0:
+            scores = random_state.uniform(1, 20) * np.exp(
+                -random_state.uniform(0.001, 0.5) * positions) + \
+                random_state.uniform(0, 1, length)
+        elif shape == 1:
+            scores = np.full(length, random_state.uniform(0.5, 5))
+        elif shape == 2:
+            scores = random_state.uniform(0, 10, length)
+        else:
+            scores = np.sort(random_state.uniform(0, 10, length))
+        lists.append(build_list("L{}".format(idx), list(scores)))
+    return lists
+
+
+def curve_fit_list(entity_list, max_evaluations=None):
+    """Fit a list's curve by itself with curve_fit from the usual starting
+    values. Return the fitted parameters and function evaluations used, or
+    None if the fit failed"""
+    y_vector = entity_list.get_truncated_weights_list()
+    x_vector = np.arange(1, len(y_vector) + 1)
+    kwargs = {} if max_evaluations is None else {'max_nfev': max_evaluations}
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', OptimizeWarning)
+            parameters, _, info, _, _ = curve_fit(
+                exponential_function, x_vector, y_vector,
+                p0=entity_list.cold_fit_parameters(),
+                sigma=entity_list.fit_sigma(x_vector),
+                bounds=EXPONENTIAL_FIT_BOUNDS, full_output=True, **kwargs)
+    except RuntimeError:
+        return None
+    return parameters, info['nfev']
+
+
+class TestBatchExponentialFitter(TestCase):
+
+    def assert_solve_matches_curve_fit(self, lists, max_evaluations=None):
+        """Solve the lists together and check that each one converges (or
+        fails) just as curve_fit does by itself and, when it converges,
+        ends at the same curve using (all but) the same evaluations"""
+        test_object = BatchExponentialFitter(max_evaluations=max_evaluations)
+        y_vectors = [x.get_truncated_weights_list() for x in lists]
+        lengths = np.array([len(x) for x in y_vectors])
+        x_matrix, y_matrix, sigma_matrix = test_object._padded_arrays(
+            lists, y_vectors, lengths)
+        initial = np.array([x.cold_fit_parameters() for x in lists])
+        parameters, converged, evaluations = test_object.solve(
+            x_matrix, y_matrix, sigma_matrix, initial)
+        outcomes = []
+        for idx, entity_list in enumerate(lists):
+            expected = curve_fit_list(entity_list, max_evaluations)
+            self.assertEqual(expected is not None, converged[idx],
+                             entity_list.name)
+            outcomes.append(converged[idx])
+            if expected is None:
+                continue
+            x_vector = np.arange(1, lengths[idx] + 1)
+            np.testing.assert_allclose(
+                exponential_function(x_vector, *expected[0]),
+                exponential_function(x_vector, *parameters[idx]),
+                rtol=1e-6, atol=1e-6, err_msg=entity_list.name)
+            self.assertLessEqual(abs(expected[1] - evaluations[idx]), 1,
+                                 entity_list.name)
+        return outcomes
+
+    def test_solve_matches_curve_fit_on_synthetic_lists(self):
+        """Check that the batched solve agrees with curve_fit list by list
+        on lists of varied lengths and shapes"""
+        outcomes = self.assert_solve_matches_curve_fit(synthetic_lists(40, 3))
+        self.assertTrue(all(outcomes))
+
+    def test_solve_matches_curve_fit_at_the_evaluation_limit(self):
+        """Check that, with a low evaluation limit, the same lists fail to
+        converge with the batched solve as with curve_fit, and that those
+        which do converge agree"""
+        outcomes = self.assert_solve_matches_curve_fit(
+            synthetic_lists(40, 3), max_evaluations=20)
+        self.assertTrue(any(outcomes))
+        self.assertFalse(all(outcomes))
+
+    def test_can_fit_only_exponential_lists(self):
+        """Check that the fitter only claims non-empty ExponentialEntityLists"""
+        test_object = BatchExponentialFitter()
+        self.assertTrue(test_object.can_fit(build_list("A", [1.0, 2.0])))
+        self.assertFalse(test_object.can_fit(ExponentialEntityList()))
+        self.assertFalse(test_object.can_fit(EntityList()))
+
+    def test_solve_recovers_known_parameters(self):
+        """Check that noise-free data generated from the exponential
+        function is fitted exactly, for rows of different lengths at once"""
+        test_object = BatchExponentialFitter()
+        known = np.array([[2.0, 0.1, 0.001, 1.5],
+                          [0.5, 0.3, 0.01, 3.0]])
+        lengths = [60, 25]
+        x_matrix = np.zeros((2, 60))
+        y_matrix = np.zeros((2, 60))
+        sigma_matrix = np.full((2, 60), np.inf)
+        for idx, length in enumerate(lengths):
+            x_vector = np.arange(1, length + 1)
+            x_matrix[idx, :length] = x_vector
+            y_matrix[idx, :length] = exponential_function(x_vector,
+                                                          *known[idx])
+            sigma_matrix[idx, :length] = 1.0
+        initial = np.array([[3, 0.01, 0.0001, 1.0], [3, 0.01, 0.0001, 1.0]])
+        parameters, converged, evaluations = test_object.solve(
+            x_matrix, y_matrix, sigma_matrix, initial)
+        self.assertTrue(np.all(converged))
+        self.assertTrue(np.all(evaluations > 0))
+        for idx, length in enumerate(lengths):
+            x_vector = np.arange(1, length + 1)
+            np.testing.assert_allclose(
+                exponential_function(x_vector, *known[idx]),
+                exponential_function(x_vector, *parameters[idx]),
+                rtol=1e-6)
+
+    def test_fit_stores_results_in_lists(self):
+        """Check that fitted parameters, weights and ratios are stored in
+        each list and that they describe the fitted curve"""
+        lists = [build_list("A", [10.6, 8.2, 10.7, 7.1, 4.2, 2.0, 3.3, 2.1]),
+                 build_list("B", [5.0, 4.0, 3.5, 1.0, 1.0])]
+        BatchExponentialFitter().fit(lists)
+        for entity_list in lists:
+            self.assertEqual(len(entity_list), len(entity_list.weights_list))
+            a, b, c, d = entity_list.fit_parameters
+            self.assertGreaterEqual(c, 0.00000001)
+            expected = [a * np.exp(-b * x) - c * x + d
+                        for x in range(1, len(entity_list) + 1)]
+            self.assertEqual(expected, list(entity_list.weights_list))
+            self.assertAlmostEqual(
+                np.average(expected) / entity_list.weight,
+                entity_list.ratio, 12)
+
+    def test_non_convergence_falls_back_to_curve_fit(self):
+        """Check that a list whose batched fit does not converge is fitted
+        by itself with curve_fit instead"""
+        entity_list = build_list("A", [10.6, 8.2, 10.7, 7.1, 4.2, 2.0])
+        expected = build_list("A", [10.6, 8.2, 10.7, 7.1, 4.2, 2.0])
+        expected.refit()
+        with patch("entitylist.curve_fit", wraps=curve_fit) as mock_fit:
+            BatchExponentialFitter(max_evaluations=2).fit([entity_list])
+        self.assertEqual(1, mock_fit.call_count)
+        self.assertTrue(entity_list.fit_succeeded)
+        np.testing.assert_array_equal(expected.fit_parameters,
+                                      entity_list.fit_parameters)
+        self.assertEqual(expected.weights_list, entity_list.weights_list)
+
+    def test_matches_curve_fit_on_example_data(self):
+        """Check that, on the bundled example data, each list's batched fit
+        ends where its curve_fit fit does, and that an analysis using the
+        batched fits gives the same scores as one using curve_fit"""
+        lines = list(FileReader.iter_lines(EXAMPLE_FILE))
+        expected = build_cross_validation(
+            lines, EntityListBuilder('exponential'), 0.01, 100)
+        expected.run()
+        ranked_lists = [x for x in expected.entity_lists
+                        if BatchExponentialFitter.can_fit(x)]
+        self.assertTrue(ranked_lists)
+        fitted = {}
+        for entity_list in ranked_lists:
+            entity_list.refit()
+            fitted[entity_list] = (fit_cost(entity_list),
+                                   np.array(entity_list.weights_list))
+        BatchExponentialFitter().fit(ranked_lists, force=True)
+        for entity_list in ranked_lists:
+            cost, weights = fitted[entity_list]
+            self.assertTrue(entity_list.fit_succeeded)
+            self.assertLessEqual(fit_cost(entity_list), cost * (1 + 1e-6))
+            np.testing.assert_allclose(weights, entity_list.weights_list,
+                                       rtol=1e-4)
+
+        tested_object = build_cross_validation(
+            lines, EntityListBuilder('exponential'), 0.01, 100)
+        tested_object.curve_fitter = BatchExponentialFitter()
+        tested_object.run()
+        self.assertEqual(expected.iteration, tested_object.iteration)
+        for exp_ent, act_ent in zip(expected.entities,
+                                    tested_object.entities):
+            self.assertAlmostEqual(exp_ent.score, act_ent.score, places=4)
+
+    def test_unchanged_lists_are_skipped_unless_forced(self):
+        """Check that lists whose scores have not changed by the refit
+        tolerance are skipped, and that refit_skipped() fits them"""
+        entity_list = build_list("A", [10.6, 8.2, 10.7, 7.1, 4.2, 2.0])
+        entity_list.refit_tolerance = 0.5
+        test_object = BatchExponentialFitter()
+        test_object.fit([entity_list])
+        self.assertFalse(entity_list.fit_skipped)
+        fitted = entity_list.fit_parameters
+
+        entity_list.calculate_new_weight(fit_curve=False)
+        test_object.fit([entity_list])
+        self.assertTrue(entity_list.fit_skipped)
+        self.assertIs(fitted, entity_list.fit_parameters)
+
+        test_object.refit_skipped([entity_list])
+        self.assertFalse(entity_list.fit_skipped)
+        self.assertIsNot(fitted, entity_list.fit_parameters)
+
+    def test_warm_fit_replaced_when_cold_fit_differs(self):
+        """Check that a warm-started batched fit is only kept when the fit
+        from the fixed starting values reaches the same minimum"""
+        lists = [build_list("A", [10.6, 8.2, 10.7, 7.1, 4.2, 2.0, 3.3, 2.1]),
+                 build_list("B", [5.0, 4.0, 3.5, 1.0, 1.0])]
+        BatchExponentialFitter().fit(lists)
+        cold = np.array([x.fit_parameters for x in lists])
+        for entity_list in lists:
+            entity_list.warm_start = True
+        # list A's warm fit reaches the cold fit's minimum, list B's doesn't
+        warm = cold.copy()
+        warm[1] = [1.0, 0.2, 0.003, 2.0]
+        test_object = BatchExponentialFitter()
+        with patch.object(test_object, 'solve', side_effect=[
+                (warm, np.array([True, True]), np.array([5, 5])),
+                (cold.copy(), np.array([True, True]), np.array([20, 20]))]):
+            test_object.fit(lists, force=True)
+        self.assertTrue(lists[0].fit_was_warm_started)
+        self.assertFalse(lists[1].fit_was_warm_started)
+        self.assertEqual([25, 25], [x.fit_evaluations for x in lists])
+        np.testing.assert_array_equal(cold, [x.fit_parameters for x in lists])
+
+    def test_warm_start_matches_cold_start_on_example_data(self):
+        """Check that warm starting the batched fits leaves the final scores
+        of an analysis of the bundled example data (all but) unchanged"""
+        lines = list(FileReader.iter_lines(EXAMPLE_FILE))
+        scores = []
+        for warm_start in [False, True]:
+            cross_validation = build_cross_validation(
+                lines, EntityListBuilder('exponential',
+                                         warm_start=warm_start), 0.01, 100)
+            cross_validation.curve_fitter = BatchExponentialFitter()
+            cross_validation.run()
+            scores.append(dict((x.name, x.score)
+                               for x in cross_validation.entities))
+        self.assertEqual(set(scores[0]), set(scores[1]))
+        for name, score in scores[0].items():
+            self.assertAlmostEqual(score, scores[1][name], delta=1e-4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+import json
+from unittest import TestCase, main
+
+from benchmark import Benchmark, BENCHMARK_COLUMNS, format_results
+from synthetic_data import SyntheticDataGenerator
+
+
+class TestBenchmark(TestCase):
+
+    def test_every_stage_is_timed(self):
+        """Check that a small benchmark run reports every stage of the
+        pipeline, with one result per iteration and per curve fit model"""
+        generator = SyntheticDataGenerator(
+            categories=2, ranked_lists=2, unranked_lists=2, min_length=10,
+            max_length=30, signal_entities=20, noise_entities=100)
+        test_object = Benchmark(generator,
+                                curve_fit_models=['exponential', 'knn'])
+        results = test_object.run()
+        stages = [x['stage'] for x in results]
+        for stage in ['read', 'build', 'iteration', 'finish', 'curve_fit',
+                      'final_scores', 'dump']:
+            self.assertIn(stage, stages)
+        iterations = [x['iteration'] for x in results
+                      if x['stage'] == 'iteration']
+        self.assertEqual(list(range(1, len(iterations) + 1)), iterations)
+        self.assertEqual(['exponential', 'knn'],
+                         [x['model'] for x in results
+                          if x['stage'] == 'curve_fit'])
+        for result in results:
+            self.assertGreaterEqual(result['seconds'], 0)
+        self.assertEqual(4, [x['items'] for x in results
+                             if x['stage'] == 'read'][0])
+
+    def test_results_are_machine_readable(self):
+        """Check the JSON and tab-separated forms of the results"""
+        results = [dict(stage='read', model='', iteration='', items=3,
+                        seconds=0.5)]
+        document = json.loads(format_results(results, 'json',
+                                             parameters=dict(seed=1)))
+        self.assertEqual(results, document['results'])
+        self.assertEqual(dict(seed=1), document['parameters'])
+        lines = format_results(results, 'tsv').splitlines()
+        self.assertEqual(['\t'.join(BENCHMARK_COLUMNS), 'read\t\t\t3\t0.5'],
+                         lines)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import numpy as np
+from mock import Mock
+
+from analysis_fixtures import build_analysis
+from convergence import ConvergenceMonitor, STOP_ABSOLUTE, STOP_RANKS, \
+    STOP_RELATIVE
+
+
+def final_scores(cross_validation):
+    return np.array([x.score for x in cross_validation.entities])
+
+
+class TestConvergenceMonitor(TestCase):
+
+    def test_default_stops_as_threshold_does(self):
+        """Check that, with no other criteria, the monitor stops the
+        analysis at the same iteration and scores as the threshold"""
+        expected = build_analysis('exponential')
+        expected.run_analysis()
+        cross_validation = build_analysis('exponential')
+        test_object = ConvergenceMonitor()
+        cross_validation.convergence = test_object
+        cross_validation.run_analysis()
+        self.assertEqual(STOP_ABSOLUTE, test_object.stop_reason)
+        self.assertEqual(expected.iteration, cross_validation.iteration)
+        self.assertEqual(expected.iteration, test_object.iterations)
+        self.assertEqual(0, test_object.iterations_saved)
+        np.testing.assert_array_equal(final_scores(expected),
+                                      final_scores(cross_validation))
+
+    def test_relative_tolerance_stops_early(self):
+        """Check that a loose relative tolerance stops the analysis before
+        the threshold would"""
+        expected = build_analysis('exponential')
+        expected.run_analysis()
+        cross_validation = build_analysis('exponential')
+        test_object = ConvergenceMonitor(relative_tolerance=0.1)
+        cross_validation.convergence = test_object
+        cross_validation.run_analysis()
+        self.assertEqual(STOP_RELATIVE, test_object.stop_reason)
+        self.assertLess(cross_validation.iteration, expected.iteration)
+        self.assertGreater(test_object.iterations_saved, 0)
+
+    def test_stops_when_top_entities_are_stable(self):
+        """Check that the analysis stops once the order of the top entities
+        has not changed for rank_patience iterations"""
+        test_object = ConvergenceMonitor(top_n=2, rank_patience=2)
+        cross_validation = Mock(threshold=0.1, max_iterations=100,
+                                entity_lists=[])
+        cross_validation.entities = [Mock(score=1.0), Mock(score=3.0),
+                                     Mock(score=2.0)]
+        self.assertFalse(test_object.check(cross_validation, 1, 1.0))
+        cross_validation.entities[0].score = 2.5
+        self.assertFalse(test_object.check(cross_validation, 2, 1.0))
+        self.assertFalse(test_object.check(cross_validation, 3, 1.0))
+        self.assertTrue(test_object.check(cross_validation, 4, 1.0))
+        self.assertEqual(STOP_RANKS, test_object.stop_reason)
+        self.assertEqual([True, True, False, False],
+                         [x['top_n_changed'] for x in test_object.records])
+
+    def test_resume_applies_the_stopping_criteria(self):
+        """Check that an analysis carried on from a saved iteration is
+        judged by the monitor's criteria, without adding a record"""
+        test_object = ConvergenceMonitor(relative_tolerance=0.1, top_n=2,
+                                         rank_patience=1)
+        entity_list = Mock(weight=2.0, delta=0.5)
+        cross_validation = Mock(threshold=0.01, max_iterations=100,
+                                entity_lists=[entity_list])
+        cross_validation.entities = [Mock(score=1.0), Mock(score=3.0)]
+        self.assertFalse(test_object.resume(cross_validation, 5, None))
+        self.assertFalse(test_object.resume(cross_validation, 5, 0.5))
+        entity_list.delta = 0.1
+        self.assertTrue(test_object.resume(cross_validation, 5, 0.1))
+        self.assertEqual(STOP_RELATIVE, test_object.stop_reason)
+        self.assertEqual([], test_object.records)
+        entity_list.delta = 0.5
+        self.assertFalse(test_object.resume(cross_validation, 5, 0.5))
+        self.assertTrue(test_object.check(cross_validation, 6, 0.5))
+        self.assertEqual(STOP_RANKS, test_object.stop_reason)
+
+    def test_aitken_extrapolates_geometric_sequence(self):
+        """Check that Aitken extrapolation of a list weight converging
+        geometrically jumps straight to its limit"""
+        test_object = ConvergenceMonitor(aitken=True)
+        entity_list = Mock(uses_fitted_weights=False, weight=0.0, delta=0.0)
+        cross_validation = Mock(threshold=1e-6, max_iterations=100,
+                                entity_lists=[entity_list], entities=[])
+        for iteration, weight in enumerate([3.0, 2.5, 2.25], 1):
+            entity_list.weight = weight
+            test_object.check(cross_validation, iteration, 1.0)
+        self.assertAlmostEqual(2.0, entity_list.weight)
+        self.assertEqual([0, 0, 1], [x['extrapolated']
+                                     for x in test_object.records])
+
+    def test_aitken_converges_in_fewer_iterations(self):
+        """Check that Aitken extrapolation needs fewer iterations and gives
+        final scores within the threshold of the unaccelerated ones"""
+        expected = build_analysis('exponential')
+        expected.run()
+        cross_validation = build_analysis('exponential')
+        cross_validation.convergence = ConvergenceMonitor(aitken=True)
+        cross_validation.run()
+        self.assertLessEqual(cross_validation.iteration, expected.iteration)
+        np.testing.assert_allclose(final_scores(expected),
+                                   final_scores(cross_validation),
+                                   atol=0.1)
+
+    def test_dump_writes_convergence_file(self):
+        output_folder = tempfile.mkdtemp() + os.sep
+        try:
+            cross_validation = build_analysis('exponential')
+            test_object = ConvergenceMonitor(relative_tolerance=0.1)
+            cross_validation.convergence = test_object
+            cross_validation.run_analysis()
+            test_object.dump(output_folder)
+            with open(output_folder + 'convergence.txt') as in_file:
+                lines = in_file.read().splitlines()
+            self.assertEqual('iteration\tdelta\trelative_delta\t'
+                             'top_n_changed\textrapolated', lines[0])
+            self.assertEqual(test_object.iterations + 2, len(lines))
+            self.assertTrue(lines[-1].startswith('# stopped (relative)'))
+        finally:
+            shutil.rmtree(output_folder)
+
+
+if __name__ == '__main__':
+    main()
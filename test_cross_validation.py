@@ -4,9 +4,14 @@ from unittest import TestCase
 import mock
 from mock import call, Mock
 
-from cross_validation import CrossValidation, POST_ITERATION_CALLBACK
+from cross_validation import CrossValidation, POST_ITERATION_CALLBACK, \
+    POST_STEP_CALLBACK, PRE_PHASE_CALLBACK, POST_PHASE_CALLBACK, \
+    SCORING_PHASE, WEIGHTING_PHASE, FITTING_PHASE, DUMPING_PHASE, \
+    FINAL_SCORES_PHASE, build_cross_validation
 from entity import Entity
 from entitylist import EntityList
+from entitylist_builder import EntityListBuilder
+from vectorized_engine import VectorizedEngine
 
 
 class TestCrossValidation(TestCase):
@@ -47,12 +52,14 @@ class TestCrossValidation(TestCase):
         tested_object.run_analysis()
 
         expected_calls = list(itertools.repeat(call(), __MAX_ITERATIONS))
+        expected_weight_calls = list(itertools.repeat(
+            call(fit_curve=False), __MAX_ITERATIONS))
         ent1.calculate_new_score.assert_has_calls(expected_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          ent1.calculate_new_score.call_count)
         ent2.calculate_new_score.assert_has_calls(expected_calls)
-        entity_list1.calculate_new_weight.assert_has_calls(expected_calls)
-        entity_list2.calculate_new_weight.assert_has_calls(expected_calls)
+        entity_list1.calculate_new_weight.assert_has_calls(expected_weight_calls)
+        entity_list2.calculate_new_weight.assert_has_calls(expected_weight_calls)
 
     def test_one_list_never_hits_delta_threshold(self):
         """Check that the scoring continues for __MAX_ITERATIONS when one list
@@ -91,10 +98,12 @@ class TestCrossValidation(TestCase):
         tested_object.run_analysis()
 
         expected_calls = list(itertools.repeat(call(), __MAX_ITERATIONS))
+        expected_weight_calls = list(itertools.repeat(
+            call(fit_curve=False), __MAX_ITERATIONS))
         ent1.calculate_new_score.assert_has_calls(expected_calls)
         ent2.calculate_new_score.assert_has_calls(expected_calls)
-        entity_list1.calculate_new_weight.assert_has_calls(expected_calls)
-        entity_list2.calculate_new_weight.assert_has_calls(expected_calls)
+        entity_list1.calculate_new_weight.assert_has_calls(expected_weight_calls)
+        entity_list2.calculate_new_weight.assert_has_calls(expected_weight_calls)
 
     def test_lists_fall_below_delta_threshold(self):
         """Check that the scoring stops as soon as all lists drop below the
@@ -146,16 +155,18 @@ class TestCrossValidation(TestCase):
         tested_object.run_analysis()
 
         expected_calls = list(itertools.repeat(call(), __EXPECTED_ITERATIONS))
+        expected_weight_calls = list(itertools.repeat(
+            call(fit_curve=False), __EXPECTED_ITERATIONS))
         ent1.calculate_new_score.assert_has_calls(expected_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          ent1.calculate_new_score.call_count)
         ent2.calculate_new_score.assert_has_calls(expected_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          ent2.calculate_new_score.call_count)
-        entity_list1.calculate_new_weight.assert_has_calls(expected_calls)
+        entity_list1.calculate_new_weight.assert_has_calls(expected_weight_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          entity_list1.calculate_new_weight.call_count)
-        entity_list2.calculate_new_weight.assert_has_calls(expected_calls)
+        entity_list2.calculate_new_weight.assert_has_calls(expected_weight_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          entity_list2.calculate_new_weight.call_count)
 
@@ -213,16 +224,18 @@ class TestCrossValidation(TestCase):
         tested_object.run_analysis()
 
         expected_calls = list(itertools.repeat(call(), __EXPECTED_ITERATIONS))
+        expected_weight_calls = list(itertools.repeat(
+            call(fit_curve=False), __EXPECTED_ITERATIONS))
         ent1.calculate_new_score.assert_has_calls(expected_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          ent1.calculate_new_score.call_count)
         ent2.calculate_new_score.assert_has_calls(expected_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          ent2.calculate_new_score.call_count)
-        entity_list1.calculate_new_weight.assert_has_calls(expected_calls)
+        entity_list1.calculate_new_weight.assert_has_calls(expected_weight_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          entity_list1.calculate_new_weight.call_count)
-        entity_list2.calculate_new_weight.assert_has_calls(expected_calls)
+        entity_list2.calculate_new_weight.assert_has_calls(expected_weight_calls)
         self.assertEqual(__EXPECTED_ITERATIONS,
                          entity_list2.calculate_new_weight.call_count)
 
@@ -287,8 +300,9 @@ class TestCrossValidation(TestCase):
         contain expected keys and that the list of callbacks for each type is
         empty by default"""
 
-        expected_type_count = 1
-        expected_types = [POST_ITERATION_CALLBACK]
+        expected_type_count = 4
+        expected_types = [POST_ITERATION_CALLBACK, POST_STEP_CALLBACK,
+                          PRE_PHASE_CALLBACK, POST_PHASE_CALLBACK]
 
         test_object = CrossValidation(['fake'], ['fake'], 1, 1)
         self.assertEqual(expected_type_count, len(test_object.callbacks))
@@ -310,3 +324,185 @@ class TestCrossValidation(TestCase):
         post_iteration_callbacks = test_object.callbacks[POST_ITERATION_CALLBACK]
         self.assertTrue(post_iteration_callbacks)
         self.assertTrue(fake_callback_object in post_iteration_callbacks)
+
+    def test_curve_fitter_fits_deferred_lists(self):
+        """Check that lists claimed by a curve fitter are asked to calculate
+        their weight without fitting and then fitted together, while the
+        other lists fit their own curves"""
+        ent1 = mock.create_autospec(Entity)
+        entity_list1 = mock.create_autospec(EntityList)
+        entity_list1.calculate_new_weight = Mock(return_value=0.0)
+        entity_list2 = mock.create_autospec(EntityList)
+        entity_list2.calculate_new_weight = Mock(return_value=0.0)
+
+        curve_fitter = mock.MagicMock()
+        curve_fitter.can_fit.side_effect = lambda x: x == entity_list2
+
+        tested_object = CrossValidation([ent1], [entity_list1, entity_list2],
+                                        0.1, 1)
+        tested_object.curve_fitter = curve_fitter
+        tested_object.run_analysis()
+
+        entity_list1.calculate_new_weight.assert_called_once_with(
+            fit_curve=False)
+        entity_list2.calculate_new_weight.assert_called_once_with(
+            fit_curve=False)
+        entity_list1.update_fit.assert_called_once_with()
+        entity_list2.update_fit.assert_not_called()
+        curve_fitter.fit.assert_called_once_with([entity_list2])
+
+    def test_skipped_fits_are_refitted_after_final_iteration(self):
+        """Check that every list is asked to make sure its fit is up to date
+        once the iterations are complete, with lists handled by a curve
+        fitter being passed to it together"""
+        ent1 = mock.create_autospec(Entity)
+        entity_list1 = mock.create_autospec(EntityList)
+        entity_list1.calculate_new_weight = Mock(return_value=0.0)
+        entity_list2 = mock.create_autospec(EntityList)
+        entity_list2.calculate_new_weight = Mock(return_value=0.0)
+
+        curve_fitter = mock.MagicMock()
+        curve_fitter.can_fit.side_effect = lambda x: x == entity_list2
+
+        tested_object = CrossValidation([ent1], [entity_list1, entity_list2],
+                                        0.1, 1)
+        tested_object.curve_fitter = curve_fitter
+        tested_object.run_analysis()
+
+        entity_list1.ensure_fitted.assert_called_once_with()
+        entity_list2.ensure_fitted.assert_not_called()
+        curve_fitter.refit_skipped.assert_called_once_with([entity_list2])
+
+    def test_phase_callbacks_wrap_each_phase(self):
+        """Check that the pre- and post-phase callbacks are told about each
+        phase of each iteration, in order"""
+        ent1 = mock.create_autospec(Entity)
+        entity_list1 = mock.create_autospec(EntityList)
+        entity_list1.calculate_new_weight = Mock(side_effect=[1.0, 0.0])
+
+        tested_object = CrossValidation([ent1], [entity_list1], 0.1, 5)
+        pre_phase = mock.MagicMock()
+        post_phase = mock.MagicMock()
+        tested_object.register_callback(PRE_PHASE_CALLBACK, pre_phase)
+        tested_object.register_callback(POST_PHASE_CALLBACK, post_phase)
+        tested_object.run()
+
+        expected_calls = []
+        for iteration in [1, 2]:
+            for phase in [SCORING_PHASE, WEIGHTING_PHASE, FITTING_PHASE,
+                          DUMPING_PHASE]:
+                expected_calls.append(call(tested_object,
+                                           (phase, iteration)))
+        expected_calls.append(call(tested_object, (FITTING_PHASE, 2)))
+        expected_calls.append(call(tested_object, (FINAL_SCORES_PHASE, 2)))
+        self.assertEqual(expected_calls, pre_phase.do_callback.call_args_list)
+        self.assertEqual(expected_calls,
+                         post_phase.do_callback.call_args_list)
+
+    def test_run_flushes_background_writer(self):
+        """Check that the per-iteration output being written in the
+        background is flushed once the final scores have been calculated"""
+        ent1 = mock.create_autospec(Entity)
+        entity_list1 = mock.create_autospec(EntityList)
+        entity_list1.calculate_new_weight = Mock(side_effect=[0.0])
+
+        tested_object = CrossValidation([ent1], [entity_list1], 0.1, 5)
+        manager = Mock()
+        tested_object.background_writer = manager.background_writer
+        ent1.calculate_final_corrected_scores = \
+            manager.calculate_final_corrected_scores
+        tested_object.run()
+        self.assertEqual([call.calculate_final_corrected_scores(methods=None),
+                          call.background_writer.flush()],
+                         manager.mock_calls)
+
+    def test_run_analysis_asks_convergence_monitor(self):
+        """Check that a convergence monitor, if set, decides when the
+        analysis stops rather than the threshold"""
+        ent1 = mock.create_autospec(Entity)
+        entity_list1 = mock.create_autospec(EntityList)
+        entity_list1.calculate_new_weight = Mock(return_value=0.0)
+
+        tested_object = CrossValidation([ent1], [entity_list1], 0.1, 10)
+        tested_object.convergence = Mock()
+        tested_object.convergence.check = Mock(
+            side_effect=[False, False, True])
+        tested_object.run_analysis()
+        self.assertEqual([call(tested_object, 1, 0.0),
+                          call(tested_object, 2, 0.0),
+                          call(tested_object, 3, 0.0)],
+                         tested_object.convergence.check.call_args_list)
+
+    def test_run_analysis_steps_solver_until_converged(self):
+        """Check that a solver, if set, is asked to choose the next state
+        after every iteration except the one that converged"""
+        ent1 = mock.create_autospec(Entity)
+        entity_list1 = mock.create_autospec(EntityList)
+        entity_list1.calculate_new_weight = Mock(side_effect=[1.0, 1.0, 0.0])
+
+        tested_object = CrossValidation([ent1], [entity_list1], 0.1, 10)
+        tested_object.solver = Mock()
+        tested_object.run_analysis()
+        self.assertEqual([call(tested_object, 1), call(tested_object, 2)],
+                         tested_object.solver.step.call_args_list)
+
+    def test_add_and_remove_lists_then_resume(self):
+        """Check that lists can be added to and removed from a converged
+        analysis, bringing its Entities up to date, and that resuming from
+        the old fixed point needs fewer iterations than starting again"""
+        lines = [
+            "CAT1\tList1\tUNRANKED\tX\tA\tB\tC",
+            "CAT2\tList2\tUNRANKED\tX\tA\tB\tD",
+            "CAT3\tList3\tUNRANKED\tX\tA\tE",
+        ]
+        builder = EntityListBuilder('none')
+        tested_object = build_cross_validation(lines[:2], builder, 0.0001,
+                                               100)
+        tested_object.run()
+        new_list = builder.build_list_from_string(lines[2])
+        tested_object.add_list(new_list)
+        self.assertEqual(0, tested_object.iteration)
+        self.assertEqual(['A', 'B', 'C', 'D', 'E'],
+                         sorted(x.name for x in tested_object.entities))
+        tested_object.run(resume=True)
+        expected = build_cross_validation(lines, EntityListBuilder('none'),
+                                          0.0001, 100)
+        expected.run()
+        self.assertLess(tested_object.iteration, expected.iteration)
+        for exp_ent, act_ent in zip(
+                sorted(expected.entities, key=lambda x: x.name),
+                sorted(tested_object.entities, key=lambda x: x.name)):
+            self.assertAlmostEqual(exp_ent.score, act_ent.score, places=3)
+        tested_object.remove_list(new_list)
+        self.assertEqual(['A', 'B', 'C', 'D'],
+                         sorted(x.name for x in tested_object.entities))
+        self.assertEqual([], [x.name for x in new_list
+                              if new_list in x.lists])
+
+    def test_replace_list_with_fake_entities_then_run_either_engine(self):
+        """Check that replacing a list with one of fake Entities keeps the
+        real Entities (even those left on no list) and that both engines
+        then run the analysis to the same result"""
+        lines = [
+            "CAT1\tList1\tRANKED\tX\tA\tB\tC\tD",
+            "CAT2\tList2\tUNRANKED\tX\tA\tB\tD",
+            "CAT3\tList3\tRANKED\tX\tA\tE\tC",
+        ]
+        results = []
+        for engine in [None, VectorizedEngine()]:
+            tested_object = build_cross_validation(
+                lines, EntityListBuilder('exponential'), 0.01, 100)
+            tested_object.engine = engine
+            old_list = tested_object.entity_lists[2]
+            replacement = old_list.blank_copy()
+            for n in range(10, 13):
+                replacement.append(tested_object.get_or_create_entity(n))
+            tested_object.replace_list(old_list, replacement)
+            tested_object.run()
+            self.assertEqual(['A', 'B', 'C', 'D', 'E'],
+                             sorted(x.name for x in tested_object.entities))
+            self.assertEqual(3, len(tested_object._fake_entities))
+            results.append(dict((x.name, x.score)
+                                for x in tested_object.entities))
+        for name, score in results[0].items():
+            self.assertAlmostEqual(score, results[1][name])
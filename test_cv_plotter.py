@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import numpy as np
+
+from analysis_fixtures import build_analysis
+import cv_plotter
+from cv_plotter import CrossValidationPlotter, ListFigure
+
+
+class TestCrossValidationPlotter(TestCase):
+
+    def setUp(self):
+        self.directory_path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory_path)
+
+    def plotted_files(self):
+        return sorted(os.listdir(self.directory_path))
+
+    def test_one_plot_per_list_per_iteration(self):
+        """Check that a plot is saved for every list at every iteration,
+        all drawn on the same Figure"""
+        cross_validation = build_analysis('exponential')
+        cross_validation.max_iterations = 2
+        cross_validation.plotter = CrossValidationPlotter(self.directory_path)
+        cross_validation.run()
+        figure = cv_plotter._list_figure
+        cross_validation.plotter.plot_cross_validation(cross_validation, 3)
+        self.assertIs(figure, cv_plotter._list_figure)
+        expected = sorted("{}-{:03d}.png".format(x.name, iteration)
+                          for x in cross_validation.entity_lists
+                          for iteration in [1, 2, 3])
+        self.assertEqual(expected, self.plotted_files())
+
+    def test_panels_make_one_image_per_iteration(self):
+        """Check that the panels option saves a single image per iteration
+        with a panel for each list"""
+        cross_validation = build_analysis('exponential')
+        cross_validation.max_iterations = 2
+        test_object = CrossValidationPlotter(self.directory_path, panels=True)
+        cross_validation.plotter = test_object
+        cross_validation.run()
+        self.assertEqual(['iteration-001.png', 'iteration-002.png'],
+                         self.plotted_files())
+        panels = [x for x in test_object._panel_figure.panels
+                  if x.axes.get_visible()]
+        self.assertEqual(len(cross_validation.entity_lists), len(panels))
+        self.assertEqual(sorted(x.name for x in cross_validation.entity_lists),
+                         sorted(x.axes.get_title() for x in panels))
+
+    def test_workers_draw_the_same_plots(self):
+        """Check that drawing the plots in worker processes saves the same
+        files as drawing them in this one"""
+        cross_validation = build_analysis('exponential')
+        cross_validation.max_iterations = 1
+        test_object = CrossValidationPlotter(self.directory_path, workers=2)
+        cross_validation.plotter = test_object
+        try:
+            cross_validation.run()
+        finally:
+            test_object.close()
+        self.assertEqual(sorted("{}-001.png".format(x.name)
+                                for x in cross_validation.entity_lists),
+                         self.plotted_files())
+
+    def test_fitted_weights_hidden_unless_one_per_slot(self):
+        """Check that a reused ListAxes only shows the fitted weights and
+        list weight when there is a fitted weight for every slot"""
+        figure = ListFigure()
+        list_axes = figure.list_axes
+        list_axes.draw('ranked', np.ones(5), np.ones(5), 0.5)
+        self.assertTrue(list_axes.fitted_line.get_visible())
+        self.assertEqual([0.5] * 5, list(list_axes.weight_line.get_ydata()))
+        list_axes.draw('unranked', np.ones(3), np.ones(1), 1.0)
+        self.assertFalse(list_axes.fitted_line.get_visible())
+        self.assertFalse(list_axes.weight_line.get_visible())
+        self.assertEqual(3, len(list_axes.truncated_line.get_xdata()))
+        self.assertEqual(['Truncated list weight'],
+                         [x.get_text() for x in
+                          list_axes.axes.get_legend().get_texts()])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+from analysis_fixtures import build_analysis
+from dirty_set import DirtySetTracker
+
+
+class TestDirtySetTracker(TestCase):
+
+    def test_zero_epsilon_matches_full_iteration(self):
+        """Check that with an epsilon of zero the analysis gives exactly the
+        scores and weights of recalculating everything"""
+        expected = build_analysis('exponential')
+        expected.run()
+        cross_validation = build_analysis('exponential')
+        test_object = DirtySetTracker(0.0)
+        cross_validation.dirty_set = test_object
+        cross_validation.run()
+        self.assertEqual(expected.iteration, cross_validation.iteration)
+        self.assertEqual([x.score for x in expected.entities],
+                         [x.score for x in cross_validation.entities])
+        self.assertEqual([x.weights_list for x in expected.entity_lists],
+                         [x.weights_list for x in
+                          cross_validation.entity_lists])
+        self.assertEqual(cross_validation.iteration,
+                         len(test_object.iterations))
+
+    def test_unchanged_lists_are_skipped(self):
+        """Check that only the members of a list whose weight has changed
+        are scored and only the lists they are on are weighted"""
+        cross_validation = build_analysis('exponential')
+        test_object = DirtySetTracker(0.0)
+        cross_validation.dirty_set = test_object
+        cross_validation.max_iterations = 2
+        cross_validation.run_analysis()
+        # the weights from the last iteration haven't been scored yet
+        self.assertEqual(len(cross_validation.entities), len(
+            test_object.entities_to_score(cross_validation)))
+        self.assertEqual([], test_object.entities_to_score(cross_validation))
+        self.assertEqual([], test_object.lists_to_weight(cross_validation,
+                                                         []))
+        self.assertEqual([0.0] * len(cross_validation.entity_lists),
+                         [x.delta for x in cross_validation.entity_lists])
+        unranked = [x for x in cross_validation.entity_lists
+                    if not x.uses_fitted_weights]
+        entity_list = [x for x in unranked if x.name == 'List4'][0]
+        entity_list.weight += 1.0
+        members = test_object.entities_to_score(cross_validation)
+        self.assertEqual(['A', 'P'], sorted(x.name for x in members))
+        entity_p = [x for x in members if x.name == 'P']
+        lists = test_object.lists_to_weight(cross_validation, entity_p)
+        self.assertEqual(['List4'], [x.name for x in lists])
+        counters = test_object.iterations[-1]
+        self.assertEqual((2, 1), (counters['entities_scored'],
+                                  counters['lists_weighted']))
+        self.assertEqual(len(cross_validation.entities) - 2,
+                         counters['entities_skipped'])
+
+    def test_dump_writes_counters(self):
+        output_folder = tempfile.mkdtemp() + os.sep
+        try:
+            cross_validation = build_analysis('exponential')
+            test_object = DirtySetTracker(0.0)
+            cross_validation.dirty_set = test_object
+            cross_validation.run_analysis()
+            test_object.dump(output_folder)
+            with open(output_folder + 'dirty_set.txt') as in_file:
+                lines = in_file.read().splitlines()
+            self.assertEqual('iteration\tentities_scored\tentities_skipped\t'
+                             'lists_weighted\tlists_skipped', lines[0])
+            self.assertEqual(cross_validation.iteration + 1, len(lines))
+        finally:
+            shutil.rmtree(output_folder)
+
+
+if __name__ == '__main__':
+    main()
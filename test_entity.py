@@ -4,7 +4,7 @@ from unittest import TestCase, skip
 # noinspection PyProtectedMember
 from mock import Mock, MagicMock, patch, call
 
-from entity import Entity
+from entity import CompactEntity, Entity
 from entitylist import EntityList
 from constants import T_METHOD_NONE
 
@@ -24,6 +24,22 @@ class TestEntity(TestCase):
         self.assertEqual(set_score, test_object.score,
                          "Entity score should be 99.3")
 
+    def test_score_change_is_reported_to_lists(self):
+        """Check that changing an Entity's score tells each of its lists,
+        and that setting the same score again does not"""
+        test_object = Entity("A")
+        list1 = Mock()
+        list2 = Mock()
+        test_object.note_list(list1)
+        test_object.note_list(list2)
+        test_object.score = 2.5
+        list1.scores_changed.assert_called_once_with()
+        list2.scores_changed.assert_called_once_with()
+        test_object.score = 2.5
+        self.assertEqual(1, list1.scores_changed.call_count)
+        test_object.set_calculated_score(3.0, {}, {})
+        self.assertEqual(2, list2.scores_changed.call_count)
+
     def test_entity_has_transformed_score_one(self):
         """Check that an Entity has a default transformed score of 0."""
         test_object = Entity("A")
@@ -340,3 +356,33 @@ class TestEntity(TestCase):
         test_object = Entity("ZZ")
         self.assertEqual(expected_sum,
                          test_object.sum_max_weights_per_category(weights))
+
+    def test_compact_entity_has_no_instance_dict(self):
+        """Check that a CompactEntity only accepts its own attributes"""
+        test_object = CompactEntity("A")
+        self.assertFalse(hasattr(test_object, '__dict__'))
+        with self.assertRaises(AttributeError):
+            test_object.colour = "red"
+
+    def test_compact_entity_scores_like_entity(self):
+        """Check that a CompactEntity scores, forgets lists and resets in
+        the same way as an Entity"""
+        list1 = EntityList()
+        list1.category_name = "Cat1"
+        list2 = EntityList()
+        list2.category_name = "Cat2"
+        list2.weight = 3.5
+        entities = [Entity("A"), CompactEntity("A")]
+        for entity in entities:
+            list1.append(entity)
+            list2.append(entity)
+            entity.calculate_new_score()
+            self.assertEqual(4.5, entity.score)
+            self.assertEqual(3.5, entity.raw_score_from_list(list2))
+            self.assertEqual(3.5, entity.score_from_list(list2))
+            entity.forget_list(list1)
+            self.assertEqual([list2], entity.lists)
+            self.assertEqual(3.5, entity.raw_score_from_list(list2))
+            entity.reset()
+            self.assertEqual(1, entity.score)
+            self.assertEqual(0.0, entity.raw_score_from_list(list2))
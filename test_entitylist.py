@@ -1,3 +1,4 @@
+import os
 from math import sqrt
 from random import uniform
 from re import compile
@@ -6,9 +7,15 @@ from unittest import TestCase, skip
 import numpy as np
 from mock import MagicMock, patch
 
+from cross_validation import build_cross_validation
 from entity import Entity
 from entitylist import EntityList, ExponentialEntityList, adjusted_weight, \
-    FAILED_RANKED_LIST_DESCENT_STEP
+    FAILED_RANKED_LIST_DESCENT_STEP, same_fit_cost
+from entitylist_builder import EntityListBuilder
+from file_reader import FileReader
+
+EXAMPLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'example_input_and_result', '3_3_0m.txt')
 
 
 class TestEntityList(TestCase):
@@ -605,3 +612,249 @@ class TestEntityList(TestCase):
         # check that the mocks were called with the expected arguments
         transformer.transform.assert_called_once_with(initial, mean)
         scaler.scale.assert_called_once_with(transformed_score, stdev)
+
+    def test_exponential_list_warm_starts_from_previous_fit(self):
+        """Check that an ExponentialEntityList only starts a fit from its
+        previous parameters when warm starting is enabled and the previous
+        fit succeeded"""
+        test_object = ExponentialEntityList()
+        test_object.weight = 2.5
+        self.assertEqual([3, 0.01, 0.0001, 2.5],
+                         test_object.initial_fit_parameters())
+
+        test_object.fit_parameters = [1.0, 0.2, 0.003, 4.0]
+        test_object.fit_succeeded = True
+        self.assertEqual([3, 0.01, 0.0001, 2.5],
+                         test_object.initial_fit_parameters())
+
+        test_object.warm_start = True
+        self.assertTrue(test_object.can_warm_start())
+        self.assertEqual([1.0, 0.2, 0.003, 4.0],
+                         test_object.initial_fit_parameters())
+
+        test_object.fit_succeeded = False
+        self.assertEqual([3, 0.01, 0.0001, 2.5],
+                         test_object.initial_fit_parameters())
+
+    def test_exponential_list_records_evaluations_saved(self):
+        """Check that the evaluations saved by a warm-started fit are
+        measured against the most recent cold fit"""
+        test_object = ExponentialEntityList()
+        test_object.record_fit_evaluations(40, False)
+        self.assertEqual(40, test_object.fit_evaluations)
+        self.assertEqual(0, test_object.fit_evaluations_saved)
+        test_object.record_fit_evaluations(12, True)
+        self.assertEqual(12, test_object.fit_evaluations)
+        self.assertEqual(28, test_object.fit_evaluations_saved)
+        self.assertTrue(test_object.fit_was_warm_started)
+        test_object.record_fit_evaluations(50, True)
+        self.assertEqual(0, test_object.fit_evaluations_saved)
+        test_object.reset()
+        self.assertIsNone(test_object.cold_fit_evaluations)
+        self.assertEqual(0, test_object.fit_evaluations)
+
+    def test_same_fit_cost(self):
+        """Check that two fit costs are only taken to be the same minimum
+        when they agree to within a tight relative tolerance"""
+        self.assertTrue(same_fit_cost(2.0, 2.0))
+        self.assertTrue(same_fit_cost(2.0, 2.0 * (1 + 1e-9)))
+        self.assertFalse(same_fit_cost(2.0, 2.0 * (1 + 1e-6)))
+        self.assertFalse(same_fit_cost(2.0, 1.9))
+        self.assertTrue(same_fit_cost(0.0, 0.0))
+
+    def _warm_list(self):
+        """Make a warm-started ExponentialEntityList with a previous fit"""
+        test_object = ExponentialEntityList()
+        for idx, score in enumerate([10.6, 8.2, 10.7, 7.1, 4.2, 2.0]):
+            ent = Entity(str(idx))
+            ent.score = score
+            test_object.append(ent)
+        test_object.calculate_new_weight(fit_curve=False)
+        test_object.warm_start = True
+        test_object.fit_parameters = [1.0, 0.2, 0.003, 4.0]
+        test_object.fit_succeeded = True
+        return test_object
+
+    def test_warm_fit_kept_when_cold_fit_reaches_same_minimum(self):
+        """Check that a warm-started fit is kept when the fit from the fixed
+        starting values reaches the same cost"""
+        test_object = self._warm_list()
+        warm = (1.5, 10, np.array([2.0, 0.1, 0.001, 5.0]))
+        cold = (1.5, 30, np.array([2.0, 0.1, 0.001, 5.0000001]))
+        with patch.object(ExponentialEntityList, '_fit_from',
+                          side_effect=[warm, cold]) as mock_fit:
+            test_object._fit_curve_to_entity_scores()
+        self.assertEqual([1.0, 0.2, 0.003, 4.0],
+                         mock_fit.call_args_list[0][0][2])
+        self.assertEqual(test_object.cold_fit_parameters(),
+                         mock_fit.call_args_list[1][0][2])
+        np.testing.assert_array_equal(warm[2], test_object.fit_parameters)
+        self.assertTrue(test_object.fit_was_warm_started)
+        self.assertEqual(40, test_object.fit_evaluations)
+
+    def test_warm_fit_replaced_when_cold_fit_differs(self):
+        """Check that the cold fit is used when the warm-started fit ends in
+        a different minimum, whether its cost is higher or lower, or when
+        the warm-started fit fails"""
+        cold = (1.5, 30, np.array([2.0, 0.1, 0.001, 5.0]))
+        for warm in [(1.6, 10, np.array([1.0, 0.2, 0.003, 4.0])),
+                     (1.4, 10, np.array([1.0, 0.2, 0.003, 4.0])),
+                     RuntimeError("no fit")]:
+            test_object = self._warm_list()
+            with patch.object(ExponentialEntityList, '_fit_from',
+                              side_effect=[warm, cold]):
+                test_object._fit_curve_to_entity_scores()
+            np.testing.assert_array_equal(cold[2],
+                                          test_object.fit_parameters)
+            self.assertTrue(test_object.fit_succeeded)
+            self.assertFalse(test_object.fit_was_warm_started)
+
+    def test_warm_fit_kept_when_cold_fit_fails(self):
+        """Check that a warm-started fit is used when the fit from the fixed
+        starting values fails"""
+        test_object = self._warm_list()
+        warm = (1.5, 10, np.array([2.0, 0.1, 0.001, 5.0]))
+        with patch.object(ExponentialEntityList, '_fit_from',
+                          side_effect=[warm, RuntimeError("no fit")]):
+            test_object._fit_curve_to_entity_scores()
+        np.testing.assert_array_equal(warm[2], test_object.fit_parameters)
+        self.assertTrue(test_object.fit_was_warm_started)
+
+    def test_warm_start_matches_cold_start_on_example_data(self):
+        """Check that warm starting the curve fits leaves the final scores
+        of an analysis of the bundled example data (all but) unchanged"""
+        lines = list(FileReader.iter_lines(EXAMPLE_FILE))
+        scores = []
+        for warm_start in [False, True]:
+            cross_validation = build_cross_validation(
+                lines, EntityListBuilder('exponential',
+                                         warm_start=warm_start), 0.01, 100)
+            cross_validation.run()
+            scores.append(dict((x.name, x.score)
+                               for x in cross_validation.entities))
+        self.assertEqual(set(scores[0]), set(scores[1]))
+        for name, score in scores[0].items():
+            self.assertAlmostEqual(score, scores[1][name], delta=1e-4)
+
+    def test_refit_tolerance_changes_example_scores_by_little(self):
+        """Check that skipping refits with a non-zero refit tolerance moves
+        the final scores of an analysis of the bundled example data by less
+        than a tenth of the tolerance"""
+        lines = list(FileReader.iter_lines(EXAMPLE_FILE))
+        scores = []
+        for refit_tolerance in [0.0, 0.05]:
+            cross_validation = build_cross_validation(
+                lines, EntityListBuilder('exponential',
+                                         refit_tolerance=refit_tolerance),
+                0.01, 100)
+            cross_validation.run()
+            scores.append(dict((x.name, x.score)
+                               for x in cross_validation.entities))
+        self.assertEqual(set(scores[0]), set(scores[1]))
+        differences = [abs(score - scores[1][name])
+                       for name, score in scores[0].items()]
+        self.assertGreater(max(differences), 0)
+        self.assertLess(max(differences), 0.005)
+
+    @patch.object(ExponentialEntityList, '_fit_curve_to_entity_scores')
+    def test_refit_skipped_while_scores_unchanged(self, mock_fit):
+        """Check that a ranked list only refits its curve when a member
+        Entity's score has changed by at least the refit tolerance, and that
+        ensure_fitted() refits a list whose fit was skipped"""
+        test_object = ExponentialEntityList()
+        test_object.refit_tolerance = 0.1
+        ent1 = Entity("1")
+        ent1.score = 2.0
+        test_object.append(ent1)
+        ent2 = Entity("2")
+        ent2.score = 1.0
+        test_object.append(ent2)
+
+        test_object.calculate_new_weight()
+        self.assertEqual(1, mock_fit.call_count)
+        self.assertFalse(test_object.fit_skipped)
+
+        ent1.score = 2.05
+        test_object.calculate_new_weight()
+        self.assertEqual(1, mock_fit.call_count)
+        self.assertTrue(test_object.fit_skipped)
+
+        # the change is measured from the last fit, not the last iteration
+        ent1.score = 2.1
+        test_object.calculate_new_weight()
+        self.assertEqual(2, mock_fit.call_count)
+        self.assertFalse(test_object.fit_skipped)
+
+        ent2.score = 1.01
+        test_object.calculate_new_weight()
+        self.assertTrue(test_object.fit_skipped)
+        test_object.ensure_fitted()
+        self.assertEqual(3, mock_fit.call_count)
+        self.assertFalse(test_object.fit_skipped)
+        test_object.ensure_fitted()
+        self.assertEqual(3, mock_fit.call_count)
+
+    def test_refit_always_needed_without_tolerance(self):
+        """Check that lists always refit by default and that unranked lists
+        never track their scores"""
+        test_object = ExponentialEntityList()
+        ent1 = Entity("1")
+        test_object.append(ent1)
+        test_object.fit_completed()
+        self.assertTrue(test_object.needs_refit())
+
+        test_object = EntityList()
+        test_object.refit_tolerance = 0.1
+        test_object.append(ent1)
+        test_object.fit_completed()
+        self.assertTrue(test_object.needs_refit())
+
+    def test_truncated_weights_list_is_cached_until_scores_change(self):
+        """Check that the truncated weights list is the square root of the
+        running mean of the scores, that it is cached while the scores stay
+        the same and recalculated when they change"""
+        test_object = EntityList()
+        scores = [4.0, 2.0, 3.0, 0.5]
+        entities = []
+        for idx, score in enumerate(scores):
+            ent = Entity(str(idx))
+            ent.score = score
+            test_object.append(ent)
+            entities.append(ent)
+
+        expected = []
+        running_total = 0.0
+        for idx, score in enumerate(scores):
+            running_total += score
+            expected.append(sqrt(running_total / (idx + 1)))
+        returned = test_object.get_truncated_weights_list()
+        self.assertEqual(expected, list(returned))
+        self.assertIs(returned, test_object.get_truncated_weights_list())
+        self.assertFalse(returned.flags.writeable)
+
+        entities[2].score = 7.0
+        updated = test_object.get_truncated_weights_list()
+        self.assertIsNot(returned, updated)
+        self.assertEqual(expected[:2], list(updated[:2]))
+        self.assertAlmostEqual(sqrt(13.0 / 3), updated[2], 14)
+
+    def test_score_caches_hit_without_reading_scores(self):
+        """Check that the truncated weights list and needs_refit() do not
+        read the member scores again while none of them has changed"""
+        test_object = ExponentialEntityList()
+        test_object.refit_tolerance = 0.1
+        entities = [Entity(str(x)) for x in range(3)]
+        for ent in entities:
+            test_object.append(ent)
+        returned = test_object.get_truncated_weights_list()
+        test_object.fit_completed()
+        with patch.object(test_object, 'member_scores') as mock_scores:
+            self.assertIs(returned, test_object.get_truncated_weights_list())
+            self.assertFalse(test_object.needs_refit())
+            mock_scores.assert_not_called()
+        entities[1].score = 1.05
+        self.assertIsNot(returned, test_object.get_truncated_weights_list())
+        self.assertFalse(test_object.needs_refit())
+        test_object.append(Entity("3"))
+        self.assertEqual(4, len(test_object.get_truncated_weights_list()))
+
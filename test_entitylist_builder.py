@@ -2,6 +2,7 @@ import unittest
 
 from mock import patch
 
+from entity import CompactEntity, Entity
 from entitylist_builder import EntityListBuilder
 from errors import WarnValueError, KillValueError
 from entitylist import EntityList, KnnEntityList, SvrEntityList, \
@@ -349,6 +350,38 @@ class TestEntityListBuilder(unittest.TestCase):
         self.assertEqual(1, len(test_object1.entities()))
         self.assertEqual(1, len(test_object2.entities()))
 
+    def test_warm_start_is_passed_to_exponential_lists(self):
+        """Test that the builder tells the exponential lists it builds
+        whether to warm-start their curve fits"""
+        test_object = EntityListBuilder('exponential', warm_start=True)
+        entity_list = test_object.build_list_from_string(self.VALID_STRING)
+        self.assertTrue(entity_list.warm_start)
+        test_object = EntityListBuilder('exponential')
+        entity_list = test_object.build_list_from_string(self.VALID_STRING)
+        self.assertFalse(entity_list.warm_start)
+
+    def test_entity_lists_in_build_order(self):
+        """Test that the builder reports the lists it has built in the
+        order it built them"""
+        test_object = EntityListBuilder('none')
+        list1 = test_object.build_list_from_string(self.VALID_STRING)
+        list2 = test_object.build_list_from_string(
+            "category\tother\tranked\tignored\td\tb\te")
+        self.assertEqual([list1, list2], test_object.entity_lists())
+        self.assertEqual(['a', 'b', 'c', 'd', 'e'],
+                         [x.name for x in test_object.entities()])
+
+    def test_builder_creates_compact_entities_by_default(self):
+        """Test that a builder creates slotted CompactEntities unless asked
+        for Entities that can be given attributes"""
+        test_object = EntityListBuilder('none')
+        entity = test_object.get_or_create_entity("A")
+        self.assertIs(CompactEntity, type(entity))
+        self.assertFalse(hasattr(entity, '__dict__'))
+        entity = EntityListBuilder('none',
+                                  compact=False).get_or_create_entity("A")
+        self.assertIs(Entity, type(entity))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -113,6 +113,48 @@ class TestFileReader(TestCase):
         self.assertEqual(4, len(test_object.list_lines),
                          "Should be 4 items in the list")
 
+    @mock.patch('file_reader.io.open', create=True)
+    def test_iter_lines_yields_the_same_lines_as_read_file(self, mocked_open):
+        """
+        Check that the streaming reader applies the comment, blank line and
+        terminator rules in the same way as read_file
+        """
+        read_data = "#CR\rCategory\tName\tRANKED\tG1\r" \
+                    "CRLF\r\n" \
+                    "\t\t\n" \
+                    "# LF\n" \
+                    "LF\n" \
+                    "-----\n" \
+                    "After the end"
+        mocked_open.side_effect = [
+            mock.mock_open(read_data=read_data).return_value,
+            mock.mock_open(read_data=read_data).return_value
+        ]
+        __file_path = "Path to File"
+        test_object = FileReader()
+        test_object.read_file(__file_path)
+        streamed = list(FileReader.iter_lines(__file_path))
+        mocked_open.assert_called_with(__file_path, "r")
+        self.assertEqual(["Category\tName\tRANKED\tG1", "CRLF", "LF"],
+                         streamed)
+        self.assertEqual(test_object.list_lines, streamed)
+
+    @mock.patch('file_reader.io.open', create=True)
+    def test_iter_lines_reads_lazily(self, mocked_open):
+        """
+        Check that the streaming reader does not store the lines it yields
+        and does not open the file until it is first asked for a line
+        """
+        mocked_open.side_effect = [
+            mock.mock_open(read_data="A\nB\n").return_value
+        ]
+        test_object = FileReader()
+        lines = test_object.iter_lines("Path to File")
+        self.assertFalse(mocked_open.called)
+        self.assertEqual("A", next(lines))
+        self.assertEqual(["B"], list(lines))
+        self.assertFalse(test_object.list_lines)
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,52 @@
+from unittest import TestCase, main
+
+import mock
+
+from cross_validation import CrossValidation
+from entitylist import EntityList, ExponentialEntityList
+from fit_statistics import FitStatisticsCollector, FIT_STATISTICS_COLUMNS
+
+
+class TestFitStatisticsCollector(TestCase):
+
+    def build_cross_validation(self):
+        """Make a CrossValidation object with two ranked lists whose fits
+        have been recorded, one ranked list whose fit was skipped and one
+        unranked list"""
+        list1 = ExponentialEntityList()
+        list1.record_fit_evaluations(30, False)
+        list1.record_fit_evaluations(10, True)
+        list2 = ExponentialEntityList()
+        list2.record_fit_evaluations(25, False)
+        cross_validation = mock.create_autospec(CrossValidation)
+        list3 = ExponentialEntityList()
+        list3.skip_fit()
+        cross_validation.entity_lists = [list1, list2, list3, EntityList()]
+        return cross_validation
+
+    def test_collects_statistics_per_iteration(self):
+        """Check that the collector sums the fit statistics of the ranked
+        lists at each iteration"""
+        test_object = FitStatisticsCollector()
+        test_object.do_callback(self.build_cross_validation(), 3)
+        self.assertEqual([dict(iteration=3, fits=2, skipped=1, warm_starts=1,
+                               evaluations=35, evaluations_saved=20)],
+                         test_object.iterations)
+
+    @mock.patch('utils.io.open')
+    def test_dump_writes_tab_separated_file(self, mock_open):
+        """Check that the statistics are written out with a header row"""
+        handle = mock.MagicMock()
+        mock_open.return_value.__enter__.return_value = handle
+        test_object = FitStatisticsCollector()
+        test_object.do_callback(self.build_cross_validation(), 1)
+        test_object.dump('/local/directory/')
+        mock_open.assert_called_once_with(
+            '/local/directory/fit_statistics.txt', 'w')
+        handle.writelines.assert_called_once_with(
+            ['\t'.join(FIT_STATISTICS_COLUMNS) + '\n',
+             '1\t2\t1\t1\t35\t20\n'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+from unittest import TestCase, main
+
+import numpy as np
+from mock import Mock
+
+from analysis_fixtures import build_analysis
+from fixed_point_solver import AcceleratedSolver, ANDERSON, BROYDEN, \
+    read_state, write_state
+
+
+def final_scores(cross_validation):
+    return np.array([x.score for x in cross_validation.entities])
+
+
+def linear_lists(matrix, offset, weights):
+    """Return unranked mock lists whose weights are updated by the affine
+    map x -> matrix.x + offset each time the returned function is called"""
+    entity_lists = [Mock(uses_fitted_weights=False, weight=weight)
+                    for weight in weights]
+
+    def iterate():
+        state = np.array([x.weight for x in entity_lists])
+        for entity_list, value in zip(entity_lists,
+                                      matrix.dot(state) + offset):
+            entity_list.weight = value
+        return state
+    return entity_lists, iterate
+
+
+class TestAcceleratedSolver(TestCase):
+
+    def test_state_round_trip(self):
+        """Check that the state holds the weight of every list and the
+        fitted weights of ranked lists with one for every member"""
+        cross_validation = build_analysis('exponential')
+        cross_validation.max_iterations = 2
+        cross_validation.run_analysis()
+        layout, state = read_state(cross_validation.entity_lists)
+        ranked = [x for x in cross_validation.entity_lists
+                  if x.uses_fitted_weights]
+        self.assertTrue(ranked)
+        self.assertEqual(len(cross_validation.entity_lists) +
+                         sum(len(x) for x in ranked), len(state))
+        write_state(cross_validation.entity_lists, layout, state * 2)
+        self.assertEqual(state[0] * 2,
+                         cross_validation.entity_lists[0].weight)
+        np.testing.assert_array_equal(state * 2, read_state(
+            cross_validation.entity_lists)[1])
+
+    def test_solves_linear_fixed_point(self):
+        """Check that, on a contracting affine map, both methods reach the
+        fixed point in far fewer steps than plain iteration"""
+        matrix = np.array([[0.6, 0.3], [0.2, 0.7]])
+        offset = np.array([1.0, 0.5])
+        expected = np.linalg.solve(np.eye(2) - matrix, offset)
+        for method in [ANDERSON, BROYDEN]:
+            entity_lists, iterate = linear_lists(matrix, offset, [1.0, 1.0])
+            cross_validation = Mock(entity_lists=entity_lists)
+            test_object = AcceleratedSolver(method, memory=2)
+            for iteration in range(1, 6):
+                iterate()
+                test_object.step(cross_validation, iteration)
+            np.testing.assert_allclose(
+                expected, [x.weight for x in entity_lists], atol=1e-8)
+            self.assertEqual(0, test_object.fallbacks)
+
+    def test_falls_back_when_residual_grows(self):
+        """Check that an accelerated state whose residual is bigger than
+        that of the state it came from is replaced by the plain step"""
+        entity_list = Mock(uses_fitted_weights=False, weight=1.0)
+        cross_validation = Mock(entity_lists=[entity_list])
+        test_object = AcceleratedSolver(ANDERSON)
+        test_object.mix = Mock(side_effect=[None, np.array([5.0])])
+        for iteration, weight in enumerate([2.0, 2.5, 2.75], 1):
+            entity_list.weight = weight
+            test_object.step(cross_validation, iteration)
+        self.assertEqual(5.0, entity_list.weight)
+        # the accelerated state 5.0 gives 10.0 - much further off
+        entity_list.weight = 10.0
+        test_object.step(cross_validation, 4)
+        self.assertEqual(2.75, entity_list.weight)
+        self.assertEqual((1, 1), (test_object.accelerated_steps,
+                                  test_object.fallbacks))
+
+    def test_analysis_converges_in_fewer_iterations(self):
+        """Check that an accelerated analysis needs no more iterations and
+        gives final scores close to those of plain iteration"""
+        expected = build_analysis('exponential')
+        expected.run()
+        for method in [ANDERSON, BROYDEN]:
+            cross_validation = build_analysis('exponential')
+            cross_validation.solver = AcceleratedSolver(method)
+            cross_validation.run()
+            self.assertLessEqual(cross_validation.iteration,
+                                 expected.iteration)
+            np.testing.assert_allclose(final_scores(expected),
+                                       final_scores(cross_validation),
+                                       atol=0.1)
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, AcceleratedSolver, 'picard')
+
+
+if __name__ == '__main__':
+    main()
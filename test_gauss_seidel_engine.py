@@ -0,0 +1,73 @@
+from unittest import TestCase, main
+
+import numpy as np
+
+from analysis_fixtures import build_analysis
+from gauss_seidel_engine import GaussSeidelEngine
+
+
+def scores(cross_validation):
+    return np.array([x.score for x in cross_validation.entities])
+
+
+class TestGaussSeidelEngine(TestCase):
+
+    def test_reaches_same_fixed_point_in_fewer_sweeps(self):
+        """Check that the in-place updates converge to the same scores as
+        the usual iteration, in no more iterations"""
+        results = []
+        for engine in [None, GaussSeidelEngine()]:
+            cross_validation = build_analysis('exponential', engine)
+            cross_validation.threshold = 1e-6
+            cross_validation.run()
+            results.append(cross_validation)
+        expected, actual = results
+        self.assertLessEqual(actual.iteration, expected.iteration)
+        np.testing.assert_allclose(scores(expected), scores(actual),
+                                   atol=1e-4)
+
+    def test_scores_up_to_date_after_each_sweep(self):
+        """Check that after a sweep every Entity score is the one its lists'
+        current weights give, although not every score was recalculated"""
+        engine = GaussSeidelEngine()
+        cross_validation = build_analysis('exponential', engine)
+        cross_validation.max_iterations = 3
+        cross_validation.run_analysis()
+        actual = scores(cross_validation)
+        for entity in cross_validation.entities:
+            entity.calculate_new_score()
+        np.testing.assert_array_equal(scores(cross_validation), actual)
+        self.assertGreaterEqual(engine.total_rescored,
+                                len(cross_validation.entities))
+
+    def test_only_members_of_changed_lists_are_dirty(self):
+        """Check that a change to a list's weight between sweeps marks just
+        its members as needing new scores"""
+        engine = GaussSeidelEngine()
+        cross_validation = build_analysis('exponential', engine)
+        cross_validation.max_iterations = 1
+        cross_validation.run_analysis()
+        self.assertEqual([], engine.dirty_entities(cross_validation))
+        entity_list = cross_validation.entity_lists[0]
+        entity_list.weight += 1.0
+        self.assertEqual(list(entity_list),
+                         engine.dirty_entities(cross_validation))
+        self.assertEqual([], engine.dirty_entities(cross_validation))
+
+    def test_replaced_fitted_weights_are_a_change(self):
+        """Check that fitted weights replaced by a new list, even one with
+        the same values, mark the list's members as needing new scores"""
+        engine = GaussSeidelEngine()
+        cross_validation = build_analysis('exponential', engine)
+        cross_validation.max_iterations = 1
+        cross_validation.run_analysis()
+        self.assertEqual([], engine.dirty_entities(cross_validation))
+        entity_list = [x for x in cross_validation.entity_lists
+                       if x.uses_fitted_weights][0]
+        entity_list.weights_list = list(entity_list.weights_list)
+        self.assertEqual(list(entity_list),
+                         engine.dirty_entities(cross_validation))
+
+
+if __name__ == '__main__':
+    main()
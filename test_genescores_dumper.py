@@ -1,12 +1,20 @@
+import io
+import os
+import shutil
+import tempfile
 from unittest import TestCase, main
 
 import mock
+import numpy as np
+import scipy.sparse
 
+from analysis_fixtures import build_analysis
 from constants import T_METHOD_NONE
 from cross_validation import CrossValidation
 from entity import Entity
 from entitylist import EntityList
-from genescores_dumper import GeneScoresDumper, IterationAwareGeneScoresDumper
+from genescores_dumper import GeneScoresDumper, \
+    IterationAwareGeneScoresDumper, AllScoresGeneScoresDumper
 
 
 class TestGeneScoresDumper(TestCase):
@@ -187,6 +195,108 @@ class TestGeneScoresDumper(TestCase):
         self.assertEqual("maic_raw-007", result.filename)
         self.assertEqual("no_transform", result.methodname)
 
+    def test_all_scores_dump_matches_row_by_row_dump(self):
+        """Check that the chunked, sparse AllScoresGeneScoresDumper output
+        is exactly what the row-by-row GeneScoresDumper code writes with
+        the same columns, both with the integer weights of the first
+        iteration and after the analysis has converged"""
+        output_folder = tempfile.mkdtemp()
+        try:
+            for max_iterations in [1, 100]:
+                cross_validation = build_analysis('exponential')
+                cross_validation.max_iterations = max_iterations
+                cross_validation.run()
+                test_object = AllScoresGeneScoresDumper(
+                    cross_validation, output_folder + os.sep)
+                with mock.patch('genescores_dumper.DUMP_CHUNK_ROWS', 3):
+                    test_object.dump()
+                with io.open(os.path.join(output_folder,
+                                          'maic_raw.txt')) as in_stream:
+                    actual = in_stream.read()
+                test_object.output_folder = os.path.join(output_folder,
+                                                         'expected-')
+                GeneScoresDumper.dump(test_object)
+                with io.open(os.path.join(output_folder,
+                                          'expected-maic_raw.txt')) \
+                        as in_stream:
+                    expected = in_stream.read()
+                self.assertEqual(expected, actual)
+                self.assertEqual(len(cross_validation.entities) + 1,
+                                 len(actual.splitlines()))
+        finally:
+            shutil.rmtree(output_folder)
+
+    def test_npz_dump_matches_text_dump(self):
+        """Check that the NPZ output holds the same names and scores as the
+        text output, and that its score matrix can be read by scipy"""
+        output_folder = tempfile.mkdtemp()
+        try:
+            cross_validation = build_analysis('exponential')
+            cross_validation.run()
+            AllScoresGeneScoresDumper(cross_validation,
+                                      output_folder + os.sep).dump()
+            AllScoresGeneScoresDumper(cross_validation, output_folder + os.sep,
+                                      output_format='npz').dump()
+            with io.open(os.path.join(output_folder,
+                                      'maic_raw.txt')) as in_stream:
+                rows = [x.rstrip('\n').split('\t') for x in in_stream]
+            file_path = os.path.join(output_folder, 'maic_raw.npz')
+            with np.load(file_path) as archive:
+                self.assertEqual(rows[0][1:-2], list(archive['list_names']))
+                self.assertEqual([x[0] for x in rows[1:]],
+                                 list(archive['entity_names']))
+                self.assertEqual([float(x[-2]) for x in rows[1:]],
+                                 list(archive['maic_score']))
+                self.assertEqual([x[-1] for x in rows[1:]],
+                                 list(archive['contributors']))
+            scores = scipy.sparse.load_npz(file_path).toarray()
+            expected = [[float(x) for x in row[1:-2]] for row in rows[1:]]
+            self.assertEqual(expected, scores.tolist())
+        finally:
+            shutil.rmtree(output_folder)
+
+    def test_unknown_output_format_is_rejected(self):
+        """Check that an unknown output format is reported when the dumper
+        is created"""
+        cross_val = mock.create_autospec(CrossValidation)
+        self.assertRaises(ValueError, AllScoresGeneScoresDumper, cross_val,
+                          output_format='xlsx')
+
+    @mock.patch('genescores_dumper.pyarrow', None)
+    def test_arrow_output_formats_need_pyarrow(self):
+        """Check that the Parquet and Feather formats are refused if pyarrow
+        is not installed"""
+        cross_val = mock.create_autospec(CrossValidation)
+        for output_format in ['parquet', 'feather']:
+            self.assertRaises(ImportError, AllScoresGeneScoresDumper,
+                              cross_val, output_format=output_format)
+
+    @mock.patch('genescores_dumper.pyarrow')
+    def test_arrow_dump_writes_text_columns(self, mock_pyarrow):
+        """Check that the Parquet and Feather tables have the columns of the
+        text output and are written with the right pyarrow functions"""
+        mock_pyarrow.array.side_effect = lambda x: list(x)
+        cross_validation = build_analysis('exponential')
+        cross_validation.run()
+        lists = AllScoresGeneScoresDumper(
+            cross_validation).lists_in_category_order()
+        for output_format in ['parquet', 'feather']:
+            mock_pyarrow.reset_mock()
+            AllScoresGeneScoresDumper(cross_validation, '/local/directory/',
+                                      output_format=output_format).dump()
+            args, kwargs = mock_pyarrow.Table.from_arrays.call_args
+            self.assertEqual(['gene'] + [x.name for x in lists] +
+                             ['maic_score', 'contributors'], kwargs['names'])
+            self.assertEqual(len(cross_validation.entities), len(args[0][0]))
+            table = mock_pyarrow.Table.from_arrays.return_value
+            file_path = '/local/directory/maic_raw.' + output_format
+            if output_format == 'parquet':
+                mock_pyarrow.parquet.write_table.assert_called_once_with(
+                    table, file_path)
+            else:
+                mock_pyarrow.feather.write_feather.assert_called_once_with(
+                    table, file_path, compression='uncompressed')
+
 
 if __name__ == '__main__':
     main()
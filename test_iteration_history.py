@@ -0,0 +1,148 @@
+import io
+import os
+import shutil
+import tempfile
+from unittest import TestCase, main
+
+import mock
+import numpy as np
+
+from analysis_fixtures import build_analysis
+from cross_validation import POST_ITERATION_CALLBACK
+import iteration_history
+from iteration_history import IterationHistoryReader, \
+    IterationHistoryWriter, IterationSnapshot, HISTORY_FILENAME, NO_WINNER
+
+
+class SnapshotCollector(object):
+    """Keep a snapshot of the analysis at every iteration"""
+
+    def __init__(self):
+        self.snapshots = {}
+
+    def do_callback(self, cross_validation=None, iteration=None):
+        self.snapshots[iteration] = IterationHistoryWriter.snapshot(
+            cross_validation, iteration)
+
+
+def make_snapshot(iteration, scores, weights, winners):
+    return IterationSnapshot(iteration, ['A', 'B', 'C'], ['L1', 'L2'],
+                             ['cat1', 'cat2'],
+                             np.array(scores, dtype=np.float64),
+                             np.array(weights, dtype=np.float64),
+                             np.array(winners, dtype=np.int32))
+
+
+class TestIterationHistory(TestCase):
+
+    def setUp(self):
+        self.output_folder = tempfile.mkdtemp() + os.sep
+
+    def tearDown(self):
+        shutil.rmtree(self.output_folder)
+
+    def assertSnapshotsEqual(self, expected, actual):
+        self.assertEqual(expected.iteration, actual.iteration)
+        self.assertEqual(expected.entity_names, actual.entity_names)
+        self.assertEqual(expected.list_names, actual.list_names)
+        self.assertEqual(expected.category_names, actual.category_names)
+        self.assertEqual(expected.entity_scores.tolist(),
+                         actual.entity_scores.tolist())
+        self.assertEqual(expected.list_weights.tolist(),
+                         actual.list_weights.tolist())
+        self.assertEqual(expected.category_winners.tolist(),
+                         actual.category_winners.tolist())
+
+    def test_reader_reconstructs_every_iteration(self):
+        """Check that every iteration of an analysis can be reconstructed
+        exactly from the history, whatever order they are asked for in"""
+        cross_validation = build_analysis('exponential')
+        collector = SnapshotCollector()
+        writer = IterationHistoryWriter(self.output_folder)
+        cross_validation.register_callback(POST_ITERATION_CALLBACK, writer)
+        cross_validation.register_callback(POST_ITERATION_CALLBACK, collector)
+        cross_validation.run()
+
+        reader = IterationHistoryReader(self.output_folder + HISTORY_FILENAME)
+        iterations = sorted(collector.snapshots.keys())
+        self.assertEqual(iterations, reader.iterations)
+        self.assertTrue(len(iterations) > 2)
+        for iteration in [iterations[-1], iterations[1]] + iterations:
+            self.assertSnapshotsEqual(collector.snapshots[iteration],
+                                      reader.snapshot(iteration))
+        self.assertRaises(KeyError, reader.snapshot, iterations[-1] + 1)
+
+    def test_delta_record_holds_only_changes(self):
+        """Check that a delta record holds just the positions and values of
+        the scores, weights and winners that changed"""
+        previous = make_snapshot(1, [1.0, 2.0, 3.0], [0.5, 0.5],
+                                 [[0, 1], [0, NO_WINNER], [1, 1]])
+        snapshot = make_snapshot(2, [1.0, float('nan'), 3.5], [0.5, 0.5],
+                                 [[0, 1], [0, NO_WINNER], [0, 1]])
+        arrays = IterationHistoryWriter.delta_record(previous, snapshot)
+        self.assertEqual([1, 2], arrays['entity_scores_indexes'].tolist())
+        self.assertTrue(np.isnan(arrays['entity_scores_values'][0]))
+        self.assertEqual(3.5, arrays['entity_scores_values'][1])
+        self.assertEqual([], arrays['list_weights_indexes'].tolist())
+        self.assertEqual([4], arrays['category_winners_indexes'].tolist())
+        self.assertEqual([0], arrays['category_winners_values'].tolist())
+
+    def test_full_record_written_when_the_lists_change(self):
+        """Check that an iteration is written in full, rather than as a
+        delta, if the entities or lists have changed since the last one"""
+        cross_validation = build_analysis('exponential')
+        writer = IterationHistoryWriter(self.output_folder)
+        writer.do_callback(cross_validation, 1)
+        writer.do_callback(cross_validation, 2)
+        cross_validation.entity_lists = cross_validation.entity_lists[1:]
+        writer.do_callback(cross_validation, 3)
+        reader = IterationHistoryReader(self.output_folder + HISTORY_FILENAME)
+        self.assertEqual([True, False, True], [x[1] for x in reader.records])
+        self.assertSnapshotsEqual(
+            IterationHistoryWriter.snapshot(cross_validation, 3),
+            reader.snapshot(3))
+
+    def test_main_lists_and_prints_iterations(self):
+        """Check that the command line lists the recorded iterations, or
+        prints the scores of one of them"""
+        cross_validation = build_analysis('exponential')
+        writer = IterationHistoryWriter(self.output_folder)
+        writer.do_callback(cross_validation, 1)
+        writer.do_callback(cross_validation, 2)
+        history_file = self.output_folder + HISTORY_FILENAME
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            iteration_history.main([history_file])
+        self.assertEqual("1\n2\n", stdout.getvalue())
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            iteration_history.main([history_file, '2'])
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(['gene', 'maic_score'], lines[0].split('\t')[:2])
+        self.assertEqual(len(cross_validation.entities) + 1, len(lines))
+
+    def test_main_reports_usage_errors(self):
+        """Check that the command line shows its help, and exits with a
+        usage message (not a traceback) for a missing history file or an
+        unrecorded iteration"""
+        with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+            with self.assertRaises(SystemExit) as context:
+                iteration_history.main(['-h'])
+        self.assertEqual(0, context.exception.code)
+        self.assertIn('usage:', stdout.getvalue())
+
+        writer = IterationHistoryWriter(self.output_folder)
+        writer.do_callback(build_analysis('exponential'), 1)
+        for args, message in [
+                ([self.output_folder + 'missing.bin'],
+                 'cannot read the history file'),
+                ([self.output_folder + HISTORY_FILENAME, '5'],
+                 'Iteration 5 is not in the history')]:
+            with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+                with self.assertRaises(SystemExit) as context:
+                    iteration_history.main(args)
+            self.assertEqual(2, context.exception.code)
+            self.assertIn('usage:', stderr.getvalue())
+            self.assertIn(message, stderr.getvalue())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
 import os
 import re
+import shutil
+import tempfile
 from unittest import TestCase
 
 import mock
 
+from analysis_fixtures import build_analysis
+from analysis_state import save_state
 from maic import Maic
 
 
@@ -127,3 +131,22 @@ class TestMaic(TestCase):
             pass
         except BaseException:
             self.fail("Should get an OSError")
+
+    def test_resume_from_checkpoint_of_other_input_fails(self):
+        """Check that resuming from a checkpoint of a different input is
+        refused"""
+        folder = tempfile.mkdtemp()
+        try:
+            path = os.path.join(folder, 'checkpoint.npz')
+            saved = build_analysis('exponential')
+            saved.max_iterations = 1
+            saved.run_analysis()
+            save_state(saved, path)
+            cross_validation = build_analysis('exponential')
+            Maic.resume_from_checkpoint(cross_validation, path)
+            self.assertEqual(1, cross_validation.iteration)
+            cross_validation.remove_list(cross_validation.entity_lists[-1])
+            self.assertRaises(ValueError, Maic.resume_from_checkpoint,
+                              cross_validation, path)
+        finally:
+            shutil.rmtree(folder)
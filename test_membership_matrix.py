@@ -0,0 +1,70 @@
+from unittest import TestCase, main
+
+import numpy as np
+
+from analysis_fixtures import build_analysis
+from membership_matrix import MembershipMatrix
+
+
+class TestMembershipMatrix(TestCase):
+
+    def test_matrix_describes_memberships(self):
+        """Check the compiled membership matrix for our test data"""
+        cross_validation = build_analysis('none')
+        matrix = MembershipMatrix(cross_validation.entities,
+                                  cross_validation.entity_lists)
+        self.assertEqual(len(cross_validation.entities), matrix.entity_count)
+        self.assertEqual(6, matrix.list_count)
+        self.assertEqual(sum(len(x) for x in cross_validation.entity_lists),
+                         matrix.membership_count)
+        self.assertEqual(['CAT1', 'CAT2', 'CAT3'], matrix.categories)
+        self.assertEqual([0, 0, 1, 1, 2, 0], list(matrix.list_categories))
+        self.assertEqual(list(range(1, 9)), list(matrix.ranks[:8]))
+        # Entity A is on every list but List6 shares a category with
+        # List1 and List2 so A is in three (Entity, category) groups
+        entity_a = cross_validation.entities.index(
+            [x for x in cross_validation.entities if x.name == 'A'][0])
+        self.assertEqual(3, list(matrix.group_entities).count(entity_a))
+
+    def test_category_maxima_and_scores(self):
+        """Check the per-category maxima, the winning memberships and the
+        resulting Entity scores and list totals"""
+        cross_validation = build_analysis('none')
+        matrix = MembershipMatrix(cross_validation.entities,
+                                  cross_validation.entity_lists)
+        weights = np.ones(matrix.membership_count)
+        maxima, winners = matrix.category_maxima(weights)
+        self.assertEqual(len(matrix.group_starts), len(maxima))
+        self.assertTrue(np.all(maxima == 1.0))
+        scores = matrix.entity_scores(maxima)
+        # every Entity scores one per category it appears in
+        for entity, score in zip(cross_validation.entities, scores):
+            categories = set(x.category for x in entity.lists)
+            self.assertEqual(len(categories), score)
+        totals = matrix.list_totals(np.ones(matrix.entity_count))
+        self.assertEqual([len(x) for x in cross_validation.entity_lists],
+                         list(totals))
+        # ties go to the first list the Entity is on in each category
+        for winner in winners:
+            entity = matrix.entities[matrix.entity_ids[winner]]
+            category = matrix.categories[matrix.category_ids[winner]]
+            first = [x for x in entity.lists if x.category == category][0]
+            self.assertIs(first, matrix.entity_lists[matrix.list_ids[winner]])
+
+    def test_memberships_in_list_order(self):
+        """Check that the memberships are laid out list by list, with each
+        member's one-based rank on its list"""
+        cross_validation = build_analysis('none')
+        matrix = MembershipMatrix(cross_validation.entities,
+                                  cross_validation.entity_lists)
+        expected = []
+        for list_id, entity_list in enumerate(cross_validation.entity_lists):
+            for rank, entity in enumerate(entity_list):
+                expected.append((cross_validation.entities.index(entity),
+                                 list_id, rank + 1))
+        self.assertEqual(expected, list(zip(matrix.entity_ids.tolist(),
+                                            matrix.list_ids.tolist(),
+                                            matrix.ranks.tolist())))
+
+if __name__ == '__main__':
+    main()
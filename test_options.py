@@ -9,16 +9,40 @@ from constants import T_METHOD_NONE, T_METHOD_MEAN, T_METHOD_STEM_SCALE, \
     S_METHOD_STEM_POW
 
 EXPECTED_OPTION_ATTRIBUTE_KEYS = [
+    'aitken',
+    'batch_fit',
+    'checkpoint',
+    'checkpoint_interval',
+    'dirty_epsilon',
     'dump',
+    'dump_history',
+    'engine',
     'filename',
     'logging_level',
     'max_input_len',
     'max_iterations',
     'output_folder',
+    'output_format',
     'plot',
+    'plot_panels',
+    'plot_workers',
+    'profile',
+    'profile_memory',
     'random_source_len',
+    'rank_patience',
+    'refit_tolerance',
+    'relative_tolerance',
+    'resume',
+    'save_state',
+    'solver',
+    'solver_memory',
     'stability',
-    'weight_function'
+    'start_from',
+    'top_n',
+    'warm_start',
+    'weight_function',
+    'workers',
+    'write_queue'
 ]
 EXPECTED_OPTION_ATTRIBUTE_COUNT = len(EXPECTED_OPTION_ATTRIBUTE_KEYS)
 
@@ -0,0 +1,86 @@
+from unittest import TestCase, main
+
+import mock
+
+from entity import Entity
+from entitylist import ExponentialEntityList, PolynomialEntityList
+from parallel_fitter import ParallelCurveFitter, fit_detached_list
+
+TEST_SCORES = [[10.6, 8.2, 10.7, 7.1, 4.2, 2.0, 3.3, 2.1],
+               [5.0, 4.0, 3.5, 1.0, 1.0, 0.5],
+               [3.3, 3.2, 1.1, 1.0, 0.9, 0.2, 0.2]]
+
+
+def build_lists(list_class):
+    """Make a set of lists of the given class whose Entities have the test
+    scores and whose weights have been calculated (but not fitted)"""
+    lists = []
+    for idx, scores in enumerate(TEST_SCORES):
+        entity_list = list_class()
+        entity_list.name = "List{}".format(idx)
+        for score in scores:
+            ent = Entity("{}-{}".format(idx, score))
+            ent.score = score
+            entity_list.append(ent)
+        entity_list.calculate_new_weight(fit_curve=False)
+        lists.append(entity_list)
+    return lists
+
+
+class TestParallelCurveFitter(TestCase):
+
+    def assert_same_fits(self, expected_lists, actual_lists):
+        for expected, actual in zip(expected_lists, actual_lists):
+            self.assertEqual(list(expected.weights_list),
+                             list(actual.weights_list))
+            self.assertEqual(expected.ratio, actual.ratio)
+
+    def test_detached_fit_matches_fit_in_place(self):
+        """Check that repeating a fit from a list's payload gives exactly the
+        same results as fitting the list itself"""
+        for list_class in [ExponentialEntityList, PolynomialEntityList]:
+            expected_lists = build_lists(list_class)
+            actual_lists = build_lists(list_class)
+            for expected, actual in zip(expected_lists, actual_lists):
+                expected.refit()
+                actual.apply_fit_result(
+                    fit_detached_list(actual.fit_payload()))
+            self.assert_same_fits(expected_lists, actual_lists)
+            if list_class == ExponentialEntityList:
+                for expected, actual in zip(expected_lists, actual_lists):
+                    self.assertEqual(list(expected.fit_parameters),
+                                     list(actual.fit_parameters))
+                    self.assertEqual(expected.fit_evaluations,
+                                     actual.fit_evaluations)
+
+    @mock.patch('parallel_fitter.Pool')
+    def test_small_jobs_are_fitted_serially(self, mock_pool):
+        """Check that no worker pool is used when there is too little work"""
+        expected_lists = build_lists(ExponentialEntityList)
+        for entity_list in expected_lists:
+            entity_list.refit()
+        actual_lists = build_lists(ExponentialEntityList)
+        test_object = ParallelCurveFitter(4)
+        test_object.fit(actual_lists)
+        mock_pool.assert_not_called()
+        self.assert_same_fits(expected_lists, actual_lists)
+
+    def test_parallel_fits_match_serial_fits(self):
+        """Check that fitting in worker processes gives exactly the same
+        results as fitting the lists one by one"""
+        expected_lists = build_lists(ExponentialEntityList)
+        for entity_list in expected_lists:
+            entity_list.refit()
+        actual_lists = build_lists(ExponentialEntityList)
+        test_object = ParallelCurveFitter(2, min_parallel_entities=0)
+        try:
+            test_object.fit(actual_lists)
+        finally:
+            test_object.close()
+        self.assert_same_fits(expected_lists, actual_lists)
+        for entity_list in actual_lists:
+            self.assertFalse(entity_list.fit_skipped)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+import json
+from unittest import TestCase, main
+
+import mock
+
+from analysis_fixtures import build_analysis
+from gauss_seidel_engine import GaussSeidelEngine
+from profiler import PhaseProfiler, PROFILE_COLUMNS, ITERATION_TOTAL
+from vectorized_engine import VectorizedEngine
+
+
+class TestPhaseProfiler(TestCase):
+
+    def profile_analysis(self, engine=None):
+        cross_validation = build_analysis('exponential', engine)
+        test_object = PhaseProfiler()
+        test_object.register(cross_validation)
+        cross_validation.run()
+        return cross_validation, test_object
+
+    def test_every_phase_of_every_iteration_is_recorded(self):
+        """Check that each iteration records its scoring, weighting, fitting
+        and dumping phases (once each) and a total, and that the fits are
+        counted in the fitting phase"""
+        for engine in [None, VectorizedEngine(), GaussSeidelEngine()]:
+            cross_validation, test_object = self.profile_analysis(engine)
+            iterations = cross_validation.iteration
+            for iteration in range(1, iterations + 1):
+                phases = [x['phase'] for x in test_object.records
+                          if x['iteration'] == iteration]
+                self.assertEqual(len(set(phases)), len(phases))
+                for phase in ['scoring', 'weighting', 'fitting', 'dumping',
+                              ITERATION_TOTAL]:
+                    self.assertIn(phase, phases)
+            self.assertEqual(['final_scores'],
+                             [x['phase'] for x in test_object.records[-1:]])
+            for record in test_object.records:
+                self.assertGreaterEqual(record['wall_time'], 0)
+                self.assertEqual(sorted(PROFILE_COLUMNS), sorted(record))
+            # Two ranked lists are fitted at every iteration
+            totals = test_object.totals()
+            self.assertEqual(2 * iterations, totals['fitting']['fits'])
+            self.assertEqual(2 * iterations, totals[ITERATION_TOTAL]['fits'])
+            self.assertEqual(0, totals['weighting']['fits'])
+            self.assertEqual(0, totals['scoring']['fits'])
+
+    def test_fitting_phase_is_recorded_for_a_curve_fitter(self):
+        """Check that lists fitted by a curve fitter are counted in the
+        fitting phase rather than the weighting phase"""
+        cross_validation = build_analysis('exponential')
+        cross_validation.curve_fitter = mock.MagicMock()
+        cross_validation.curve_fitter.can_fit.side_effect = \
+            lambda x: x.uses_fitted_weights
+        cross_validation.curve_fitter.fit.side_effect = \
+            lambda lists: [x.refit() for x in lists]
+        test_object = PhaseProfiler()
+        test_object.register(cross_validation)
+        cross_validation.run_analysis()
+        totals = test_object.totals()
+        self.assertEqual(0, totals['weighting']['fits'])
+        self.assertEqual(2 * cross_validation.iteration,
+                         totals['fitting']['fits'])
+
+    @mock.patch('utils.io.open', create=True)
+    def test_dump_writes_profile(self, mock_open):
+        """Check that the profile is written as JSON or TSV to the output
+        folder"""
+        handle = mock.MagicMock()
+        mock_open.return_value.__enter__.return_value = handle
+        test_object = PhaseProfiler()
+        test_object.records = [dict(iteration=1, phase='scoring',
+                                    wall_time=0.5, cpu_time=0.25, fits=0,
+                                    peak_memory=100)]
+        test_object.dump('/local/directory/', 'tsv')
+        mock_open.assert_called_with('/local/directory/profile.tsv', 'w')
+        handle.writelines.assert_called_with(
+            ['\t'.join(PROFILE_COLUMNS) + '\n',
+             '1\tscoring\t0.5\t0.25\t0\t100\n'])
+        test_object.dump('/local/directory/', 'json')
+        mock_open.assert_called_with('/local/directory/profile.json', 'w')
+        document = json.loads(''.join(handle.writelines.call_args[0][0]))
+        self.assertEqual(test_object.records, document['phases'])
+        self.assertEqual(0.5, document['totals']['scoring']['wall_time'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+from unittest import TestCase, main
+
+from synthetic_data import SyntheticDataGenerator
+
+
+class TestSyntheticDataGenerator(TestCase):
+
+    def test_lines_follow_the_input_format(self):
+        """Check that one line is generated per list, spread over the
+        categories, with the requested ranked status and list lengths"""
+        test_object = SyntheticDataGenerator(
+            categories=2, ranked_lists=3, unranked_lists=2, min_length=5,
+            max_length=10, signal_entities=20, noise_entities=50)
+        lines = list(test_object.lines())
+        self.assertEqual(5, len(lines))
+        for idx, line in enumerate(lines):
+            columns = line.split("\t")
+            self.assertEqual("Category{}".format(idx % 2 + 1), columns[0])
+            self.assertEqual("List{}".format(idx + 1), columns[1])
+            self.assertEqual("RANKED" if idx < 3 else "UNRANKED", columns[2])
+            members = columns[4:]
+            self.assertTrue(5 <= len(members) <= 10)
+            self.assertEqual(len(members), len(set(members)))
+            for member in members:
+                self.assertRegex(member, "^(entity|noise)[0-9]+$")
+
+    def test_lines_are_reproducible(self):
+        """Check that the same seed gives the same data and a different
+        seed does not"""
+        self.assertEqual(list(SyntheticDataGenerator(seed=3).lines()),
+                         list(SyntheticDataGenerator(seed=3).lines()))
+        self.assertNotEqual(list(SyntheticDataGenerator(seed=3).lines()),
+                            list(SyntheticDataGenerator(seed=4).lines()))
+
+    def test_signal_tends_to_be_ranked_first(self):
+        """Check that the signal entities are concentrated at the top of the
+        ranked lists"""
+        test_object = SyntheticDataGenerator(
+            categories=1, ranked_lists=1, unranked_lists=0, min_length=400,
+            max_length=400, signal_fraction=0.5)
+        members = next(test_object.lines()).split("\t")[4:]
+        top = sum(x.startswith("entity") for x in members[:200])
+        bottom = sum(x.startswith("entity") for x in members[200:])
+        self.assertGreater(top, bottom)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+from unittest import TestCase, main
+
+import mock
+
+from utils import tab_separated_lines, write_report
+
+
+class TestUtils(TestCase):
+
+    def test_tab_separated_lines_have_a_header(self):
+        """Check that the records are written in column order under a
+        header line"""
+        lines = tab_separated_lines(['a', 'b'], [dict(b=2, a=1),
+                                                 dict(a='x', b=0.5)])
+        self.assertEqual(['a\tb\n', '1\t2\n', 'x\t0.5\n'], lines)
+
+    @mock.patch('utils.io.open')
+    def test_write_report_to_output_folder(self, mock_open):
+        """Check that a report is written to the named file in the output
+        folder"""
+        handle = mock.MagicMock()
+        mock_open.return_value.__enter__.return_value = handle
+        write_report(['a\n', '1\n'], '/local/directory/', 'report.txt',
+                     "Report")
+        mock_open.assert_called_once_with('/local/directory/report.txt', 'w')
+        handle.writelines.assert_called_once_with(['a\n', '1\n'])
+
+    @mock.patch('utils.io.open')
+    def test_write_report_to_log(self, mock_open):
+        """Check that a report is logged under its title when there is no
+        output folder"""
+        log = mock.Mock()
+        write_report(['a\n', '1\n'], None, 'report.txt', "Report", log)
+        mock_open.assert_not_called()
+        log.info.assert_called_once_with("Report:\na\n1\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+from unittest import TestCase, main
+
+from analysis_fixtures import build_analysis
+from constants import T_METHOD_NONE
+from vectorized_engine import VectorizedEngine
+
+
+class TransformMethod(object):
+    """A transform method: a name, a transformer and a scaler"""
+
+    def __init__(self, name, transformer, scaler):
+        self.name = name
+        self.transformer = transformer
+        self.scaler = scaler
+
+
+class SubtractMean(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def transform(self, value, baseline_mean):
+        self.calls += 1
+        return value - baseline_mean
+
+
+class NoScale(object):
+
+    @staticmethod
+    def scale(value, baseline_stdev):
+        return value
+
+
+class DivideByStdev(object):
+
+    @staticmethod
+    def scale(value, baseline_stdev):
+        return value / baseline_stdev
+
+
+class TestVectorizedEngine(TestCase):
+
+    def assert_analyses_match(self, expected, actual):
+        """Check that two analyses of the same data produced exactly the
+        same results"""
+        for exp_ent, act_ent in zip(expected.entities, actual.entities):
+            self.assertEqual(exp_ent.name, act_ent.name)
+            self.assertEqual(exp_ent.score, act_ent.score,
+                             "Score differs for %s" % exp_ent.name)
+            exp_winners = exp_ent.winning_lists_by_category()
+            act_winners = act_ent.winning_lists_by_category()
+            self.assertEqual(list(exp_winners.keys()),
+                             list(act_winners.keys()))
+            for category in exp_winners:
+                self.assertEqual(exp_winners[category].name,
+                                 act_winners[category].name)
+            for exp_lst, act_lst in zip(expected.entity_lists,
+                                        actual.entity_lists):
+                self.assertEqual(exp_ent.raw_score_from_list(exp_lst),
+                                 act_ent.raw_score_from_list(act_lst))
+        for exp_lst, act_lst in zip(expected.entity_lists,
+                                    actual.entity_lists):
+            self.assertEqual(exp_lst.weight, act_lst.weight)
+            self.assertEqual(list(exp_lst.weights_list),
+                             list(act_lst.weights_list))
+
+    def test_results_match_object_iteration(self):
+        """Check that the VectorizedEngine gives exactly the same results as
+        the object-based iteration for each of the list types"""
+        for weight_function in ['none', 'exponential', 'polynomial']:
+            expected = build_analysis(weight_function)
+            expected.run_analysis()
+            actual = build_analysis(weight_function, VectorizedEngine())
+            actual.run_analysis()
+            self.assert_analyses_match(expected, actual)
+
+    def test_first_tied_list_wins_category(self):
+        """Check that when two lists in a category give an Entity the same
+        weight, the first of them is reported as the category winner"""
+        cross_validation = build_analysis('none', VectorizedEngine())
+        cross_validation.max_iterations = 1
+        cross_validation.run_analysis()
+        # After one iteration every unranked list has the same weight
+        entity = [x for x in cross_validation.entities if x.name == 'A'][0]
+        winners = entity.winning_lists_by_category()
+        self.assertEqual('List1', winners['CAT1'].name)
+        self.assertEqual('List3', winners['CAT2'].name)
+        self.assertEqual('List5', winners['CAT3'].name)
+
+    def test_final_corrected_scores_match_object_calculation(self):
+        """Check that the batched final corrected scores are exactly those
+        calculated Entity by Entity, and that each transformer and scaler
+        is only called once"""
+        methods = [TransformMethod('centred', SubtractMean(), NoScale()),
+                   TransformMethod('z', SubtractMean(), DivideByStdev())]
+        results = []
+        for engine in [None, VectorizedEngine()]:
+            cross_validation = build_analysis('exponential', engine)
+            cross_validation.transform_methods = methods
+            for idx, entity_list in enumerate(cross_validation.entity_lists):
+                entity_list.set_baseline(0.1 * idx, 1.0 + 0.5 * idx)
+            for method in methods:
+                method.transformer.calls = 0
+            cross_validation.run()
+            results.append(cross_validation)
+            if engine:
+                for method in methods:
+                    self.assertEqual(1, method.transformer.calls)
+        expected, actual = results
+        self.assert_analyses_match(expected, actual)
+        for exp_ent, act_ent in zip(expected.entities, actual.entities):
+            self.assertEqual(exp_ent.adjusted_scores, act_ent.adjusted_scores)
+            self.assertEqual(sorted(['centred', 'z', T_METHOD_NONE]),
+                             sorted(act_ent.adjusted_scores))
+
+
+if __name__ == '__main__':
+    main()
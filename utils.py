@@ -0,0 +1,29 @@
+"""
+Helpers shared by the collectors (of profiles, statistics, counters etc.)
+that report on an analysis
+"""
+import io
+import logging
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+
+def tab_separated_lines(columns, records):
+    """Return a header line naming the columns and a line for each record
+    (a dictionary with a value for every column), tab-separated"""
+    lines = ['\t'.join(columns) + '\n']
+    for record in records:
+        lines.append('\t'.join(str(record[x]) for x in columns) + '\n')
+    return lines
+
+
+def write_report(lines, output_folder, file_name, title, log=logger):
+    """Write the lines of a report to file_name in the output folder, or to
+    the log (under the title) if there is no output folder"""
+    if output_folder:
+        with io.open("{}{}".format(output_folder, file_name),
+                     'w') as out_stream:
+            out_stream.writelines(lines)
+    else:
+        log.info("{}:\n{}".format(title, ''.join(lines)))
@@ -0,0 +1,157 @@
+"""
+Code relating to the array-backed alternative to the object-by-object MAIC
+iteration
+"""
+import logging
+
+import numpy as np
+
+from constants import T_METHOD_NONE
+from cross_validation import POST_ITERATION_CALLBACK, SCORING_PHASE, \
+    WEIGHTING_PHASE
+from membership_matrix import MembershipMatrix
+
+logging.basicConfig()
+logger = logging.getLogger(__name__)
+
+
+class VectorizedEngine(object):
+    """Perform the iterations of a CrossValidation analysis using NumPy
+    array operations on a MembershipMatrix rather than asking every Entity
+    to walk its lists. The results (Entity scores, per-list weights and
+    category winners; EntityList weights and weights_list values) are the
+    same as those produced by the object-based iteration.
+
+    EntityList weights are still calculated (and curves still fitted) by the
+    EntityList objects themselves."""
+
+    def __init__(self):
+        self.matrix = None
+        self.scores = None
+        self.weights = None
+        self.winners = None
+
+    def prepare(self, cross_validation):
+        """Compile the Entity/EntityList graph of the CrossValidation
+        analysis. Called once at the start of each analysis, after
+        everything has been reset."""
+        self.matrix = MembershipMatrix(
+            cross_validation.entities + cross_validation._fake_entities,
+            cross_validation.entity_lists)
+        self.scores = None
+        self.weights = None
+        self.winners = None
+        logger.info("Compiled {} memberships for {} entities and {} "
+                    "lists".format(self.matrix.membership_count,
+                                   self.matrix.entity_count,
+                                   self.matrix.list_count))
+
+    def calculate_new_scores(self, entity_count=None):
+        """Calculate new scores for every Entity from the current list
+        weights and copy them back to the (first entity_count) Entity
+        objects"""
+        matrix = self.matrix
+        if matrix.list_count:
+            self.weights = np.concatenate(
+                [x.weights_vector() for x in matrix.entity_lists])
+        else:
+            self.weights = np.zeros(0)
+        maxima, self.winners = matrix.category_maxima(self.weights)
+        self.scores = matrix.entity_scores(maxima)
+        for entity, score in zip(matrix.entities[:entity_count],
+                                 self.scores.tolist()):
+            entity.score = score
+
+    def calculate_final_corrected_scores(self, cross_validation):
+        """Do the work of Entity.calculate_final_corrected_scores for every
+        Entity of the analysis at once: recalculate the scores from the
+        final list weights and then, for each of the transform methods,
+        transform and scale the weight of every (Entity, list) membership
+        and sum the per-category maxima.
+
+        Each method's transformer and scaler is called once, with NumPy
+        arrays holding the weight and the list baselines of every
+        membership, so they must work element by element (as NumPy
+        arithmetic does)."""
+        matrix = self.matrix
+        methods = cross_validation.transform_methods or []
+        entity_count = len(cross_validation.entities)
+        self.calculate_new_scores(entity_count)
+        self.synchronise(entity_count)
+        adjusted_scores = [{} for _ in range(entity_count)]
+        if methods:
+            means = np.array([x.base_score_mean for x in matrix.entity_lists],
+                             dtype=float)[matrix.list_ids]
+            stdevs = np.array([x.base_score_stdev
+                               for x in matrix.entity_lists],
+                              dtype=float)[matrix.list_ids]
+        for method in methods:
+            transformed = method.transformer.transform(self.weights, means)
+            scaled = method.scaler.scale(transformed, stdevs)
+            scaled = np.broadcast_to(np.asarray(scaled, dtype=float),
+                                     self.weights.shape)
+            maxima, _ = matrix.category_maxima(scaled)
+            sums = matrix.entity_scores(maxima)
+            for scores, value in zip(adjusted_scores, sums.tolist()):
+                scores[method.name] = value
+        for entity, scores in zip(cross_validation.entities,
+                                  adjusted_scores):
+            scores[T_METHOD_NONE] = entity.score
+            entity.adjusted_scores = scores
+
+    def calculate_new_weights(self):
+        """Calculate new weights for every EntityList from the current
+        Entity scores, leaving their weights distributions to be fitted
+        afterwards (see CrossValidation.fit_deferred_lists). Return the
+        largest absolute change in list weight"""
+        delta = 0
+        totals = self.matrix.list_totals(self.scores)
+        for entity_list, total in zip(self.matrix.entity_lists,
+                                      totals.tolist()):
+            delta = max(delta, abs(entity_list.apply_total_entity_weight(
+                total, fit_curve=False)))
+        return delta
+
+    def iterate(self, cross_validation):
+        """Perform one iteration of the analysis and return the largest
+        absolute change in list weight"""
+        with cross_validation.phase(SCORING_PHASE):
+            self.calculate_new_scores()
+        with cross_validation.phase(WEIGHTING_PHASE):
+            delta = self.calculate_new_weights()
+        cross_validation.fit_deferred_lists(self.matrix.entity_lists)
+        if cross_validation.plotter or \
+                cross_validation.callbacks[POST_ITERATION_CALLBACK]:
+            self.synchronise()
+        return delta
+
+    def finish(self, cross_validation):
+        """Copy everything back to the Entity objects at the end of the
+        analysis"""
+        self.synchronise()
+
+    def synchronise(self, entity_count=None):
+        """Copy the per-list weights and the category winners for the most
+        recently calculated scores back to the (first entity_count) Entity
+        objects so that they can be queried in the usual way (e.g. by the
+        dumpers and plotters)"""
+        if self.scores is None:
+            return
+        matrix = self.matrix
+        weights = [{} for _ in range(matrix.entity_count)]
+        for entity_id, list_id, weight in zip(matrix.entity_ids.tolist(),
+                                              matrix.list_ids.tolist(),
+                                              self.weights.tolist()):
+            weights[entity_id][matrix.entity_lists[list_id]] = weight
+        winners = [{} for _ in range(matrix.entity_count)]
+        group_lists = matrix.list_ids[self.winners].tolist()
+        group_entities = matrix.group_entities.tolist()
+        for group in matrix.group_sum_order.tolist():
+            entity_list = matrix.entity_lists[group_lists[group]]
+            winners[group_entities[group]][entity_list.category] = \
+                entity_list
+        for entity, score, entity_weights, entity_winners in zip(
+                matrix.entities[:entity_count], self.scores.tolist(),
+                weights, winners):
+            entity.set_calculated_score(score, entity_weights,
+                                        entity_winners)